@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Benchmark suite for scripts/guard/command-engine.py.
+
+Measures policy compilation (from JSON and from the `policy compile` artifact),
+tokenize_chain, evaluate_segment and analyze against synthetic policies
+(10 / 100 / 1k / 10k rules), chains of 1-50 segments and pathological quoting,
+plus execute against no-op binaries. `analyze` with input `program-rules` uses the
+same policies with their program-anchored rules written as program rules. The
+`split` suite runs split_chain on chains of up to 500 segments next to
+`shlex-reference`, the shlex tokenizer plus per-segment shlex.split that analyze +
+execute used before. Each case reports per-call p50/p99 latency, throughput and
+peak traced memory. Output is JSON so runs can be diffed between releases:
+
+  command-engine-bench.py --output before.json
+  command-engine-bench.py --output after.json --compare before.json
+
+The decision cache is disabled while measuring unless --cache is given, so the
+numbers reflect a cold rule scan.
+"""
+import argparse
+import importlib.util
+import json
+import pathlib
+import platform
+import random
+import shlex
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ENGINE_PATH = pathlib.Path(__file__).resolve().parent.parent / 'guard' / 'command-engine.py'
+
+RULE_COUNTS = [10, 100, 1000, 10000]
+CHAIN_LENGTHS = [1, 5, 10, 25, 50]
+EXECUTE_CHAIN_LENGTHS = [1, 5, 10]
+SPLIT_CHAIN_LENGTHS = [10, 100, 500]
+
+
+def load_engine():
+    spec = importlib.util.spec_from_file_location('command_engine', ENGINE_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def synthetic_policy(n: int, seed: int = 0) -> dict:
+    """n rules shaped like real policies: mostly program-anchored, some free-form."""
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(n):
+        prog = f'tool{i}'
+        kind = i % 10
+        if kind < 4:
+            pat = rf'^{prog}\b'
+        elif kind < 7:
+            pat = rf'^{prog}\s+(status|list|show|get)\b'
+        elif kind < 9:
+            pat = rf'\b{prog}\s+--(force|all)\b'
+        else:
+            pat = rf'^[a-z]+{i}(\s|$)'
+        rules.append({'id': f'r{i}', 'pattern': pat, 'decision': rnd.choice(['approved', 'approved', 'ask', 'rejected'])})
+    rules.append({'id': 'noop', 'pattern': r'^(true|:)$', 'decision': 'approved'})
+    return {'rules': rules}
+
+
+def program_policy(n: int, seed: int = 0) -> dict:
+    """synthetic_policy with its program-anchored rules written as program rules (program/argsPattern)."""
+    policy = synthetic_policy(n, seed)
+    for i, rule in enumerate(policy['rules'][:n]):
+        kind = i % 10
+        if kind < 4:
+            policy['rules'][i] = {'id': rule['id'], 'program': f'tool{i}', 'decision': rule['decision']}
+        elif kind < 7:
+            policy['rules'][i] = {'id': rule['id'], 'program': f'tool{i}', 'argsPattern': r'^(status|list|show|get)\b',
+                                  'decision': rule['decision']}
+    return policy
+
+
+def synthetic_chain(n_rules: int, n_segments: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    segs = []
+    for _ in range(n_segments):
+        prog = f'tool{rnd.randrange(max(n_rules, 1))}'
+        segs.append(f'{prog} {rnd.choice(["status", "list", "--force", "show"])} --flag value{rnd.randrange(1000)} path/to/file')
+    ops = [rnd.choice([' ; ', ' && ']) for _ in range(n_segments - 1)]
+    out = segs[0]
+    for op, seg in zip(ops, segs[1:]):
+        out += op + seg
+    return out
+
+
+def pathological_quoting(n_segments: int) -> str:
+    seg = 'echo "a \\"quoted\\" word" \'single "double" inside\' back\\ slash\\ ed "$HOME" \'\' "" x"y"\'z\''
+    return ' ; '.join([seg] * n_segments)
+
+
+def shlex_split_chain(command: str) -> list[list[str]]:
+    """The pre-split_chain path: a shlex pass to find segments, then shlex.split of each."""
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=';&|')
+    lexer.whitespace_split = True
+    lexer.commenters = ''
+    segments, cur = [], []
+    for t in lexer:
+        if t in (';', '&&'):
+            segments.append(' '.join(cur))
+            cur = []
+        else:
+            cur.append(t)
+    segments.append(' '.join(cur))
+    return [shlex.split(seg) for seg in segments]
+
+
+def measure(fn, min_iters: int, min_seconds: float) -> dict:
+    fn()  # warm-up
+    samples: list[int] = []
+    started = time.perf_counter()
+    while len(samples) < min_iters or time.perf_counter() - started < min_seconds:
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - t0)
+        if len(samples) >= min_iters * 50:
+            break
+    samples.sort()
+    total = sum(samples)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'iterations': len(samples),
+        'p50Us': round(samples[len(samples) // 2] / 1000, 2),
+        'p99Us': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] / 1000, 2),
+        'meanUs': round(statistics.fmean(samples) / 1000, 2),
+        'perSecond': round(len(samples) / (total / 1e9), 1) if total else None,
+        'peakKiB': round(peak / 1024, 1),
+    }
+
+
+def use_policy(engine, policy: dict, tmpdir: pathlib.Path, cache: bool):
+    path = tmpdir / f'policy-{len(policy["rules"])}.json'
+    path.write_text(json.dumps(policy))
+    engine.CMD_POLICY_PATH = path
+    engine._compiled_policy = None
+    engine.DECISION_CACHE = engine.DecisionCache(4096 if cache else 0)
+    return engine.current_policy()
+
+
+def run(args) -> dict:
+    engine = load_engine()
+    rule_counts = [n for n in RULE_COUNTS if n <= args.max_rules]
+    min_iters, min_seconds = (20, 0.05) if args.quick else (200, 0.5)
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpdir = pathlib.Path(tmp)
+
+        for n_seg in CHAIN_LENGTHS:
+            cmd = synthetic_chain(100, n_seg)
+            results.append({'suite': 'tokenize', 'input': 'synthetic', 'segments': n_seg,
+                            **measure(lambda: engine.tokenize_chain(cmd), min_iters, min_seconds)})
+            cmd_q = pathological_quoting(n_seg)
+            results.append({'suite': 'tokenize', 'input': 'quoting', 'segments': n_seg,
+                            **measure(lambda: engine.tokenize_chain(cmd_q), min_iters, min_seconds)})
+
+        for n_seg in SPLIT_CHAIN_LENGTHS:
+            for name, cmd in (('synthetic', synthetic_chain(100, n_seg)), ('quoting', pathological_quoting(n_seg))):
+                results.append({'suite': 'split', 'input': name, 'segments': n_seg,
+                                **measure(lambda: engine.split_chain(cmd), min_iters, min_seconds)})
+                results.append({'suite': 'split', 'input': f'{name}-shlex-reference', 'segments': n_seg,
+                                **measure(lambda: shlex_split_chain(cmd), min_iters, min_seconds)})
+
+        for n_rules in rule_counts:
+            policy = synthetic_policy(n_rules)
+            t0 = time.perf_counter()
+            compiled = use_policy(engine, policy, tmpdir, args.cache)
+            results.append({'suite': 'compile', 'rules': n_rules,
+                            'seconds': round(time.perf_counter() - t0, 6)})
+            if hasattr(engine, 'compile_policy'):
+                path = engine.CMD_POLICY_PATH
+                engine.compile_policy(path)
+                source = path.read_bytes()
+                t0 = time.perf_counter()
+                engine.compile_policy_source(source, None, engine.policy_artifact_path(path))
+                results.append({'suite': 'compile', 'input': 'artifact', 'rules': n_rules,
+                                'seconds': round(time.perf_counter() - t0, 6)})
+
+            seg = synthetic_chain(n_rules, 1, seed=1)
+            results.append({'suite': 'evaluate_segment', 'rules': n_rules, 'segments': 1,
+                            **measure(lambda: engine.evaluate_segment(seg, compiled.rules, compiled.matcher),
+                                      min_iters, min_seconds)})
+
+            for n_seg in CHAIN_LENGTHS:
+                cmd = synthetic_chain(n_rules, n_seg, seed=n_seg)
+                results.append({'suite': 'analyze', 'input': 'synthetic', 'rules': n_rules, 'segments': n_seg,
+                                **measure(lambda: engine.analyze(cmd), min_iters, min_seconds)})
+            cmd_q = pathological_quoting(10)
+            results.append({'suite': 'analyze', 'input': 'quoting', 'rules': n_rules, 'segments': 10,
+                            **measure(lambda: engine.analyze(cmd_q), min_iters, min_seconds)})
+
+            use_policy(engine, program_policy(n_rules), tmpdir, args.cache)
+            cmd = synthetic_chain(n_rules, 10, seed=10)
+            results.append({'suite': 'analyze', 'input': 'program-rules', 'rules': n_rules, 'segments': 10,
+                            **measure(lambda: engine.analyze(cmd), min_iters, min_seconds)})
+
+        if not args.skip_execute:
+            use_policy(engine, synthetic_policy(100), tmpdir, args.cache)
+            for n_seg in EXECUTE_CHAIN_LENGTHS:
+                cmd = ' ; '.join(['true'] * n_seg)
+                res = engine.execute(cmd)
+                if not res.get('ok'):
+                    raise SystemExit(f'execute benchmark setup failed: {json.dumps(res)[:500]}')
+                results.append({'suite': 'execute', 'input': 'true', 'rules': 100, 'segments': n_seg,
+                                **measure(lambda: engine.execute(cmd), max(5, min_iters // 10), min_seconds)})
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine': str(ENGINE_PATH),
+            'quick': args.quick,
+            'decisionCache': args.cache,
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'results': results,
+    }
+
+
+def case_key(r: dict) -> tuple:
+    return (r['suite'], r.get('input', ''), r.get('rules', 0), r.get('segments', 0))
+
+
+def compare(current: dict, baseline: dict) -> list[dict]:
+    """p50 ratio (current / baseline) for every case present in both runs."""
+    base = {case_key(r): r for r in baseline.get('results', [])}
+    rows = []
+    for r in current['results']:
+        b = base.get(case_key(r))
+        if not b or 'p50Us' not in r or not b.get('p50Us'):
+            continue
+        rows.append({'suite': r['suite'], 'input': r.get('input'), 'rules': r.get('rules'),
+                     'segments': r.get('segments'), 'p50Us': r['p50Us'], 'baselineP50Us': b['p50Us'],
+                     'ratio': round(r['p50Us'] / b['p50Us'], 3)})
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description='Benchmark command-engine analyze/execute paths')
+    ap.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    ap.add_argument('--compare', help='baseline JSON from a previous run; adds per-case p50 ratios')
+    ap.add_argument('--quick', action='store_true', help='fewer iterations (smoke run)')
+    ap.add_argument('--max-rules', type=int, default=max(RULE_COUNTS))
+    ap.add_argument('--cache', action='store_true', help='leave the decision cache enabled')
+    ap.add_argument('--skip-execute', action='store_true')
+    args = ap.parse_args()
+
+    report = run(args)
+    if args.compare:
+        report['comparison'] = compare(report, json.loads(pathlib.Path(args.compare).read_text()))
+
+    text = json.dumps(report, indent=2) + '\n'
+    if args.output:
+        pathlib.Path(args.output).write_text(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
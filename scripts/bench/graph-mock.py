@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""Local stand-in for Microsoft Graph and the login endpoints, for exercising m365.py.
+
+Serves a synthetic mailbox over plain HTTP: mail folders and messages (listing with
+$top/$skip paging, by id, and messages/delta), attachments and the MIME of messages and
+attachments ($value, with an ETag, Range and If-Range), calendars and their calendarView (and
+calendarView/delta), JSON $batch, and the OAuth token/devicecode endpoints. It can
+misbehave like a busy tenant:
+
+- --limit N: requests beyond N in flight get 429 with Retry-After (--retry-after);
+- --error-rate P: that fraction of requests fail with 503 or 504;
+- --drop-rate P: that fraction of $value downloads stop half-way (connection closed);
+- --latency MS: added to every response.
+
+  graph-mock.py --port 8765 --limit 4 --error-rate 0.02 &
+  M365_GRAPH_BASE=http://127.0.0.1:8765/v1.0 M365_LOGIN_BASE=http://127.0.0.1:8765 m365 calendar events --all-calendars
+
+m365 still needs its O365 config and a token file (any access_token is accepted). The
+first stdout line is {"ok": true, "url": ...}; GET /_stats returns request counters.
+"""
+import argparse
+import datetime as dt
+import hashlib
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+
+def mailbox(folders: int, messages: int, calendars: int, events: int, attachment_size: int) -> dict:
+    now = dt.datetime.now(dt.timezone.utc).replace(minute=0, second=0, microsecond=0)
+    box = {'folders': [], 'messages': {}, 'attachments': {}, 'calendars': [], 'events': {}}
+    names = ['Inbox', 'Archive', 'Sent Items', 'Drafts', 'Deleted Items']
+    for f in range(folders):
+        fid = 'inbox' if f == 0 else f'folder-{f}'
+        box['folders'].append({'id': fid, 'displayName': names[f] if f < len(names) else f'Folder {f}'})
+        box['messages'][fid] = [{
+            'id': f'{fid}-m{i}',
+            'subject': f'Message {i} in {fid}',
+            'from': {'emailAddress': {'address': f'sender{i % 17}@example.com'}},
+            'receivedDateTime': (now - dt.timedelta(minutes=37 * i)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'isRead': i % 3 != 0,
+            'importance': 'normal',
+            'hasAttachments': i % 5 == 0,
+            'bodyPreview': f'Preview of message {i}',
+            'body': {'contentType': 'text', 'content': f'Body of message {i} in {fid}.'},
+        } for i in range(messages)]
+        for m in box['messages'][fid]:
+            if m['hasAttachments']:
+                mid = m['id']
+                box['attachments'][mid] = [
+                    {'@odata.type': '#microsoft.graph.fileAttachment', 'id': f'{mid}-a0', 'name': 'report.pdf',
+                     'contentType': 'application/pdf', 'size': attachment_size, 'isInline': False},
+                    {'@odata.type': '#microsoft.graph.fileAttachment', 'id': f'{mid}-a1', 'name': 'report.pdf',
+                     'contentType': 'application/pdf', 'size': attachment_size // 3, 'isInline': False},
+                    {'@odata.type': '#microsoft.graph.itemAttachment', 'id': f'{mid}-a2', 'name': 'Forwarded message',
+                     'contentType': None, 'size': 2048, 'isInline': False},
+                    {'@odata.type': '#microsoft.graph.referenceAttachment', 'id': f'{mid}-a3', 'name': 'Shared link',
+                     'contentType': None, 'size': 0, 'isInline': False},
+                ]
+    for c in range(calendars):
+        cid = f'calendar-{c}'
+        box['calendars'].append({'id': cid, 'name': 'Calendar' if c == 0 else f'Calendar {c}', 'isDefaultCalendar': c == 0})
+        box['events'][cid] = [{
+            'id': f'{cid}-e{i}',
+            'subject': f'Event {i} in {cid}',
+            'start': {'dateTime': (now + dt.timedelta(hours=5 * i + c)).strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'},
+            'end': {'dateTime': (now + dt.timedelta(hours=5 * i + c + 1)).strftime('%Y-%m-%dT%H:%M:%S.0000000'), 'timeZone': 'UTC'},
+            'location': {'displayName': f'Room {i % 7}'},
+            'isAllDay': False,
+        } for i in range(events)]
+    return box
+
+
+def content(key: str, size: int) -> bytes:
+    # Deterministic bytes for an attachment, so downloads can be checked.
+    block = hashlib.sha256(key.encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def mime(subject: str, body: str) -> bytes:
+    return (f'From: sender@example.com\r\nTo: user@example.com\r\nSubject: {subject}\r\n'
+            f'MIME-Version: 1.0\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n{body}\r\n').encode()
+
+
+def select(item: dict, query: dict) -> dict:
+    fields = query.get('$select')
+    if not fields:
+        return item
+    return {k: v for k, v in item.items() if k in fields.split(',') or k == 'id'}
+
+
+class MockGraph:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.box = mailbox(args.folders, args.messages, args.calendars, args.events, args.attachment_size)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'maxInflight': 0, 'batchItems': 0, 'tokenRequests': 0,
+                      'dropped': 0, 'rangeRequests': 0}
+        self.base = ''
+
+    def admit(self) -> tuple[int, dict] | None:
+        """None to serve the request, or the (status, headers) of a throttle/failure."""
+        with self.lock:
+            self.stats['requests'] += 1
+            if self.inflight >= self.args.limit:
+                self.stats['throttled'] += 1
+                return 429, {'Retry-After': str(self.args.retry_after)}
+            if random.random() < self.args.error_rate:
+                self.stats['errors'] += 1
+                return random.choice([503, 504]), {}
+            self.inflight += 1
+            self.stats['maxInflight'] = max(self.stats['maxInflight'], self.inflight)
+        return None
+
+    def done(self) -> None:
+        with self.lock:
+            self.inflight -= 1
+
+    def page(self, items: list, path: str, query: dict, default_top: int = 10) -> dict:
+        top = int(query.get('$top', default_top))
+        skip = int(query.get('$skip', 0))
+        out = {'value': [select(i, query) for i in items[skip:skip + top]]}
+        if skip + top < len(items):
+            out['@odata.nextLink'] = f'{self.base}{path}?' + urllib.parse.urlencode({**query, '$skip': skip + top})
+        return out
+
+    def delta(self, items: list, path: str, query: dict, prefer: str) -> dict:
+        # A snapshot in pages of odata.maxpagesize; the deltaLink then returns no changes.
+        if '$deltatoken' in query:
+            return {'value': [], '@odata.deltaLink': f'{self.base}{path}?' + urllib.parse.urlencode(query)}
+        size = int(prefer.partition('odata.maxpagesize=')[2].split(',')[0] or 100)
+        skip = int(query.pop('$skiptoken', 0))
+        out = {'value': [select(i, query) for i in items[skip:skip + size]]}
+        if skip + size < len(items):
+            out['@odata.nextLink'] = f'{self.base}{path}?' + urllib.parse.urlencode({**query, '$skiptoken': skip + size})
+        else:
+            out['@odata.deltaLink'] = f'{self.base}{path}?' + urllib.parse.urlencode({**query, '$deltatoken': 'latest'})
+        return out
+
+    def get(self, path: str, query: dict, prefer: str = '') -> tuple[int, dict]:
+        parts = path.strip('/').split('/')
+        if parts[:1] != ['v1.0']:
+            return 404, {'error': {'code': 'NotFound'}}
+        parts = parts[1:]
+        box = self.box
+        if parts == ['me', 'mailFolders']:
+            return 200, {'value': box['folders']}
+        if parts == ['me', 'messages']:
+            items = sorted((m for ms in box['messages'].values() for m in ms), key=lambda m: m['receivedDateTime'], reverse=True)
+            return 200, self.page(items, path, query)
+        if parts[:2] == ['me', 'messages'] and len(parts) == 3:
+            m = self.message(parts[2])
+            if m is None:
+                return 404, {'error': {'code': 'ErrorItemNotFound'}}
+            return 200, select(m, query)
+        if parts[:2] == ['me', 'messages'] and parts[3:] == ['attachments']:
+            if self.message(parts[2]) is None:
+                return 404, {'error': {'code': 'ErrorItemNotFound'}}
+            return 200, {'value': [select(a, query) | {'@odata.type': a['@odata.type']} for a in box['attachments'].get(parts[2], [])]}
+        if parts[:2] == ['me', 'mailFolders'] and len(parts) >= 4 and parts[3] == 'messages':
+            items = box['messages'].get('inbox' if parts[2].lower() == 'inbox' else parts[2])
+            if items is None:
+                return 404, {'error': {'code': 'ErrorItemNotFound'}}
+            if parts[4:] == ['delta']:
+                return 200, self.delta(items, path, query, prefer)
+            return 200, self.page(items, path, query)
+        if parts == ['me', 'calendars']:
+            return 200, {'value': [select(c, query) for c in box['calendars']]}
+        if parts[:2] == ['me', 'calendarView'] or (parts[:2] == ['me', 'calendars'] and parts[3:4] == ['calendarView']):
+            cid = parts[2] if parts[1] == 'calendars' else box['calendars'][0]['id']
+            if cid not in box['events']:
+                return 404, {'error': {'code': 'ErrorItemNotFound'}}
+            start, end = query.get('startDateTime', ''), query.get('endDateTime', '9999')
+            items = [e for e in box['events'][cid] if e['end']['dateTime'] > start[:19] and e['start']['dateTime'] < end[:19]]
+            if parts[-1] == 'delta':
+                return 200, self.delta(items, path, query, prefer)
+            return 200, self.page(items, path, query)
+        return 404, {'error': {'code': 'NotFound', 'path': path}}
+
+    def message(self, mid: str) -> dict | None:
+        for ms in self.box['messages'].values():
+            for m in ms:
+                if m['id'] == mid:
+                    return m
+        return None
+
+    def value(self, path: str) -> bytes | None:
+        """Body of a message or attachment $value path, or None when there is no such item."""
+        parts = path.strip('/').split('/')[1:]
+        if parts[:2] != ['me', 'messages'] or parts[-1] != '$value':
+            return None
+        m = self.message(parts[2]) if len(parts) > 2 else None
+        if m is None:
+            return None
+        if len(parts) == 4:
+            return mime(m['subject'], m['body']['content'])
+        if len(parts) == 6 and parts[3] == 'attachments':
+            for a in self.box['attachments'].get(m['id'], []):
+                if a['id'] == parts[4] and a['@odata.type'].endswith('fileAttachment'):
+                    return content(a['id'], a['size'])
+                if a['id'] == parts[4] and a['@odata.type'].endswith('itemAttachment'):
+                    return mime(f'Fwd: {m["subject"]}', 'Attached message.')
+        return None
+
+    def batch(self, body: dict) -> tuple[int, dict]:
+        requests = body.get('requests') or []
+        if len(requests) > 20:
+            return 400, {'error': {'code': 'BadRequest', 'message': 'at most 20 requests per batch'}}
+        responses = []
+        for r in requests:
+            with self.lock:
+                self.stats['batchItems'] += 1
+                throttled = random.random() < self.args.error_rate
+            if throttled:
+                responses.append({'id': r.get('id'), 'status': 429, 'headers': {'Retry-After': str(self.args.retry_after)},
+                                  'body': {'error': {'code': 'TooManyRequests'}}})
+                continue
+            u = urllib.parse.urlsplit(r.get('url', ''))
+            status, payload = self.get('/v1.0' + u.path, dict(urllib.parse.parse_qsl(u.query)))
+            responses.append({'id': r.get('id'), 'status': status, 'body': payload})
+        return 200, {'responses': responses}
+
+
+def handler(mock: MockGraph) -> type:
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def reply(self, status: int, obj: dict, headers: dict | None = None) -> None:
+            raw = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def send_value(self, data: bytes) -> None:
+            start = 0
+            etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+            rng = self.headers.get('Range') or ''
+            if_range = self.headers.get('If-Range')
+            if rng.startswith('bytes=') and rng.endswith('-') and if_range in (None, etag):
+                start = int(rng[6:-1])
+                with mock.lock:
+                    mock.stats['rangeRequests'] += 1
+                if start >= len(data):
+                    return self.reply(416, {'error': {'code': 'RequestedRangeNotSatisfiable'}},
+                                      {'Content-Range': f'bytes */{len(data)}'})
+            body = data[start:]
+            self.send_response(206 if start else 200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('ETag', etag)
+            if start:
+                self.send_header('Content-Range', f'bytes {start}-{len(data) - 1}/{len(data)}')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            with mock.lock:
+                drop = random.random() < mock.args.drop_rate
+                mock.stats['dropped'] += drop
+            try:
+                if drop:
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                for i in range(0, len(body), 1 << 16):
+                    self.wfile.write(body[i:i + (1 << 16)])
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True  # client gave up (e.g. killed mid-download)
+
+        def serve(self, method: str) -> None:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else b''
+            u = urllib.parse.urlsplit(self.path)
+            if u.path == '/_stats':
+                with mock.lock:
+                    return self.reply(200, dict(mock.stats))
+            if u.path.endswith('/oauth2/v2.0/token'):
+                with mock.lock:
+                    mock.stats['tokenRequests'] += 1
+                    n = mock.stats['tokenRequests']
+                time.sleep(mock.args.latency / 1000)
+                # A new refresh token each time, as Entra ID rotates them.
+                return self.reply(200, {'access_token': f'mock-access-token-{n}', 'refresh_token': f'mock-refresh-token-{n}',
+                                        'token_type': 'Bearer', 'expires_in': 3600})
+            if u.path.endswith('/oauth2/v2.0/devicecode'):
+                return self.reply(200, {'device_code': 'mock', 'interval': 1, 'expires_in': 60,
+                                        'message': 'Mock sign-in: nothing to do.'})
+            refused = mock.admit()
+            if refused:
+                status, headers = refused
+                return self.reply(status, {'error': {'code': 'TooManyRequests' if status == 429 else 'ServiceUnavailable'}}, headers)
+            try:
+                if mock.args.latency:
+                    time.sleep(mock.args.latency / 1000)
+                data = mock.value(u.path) if method == 'GET' and u.path.endswith('/$value') else None
+                if data is not None:
+                    return self.send_value(data)
+                if method == 'POST' and u.path == '/v1.0/$batch':
+                    status, payload = mock.batch(json.loads(body or b'{}'))
+                elif method == 'GET':
+                    status, payload = mock.get(u.path, dict(urllib.parse.parse_qsl(u.query)), self.headers.get('Prefer') or '')
+                else:
+                    status, payload = 405, {'error': {'code': 'MethodNotAllowed'}}
+            finally:
+                mock.done()
+            self.reply(status, payload)
+
+        def do_GET(self) -> None:
+            self.serve('GET')
+
+        def do_POST(self) -> None:
+            self.serve('POST')
+
+    return Handler
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description='Serve a synthetic Microsoft Graph mailbox over HTTP')
+    ap.add_argument('--port', type=int, default=0, help='default: any free port')
+    ap.add_argument('--limit', type=int, default=4, help='requests in flight before answering 429')
+    ap.add_argument('--retry-after', type=float, default=1, help='seconds in the Retry-After of a 429')
+    ap.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests (and $batch items) that fail transiently')
+    ap.add_argument('--drop-rate', type=float, default=0.0, help='fraction of $value downloads cut off half-way')
+    ap.add_argument('--latency', type=float, default=20, help='milliseconds added to each response')
+    ap.add_argument('--folders', type=int, default=3)
+    ap.add_argument('--messages', type=int, default=250, help='messages per folder')
+    ap.add_argument('--calendars', type=int, default=3)
+    ap.add_argument('--events', type=int, default=60, help='events per calendar')
+    ap.add_argument('--attachment-size', type=int, default=1 << 20, help='bytes of the largest attachment of a message')
+    ap.add_argument('--seed', type=int, help='seed for the simulated failures')
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    mock = MockGraph(args)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', args.port), handler(mock))
+    server.daemon_threads = True
+    host, port = server.server_address[:2]
+    mock.base = f'http://{host}:{port}'
+    print(json.dumps({'ok': True, 'url': f'{mock.base}/v1.0', 'login': mock.base}), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Startup-time budget for the guard/worker CLI entry points.
+
+Runs each entry point the way agents call it (command-engine through its cached-bytecode
+wrapper against a throwaway daemon and in-process, m365 `auth status`, the two Bitwarden
+helpers against a stub `bw`) and measures:
+
+- importMs: total of the top-level `-X importtime` cumulative times, minus the same total
+  for `python3 -c pass`, i.e. what the entry point itself imports;
+- overheadMs: median wall time minus that of `python3 -c pass`.
+
+Each is compared with the case's budget; any case over budget makes the exit status 1, so
+this can gate a change that pulls a heavy module back onto a hot path:
+
+  startup-bench.py --output startup.json
+  startup-bench.py --budget m365-auth-status=20 --scale 1.5
+
+Everything runs in a temporary directory (socket, audit log, O365 config); no network.
+"""
+import argparse
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS = pathlib.Path(__file__).resolve().parent.parent
+ENGINE = SCRIPTS / 'guard' / 'command-engine.py'
+
+# Milliseconds. About 1.5x the medians on a 1-CPU container (whose run-to-run noise is
+# large); eagerly importing the modules that are now lazy put the engine client at ~52 ms
+# and m365 at ~76 ms of imports.
+BUDGETS = {
+    'command-engine-analyze': {'importMs': 40, 'overheadMs': 80},
+    'command-engine-analyze-local': {'importMs': 45, 'overheadMs': 100},
+    'm365-auth-status': {'importMs': 40, 'overheadMs': 70},
+    'get-email-password': {'importMs': 35, 'overheadMs': 70},
+    'fetch-o365-config': {'importMs': 40, 'overheadMs': 80},
+}
+
+
+def cases() -> list[tuple[str, list[str]]]:
+    py = sys.executable
+    return [
+        ('command-engine-analyze', ['bash', str(SCRIPTS / 'guard' / 'command-engine'), 'analyze', 'ls -la']),
+        ('command-engine-analyze-local', ['bash', str(SCRIPTS / 'guard' / 'command-engine'), 'analyze', 'ls -la', '--local']),
+        ('m365-auth-status', ['bash', str(SCRIPTS / 'worker' / 'm365'), 'auth', 'status']),
+        ('get-email-password', [py, str(SCRIPTS / 'worker' / 'get-email-password.py')]),
+        ('fetch-o365-config', [py, str(SCRIPTS / 'worker' / 'fetch-o365-config.py')]),
+    ]
+
+
+def fixture_env(tmp: pathlib.Path) -> dict[str, str]:
+    bindir = tmp / 'bin'
+    bindir.mkdir()
+    stub = bindir / 'bw'
+    stub.write_text('#!/bin/sh\nexit 1\n')
+    stub.chmod(0o755)
+    config = tmp / 'o365-config.json'
+    config.write_text(json.dumps({'tenant_id': 'tenant', 'client_id': 'client', 'user_email': 'bench@example.com'}))
+    env = dict(os.environ)
+    # Measure with bytecode caching on, as in the containers.
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env.pop('PYTHONPROFILEIMPORTTIME', None)
+    env.update({
+        'PATH': f'{bindir}{os.pathsep}{env.get("PATH", "")}',
+        'GUARD_ENGINE_SOCKET': str(tmp / 'engine.sock'),
+        'GUARD_AUDIT_DIR': str(tmp / 'audit'),
+        'M365_CONFIG_PATH': str(config),
+        'XDG_CACHE_HOME': str(tmp / 'cache'),
+    })
+    return env
+
+
+def start_daemon(env: dict[str, str]) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, str(SCRIPTS / 'run-cached.py'), str(ENGINE), 'serve'],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    ready = proc.stdout.readline()
+    if not ready or not json.loads(ready).get('ok'):
+        proc.kill()
+        raise SystemExit(f'engine daemon did not start: {ready!r}')
+    return proc
+
+
+def import_total_ms(argv: list[str], env: dict[str, str]) -> float:
+    """Sum of top-level cumulative `-X importtime` entries (nested imports are included in them)."""
+    proc = subprocess.run(argv, env={**env, 'PYTHONPROFILEIMPORTTIME': '1'},
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[2].startswith(' ') or fields[2].startswith('  '):
+            continue
+        try:
+            total += int(fields[1])
+        except ValueError:
+            continue  # the header line
+    return total / 1000
+
+
+def wall_ms(argv: list[str], env: dict[str, str]) -> float:
+    t0 = time.perf_counter()
+    subprocess.run(argv, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return (time.perf_counter() - t0) * 1000
+
+
+def measure(argv: list[str], env: dict[str, str], runs: int) -> tuple[float, float]:
+    wall_ms(argv, env)  # warm-up: writes the bytecode cache
+    imports = statistics.median(import_total_ms(argv, env) for _ in range(runs))
+    wall = statistics.median(wall_ms(argv, env) for _ in range(runs))
+    return imports, wall
+
+
+def run(args) -> dict:
+    budgets = {name: dict(b) for name, b in BUDGETS.items()}
+    for spec in args.budget:
+        name, _, value = spec.partition('=')
+        if name not in budgets:
+            raise SystemExit(f'unknown case {name!r}; cases: {", ".join(budgets)}')
+        budgets[name]['importMs'] = float(value)
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmpdir = pathlib.Path(tmp)
+        env = fixture_env(tmpdir)
+        base_imports, base_wall = measure([sys.executable, '-c', 'pass'], env, args.runs)
+        daemon = start_daemon(env)
+        try:
+            for name, argv in cases():
+                if args.case and name not in args.case:
+                    continue
+                imports, wall = measure(argv, env, args.runs)
+                row = {
+                    'case': name,
+                    'importMs': round(max(imports - base_imports, 0), 2),
+                    'overheadMs': round(max(wall - base_wall, 0), 2),
+                    'wallMs': round(wall, 2),
+                    'budget': {k: round(v * args.scale, 2) for k, v in budgets[name].items()},
+                }
+                row['overBudget'] = [k for k, v in row['budget'].items() if row[k] > v]
+                results.append(row)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'runs': args.runs,
+            'baseline': {'importMs': round(base_imports, 2), 'wallMs': round(base_wall, 2)},
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        },
+        'ok': not any(r['overBudget'] for r in results),
+        'results': results,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description='Check CLI startup time against per-entry-point budgets')
+    ap.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    ap.add_argument('--runs', type=int, default=7, help='runs per case; medians are reported')
+    ap.add_argument('--case', action='append', help='only this case (repeatable)')
+    ap.add_argument('--budget', action='append', default=[], metavar='CASE=MS', help='override a case\'s importMs budget')
+    ap.add_argument('--scale', type=float, default=1.0, help='multiply every budget (slower machines)')
+    args = ap.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2) + '\n'
+    if args.output:
+        pathlib.Path(args.output).write_text(text)
+    else:
+        sys.stdout.write(text)
+    raise SystemExit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
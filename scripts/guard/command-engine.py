@@ -12,19 +12,138 @@ Goals:
 Policy file:
 - /home/node/.openclaw/bridge/command-policy.json
   {"rules": [{"id": "...", "pattern": "...", "decision": "approved|ask|rejected"}, ...]}
+- A rule may instead (or as well) name the program: {"id": "git-status", "program": "git",
+  "args": ["status"], "argsPattern": "^status( --short)?$", "decision": "approved"}.
+  It applies only to segments that run "program" and whose arguments start with "args".
+  A program given as a path matches only that exact argv[0]. A bare name matches argv[0]
+  exactly and, for "rejected" and "ask" rules, also by its basename (so a "git" rule
+  that rejects also covers /usr/bin/git and ./git). An "approved" rule for a bare name
+  only covers a path argv[0] that is absolute and resolves to the same file as the name
+  does on the engine's PATH, so approving "ls" never approves ./ls or /tmp/x/ls.
+  "argsPattern" is searched in the arguments joined by single spaces
+  and "pattern", if set, in the segment text. Program rules are indexed by program, so a
+  segment is only checked against its own program's rules plus the free-form ones.
+- A rule may set "parallel": true. Segments whose matched rules all set it are
+  parallel-safe: with `execute --parallel` (or GUARD_PARALLEL_SEGMENTS=1), runs of them
+  joined by ';' execute concurrently (GUARD_PARALLEL_MAX threads, default 4).
+
+Engine daemon:
+- `command-engine.py serve` keeps the compiled policy warm and answers analyze/execute
+  requests (one JSON object per line) on a Unix socket, reloading the policy when the
+  file changes. `analyze` / `execute` use the daemon when it is reachable and fall back
+  to in-process evaluation otherwise; output is the same either way. Commands executed
+  through the daemon run with the caller's environment, in the caller's cwd.
+- `command-engine.py analyze-batch [--input FILE]` reads JSONL commands (a JSON string or
+  {"command": "...", "id": ...} per line) and streams one analyze result per line, in
+  input order; large inputs are spread over a process pool. A throughput summary is
+  printed to stderr.
+- Segment output is streamed through fixed-size head/tail windows (stdout/stderr keep the
+  last 6000/4000 bytes; longer streams add *Head and *TruncatedBytes). Set
+  GUARD_OUTPUT_SPILL_DIR to also keep full copies on disk, and `execute --progress` to get
+  NDJSON progress events (including live output) on stderr.
+- Segment evaluations are memoized in an LRU keyed by policy fingerprint + segment text
+  (GUARD_DECISION_CACHE_SIZE entries, default 4096, 0 disables); `command-engine.py stats`
+  shows the daemon's hit/miss counters.
+- Rule profiling: with GUARD_PROFILE=1 every rule regex evaluation is counted and timed
+  (rules slower than GUARD_PROFILE_SLOW_MS, default 5, are flagged). The daemon writes
+  the counters to GUARD_PROFILE_TEXTFILE (Prometheus textfile format) every
+  GUARD_PROFILE_FLUSH_SECONDS. `command-engine.py profile` reports them from the daemon,
+  or replays a JSONL file of commands with `--input`.
+
+Regex safety:
+- Rule patterns are screened at load time for catastrophic-backtracking constructs
+  (nested or overlapping repeats such as `(a+)+`). Matching one segment is limited to
+  budgetMs of CPU time (default 50); a segment that exceeds it is rejected on its own,
+  without affecting later segments. With "onUnsafe": "reject" (default) a segment that
+  would have to evaluate a screened rule is rejected; with "skip" screened rules never
+  match. Segments longer than
+  maxSegmentLength (default 65536) are rejected. Set these under "regexSafety" in the
+  policy. `command-engine.py policy check [--file F]` lists invalid and unsafe rules;
+  `stats` includes the daemon's flagged rules.
+- `command-engine.py policy diff OLD NEW --corpus FILE` replays JSONL commands (the
+  audit log works as-is) against both policies and writes one line per command whose
+  decision or matched rule ids change, with a summary on stderr; it exits 1 when any
+  command changes. Only rules added by NEW are evaluated on top of OLD's results, and
+  results are memoized per distinct segment.
+
+Audit log:
+- Every analyze/execute (daemon or in-process) appends one JSON line to
+  GUARD_AUDIT_DIR/command-audit.jsonl (default /home/node/.openclaw/audit): actor, command,
+  decision, per-segment matched rules, exit codes and durations. The daemon batches writes
+  (group commit every GUARD_AUDIT_FLUSH_MS, default 20); the log rotates at
+  GUARD_AUDIT_MAX_BYTES (default 16 MiB), keeping GUARD_AUDIT_KEEP (default 5) old files.
+  GUARD_AUDIT=0 disables it. `command-engine.py audit query --since 7d --decision rejected`
+  (or `--slowest --event execute`, `--rule ID`, ...) answers from a SQLite index that is
+  brought up to date with new log lines on each query.
+
+Admission control:
+- Every spawned segment needs a slot under the global concurrency limit (maxConcurrent,
+  default twice the CPU count) and under each cap that applies to it: its program in
+  "programs" (e.g. {"docker": 1}) and any matched rule with "maxConcurrent". Segments
+  that cannot start wait in a FIFO queue for up to maxQueueWaitMs (default 30000), then
+  fail with admission_timeout; with maxQueue (default 64) already waiting they fail at
+  once with admission_queue_full. Set these under "scheduler" in the policy. Limits span
+  all clients of the daemon; `stats` shows running/queued counts and queue wait times.
+
+Timeouts:
+- A chain shares one deadline, GUARD_EXECUTE_TIMEOUT seconds (default 300) or
+  `execute --timeout`; each segment gets what is left of it, at most 120 s. A segment
+  runs in its own process group, and on timeout the whole group is sent SIGTERM, then
+  SIGKILL. Segments that would start after the deadline fail with
+  chain_deadline_exceeded (exit 124) without running. Every result carries elapsedMs
+  and remainingMs.
+
+Precompiled policy:
+- `command-engine.py policy compile` validates the policy and writes
+  command-policy.json.compiled next to it: the parsed rules and their literal index, so
+  loading skips JSON parsing and pattern analysis, and each regex is compiled with
+  re.compile only when a segment first needs it. The engine uses it only while it
+  matches the JSON's current contents and the running Python version, and its payload
+  checksum checks out at load; otherwise it compiles the JSON as before. Re-run
+  `policy compile` after editing the policy.
+
+Startup:
+- Agents run this many times per task, so startup is kept short: the `command-engine`
+  wrapper next to this file starts it through scripts/run-cached.py (cached bytecode),
+  plain `analyze CMD` / `execute CMD` skip building the argparse parser, and modules only
+  some modes need (subprocess, concurrent.futures, hashlib, datetime) are imported where
+  they are used. scripts/bench/startup-bench.py fails when an entry point goes over its
+  startup budget.
 """
+from __future__ import annotations
 
-import argparse
-import datetime
+import codecs
+import collections
+import contextlib
+import fcntl
+import itertools
 import json
+import marshal
+import os
 import pathlib
+import queue
 import re
-import shlex
-import subprocess
+import selectors
+import signal
+import socket
+import socketserver
+import struct
 import sys
-from typing import Any, Tuple
+import threading
+import time
+import types
+
+TYPE_CHECKING = False
+if TYPE_CHECKING:
+    from typing import Any, Callable, Iterable, Iterator, TextIO, Tuple
+
+try:
+    from re import _parser as _re_parser
+except ImportError:  # Python < 3.11
+    import sre_parse as _re_parser
 
 CMD_POLICY_PATH = pathlib.Path('/home/node/.openclaw/bridge/command-policy.json')
+ENGINE_SOCKET_PATH = pathlib.Path(os.environ.get('GUARD_ENGINE_SOCKET', '/home/node/.openclaw/bridge/command-engine.sock'))
 
 DISALLOWED_PATTERNS = [
     r'\bbash\s+-c\b', r'\bsh\s+-c\b', r'\bpython\s+-c\b',
@@ -33,8 +152,713 @@ DISALLOWED_PATTERNS = [
 ]
 
 
+def _literal_runs(items) -> list[str]:
+    """Runs of consecutive LITERAL nodes in a parsed top-level sequence."""
+    runs: list[str] = []
+    cur: list[str] = []
+    for op, arg in items:
+        if op == _re_parser.LITERAL:
+            cur.append(chr(arg))
+            continue
+        if cur:
+            runs.append(''.join(cur))
+            cur = []
+    if cur:
+        runs.append(''.join(cur))
+    return runs
+
+
+def _required_literal(pattern: str, flags: int) -> tuple[str, str]:
+    """Classify what any match of `pattern` must contain.
+
+    Returns ('prefix', s) when the pattern is anchored at the start of the text
+    and begins with literal `s`, ('literal', s) when literal `s` must occur
+    somewhere in the text, or ('', '') when nothing useful can be derived.
+    Only top-level nodes are inspected: every one of them has to match, so
+    their literal runs are required substrings of any match.
+    """
+    try:
+        parsed = _re_parser.parse(pattern, flags)
+    except Exception:
+        return '', ''
+    all_flags = flags | parsed.state.flags
+    if all_flags & re.IGNORECASE:
+        return '', ''
+    items = list(parsed)
+    if (items and not all_flags & re.MULTILINE and items[0][0] == _re_parser.AT
+            and items[0][1] in (_re_parser.AT_BEGINNING, _re_parser.AT_BEGINNING_STRING)):
+        if len(items) > 1 and items[1][0] == _re_parser.LITERAL:
+            return 'prefix', _literal_runs(items[1:])[0]
+    runs = _literal_runs(items)
+    if runs:
+        return 'literal', max(runs, key=len)
+    return '', ''
+
+
+def _trie_regex(words: set[str]) -> str:
+    """Regex matching the longest of `words` at a position (shared prefixes factored out)."""
+    trie: dict = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def render(node: dict) -> str:
+        terminal = '' in node
+        alts = [re.escape(ch) + render(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ''
+        body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+        if terminal:
+            return '(?:' + body + ')?'
+        return body
+
+    return render(trie)
+
+
+# Static screening for super-linear (catastrophic backtracking) constructs.
+# Character sets are approximated over code points 0-255 plus 256, which stands
+# for every other code point.
+_CHARS_ALL = frozenset(range(257))
+_CATEGORY_REGEX = {
+    _re_parser.CATEGORY_DIGIT: r'\d', _re_parser.CATEGORY_NOT_DIGIT: r'\D',
+    _re_parser.CATEGORY_SPACE: r'\s', _re_parser.CATEGORY_NOT_SPACE: r'\S',
+    _re_parser.CATEGORY_WORD: r'\w', _re_parser.CATEGORY_NOT_WORD: r'\W',
+}
+_category_chars_cache: dict[Any, frozenset[int]] = {}
+# A group closed and then quantified, or verbose mode (where whitespace may separate them).
+_MAYBE_NESTED_REPEAT = re.compile(r'\)[*+{]|\(\?[a-zA-Z]*x')
+_REPEATS = (_re_parser.MAX_REPEAT, _re_parser.MIN_REPEAT)
+_POSSESSIVE_REPEAT = getattr(_re_parser, 'POSSESSIVE_REPEAT', None)
+_ATOMIC_GROUP = getattr(_re_parser, 'ATOMIC_GROUP', None)
+
+
+def _category_chars(cat) -> frozenset[int]:
+    chars = _category_chars_cache.get(cat)
+    if chars is None:
+        rx = _CATEGORY_REGEX.get(cat)
+        if rx is None:
+            return _CHARS_ALL
+        compiled = re.compile(rx)
+        chars = frozenset(c for c in _CHARS_ALL if compiled.match(chr(c if c < 256 else 0x100)))
+        _category_chars_cache[cat] = chars
+    return chars
+
+
+def _char_point(c: int) -> int:
+    return c if c < 256 else 256
+
+
+def _char_set(op, av, flags: int) -> frozenset[int]:
+    """Characters a single-character node can match."""
+    if op == _re_parser.LITERAL:
+        chars = {_char_point(av)}
+    elif op == _re_parser.NOT_LITERAL:
+        chars = set(_CHARS_ALL - {_char_point(av)})
+    elif op == _re_parser.ANY:
+        return _CHARS_ALL if flags & re.DOTALL else _CHARS_ALL - {10}
+    elif op == _re_parser.IN:
+        chars = set()
+        negate = False
+        for iop, iav in av:
+            if iop == _re_parser.NEGATE:
+                negate = True
+            elif iop == _re_parser.LITERAL:
+                chars.add(_char_point(iav))
+            elif iop == _re_parser.RANGE:
+                lo, hi = iav
+                chars.update(range(min(lo, 256), min(hi, 255) + 1))
+                if hi >= 256:
+                    chars.add(256)
+            elif iop == _re_parser.CATEGORY:
+                chars |= _category_chars(iav)
+            else:
+                return _CHARS_ALL
+        if negate:
+            chars = set(_CHARS_ALL - chars) | {256}
+    else:
+        return _CHARS_ALL
+    if flags & re.IGNORECASE:
+        chars |= {_char_point(ord(chr(c).swapcase()[0])) for c in chars if c < 256}
+    return frozenset(chars)
+
+
+def _first_chars(items, flags: int) -> tuple[frozenset[int], bool]:
+    """(characters a match of `items` can start with, whether it can match the empty string)."""
+    first: set[int] = set()
+    for op, av in items:
+        chars, nullable = _first_chars_node(op, av, flags)
+        first |= chars
+        if not nullable:
+            return frozenset(first), False
+    return frozenset(first), True
+
+
+def _first_chars_node(op, av, flags: int) -> tuple[frozenset[int], bool]:
+    if op in (_re_parser.LITERAL, _re_parser.NOT_LITERAL, _re_parser.ANY, _re_parser.IN):
+        return _char_set(op, av, flags), False
+    if op in _REPEATS or op == _POSSESSIVE_REPEAT:
+        lo, _, body = av
+        chars, nullable = _first_chars(body, flags)
+        return chars, nullable or lo == 0
+    if op == _re_parser.SUBPATTERN:
+        return _first_chars(av[3], flags | av[1])
+    if op == _ATOMIC_GROUP:
+        return _first_chars(av, flags)
+    if op == _re_parser.BRANCH:
+        first: set[int] = set()
+        any_nullable = False
+        for alt in av[1]:
+            chars, nullable = _first_chars(alt, flags)
+            first |= chars
+            any_nullable = any_nullable or nullable
+        return frozenset(first), any_nullable
+    if op in (_re_parser.AT, _re_parser.ASSERT, _re_parser.ASSERT_NOT):
+        return frozenset(), True
+    return _CHARS_ALL, True
+
+
+def _literal_word(items) -> str | None:
+    if all(op == _re_parser.LITERAL for op, _ in items):
+        return ''.join(chr(av) for _, av in items)
+    return None
+
+
+def _ambiguous_alternation(items, flags: int) -> bool:
+    """Whether a BRANCH in `items` has alternatives that can match the same text."""
+    for op, av in items:
+        if op == _re_parser.SUBPATTERN:
+            if _ambiguous_alternation(av[3], flags | av[1]):
+                return True
+        elif op == _re_parser.BRANCH:
+            alts = av[1]
+            words = [_literal_word(alt) for alt in alts]
+            firsts = [_first_chars(alt, flags) for alt in alts]
+            if any(nullable for _, nullable in firsts):
+                return True
+            for i, j in itertools.combinations(range(len(alts)), 2):
+                if words[i] is not None and words[j] is not None and not flags & re.IGNORECASE:
+                    # Literal alternatives only clash when one is a prefix of the other.
+                    if words[i].startswith(words[j]) or words[j].startswith(words[i]):
+                        return True
+                elif firsts[i][0] & firsts[j][0]:
+                    return True
+            if any(_ambiguous_alternation(alt, flags) for alt in alts):
+                return True
+    return False
+
+
+def _ambiguous_repeat(items, flags: int, before_nullable: bool, follow: frozenset[int],
+                      after_nullable: bool) -> bool:
+    """Whether a variable-length repeat in one iteration of an outer repeat can trade text with its neighbours.
+
+    `follow` is what can come after `items` inside the iteration (wrapping around
+    to the start of the next one); `before_nullable` / `after_nullable` say
+    whether everything else in the iteration can match empty.
+    """
+    for j, (op, av) in enumerate(items):
+        rest_first, rest_nullable = _first_chars(items[j + 1:], flags)
+        follow_j = rest_first | follow if rest_nullable else rest_first
+        after_j = rest_nullable and after_nullable
+        before_j = before_nullable and _first_chars(items[:j], flags)[1]
+        if op in _REPEATS:
+            lo, hi, body = av
+            if lo != hi:
+                chars, _ = _first_chars(body, flags)
+                if (before_j and after_j) or chars & follow_j:
+                    return True
+        elif op == _re_parser.SUBPATTERN:
+            if _ambiguous_repeat(av[3], flags | av[1], before_j, follow_j, after_j):
+                return True
+        elif op == _re_parser.BRANCH:
+            for alt in av[1]:
+                if _ambiguous_repeat(alt, flags, before_j, follow_j, after_j):
+                    return True
+    return False
+
+
+def _unsafe_regex(pattern: str, flags: int = 0) -> str | None:
+    """Reason `pattern` may backtrack exponentially, or None when it looks safe.
+
+    Flags repeats (unbounded, or more than 10 iterations) whose body can match
+    the same text in more than one way: a nested variable-length repeat that
+    could span the iteration or overlap what follows it, e.g. `(a+)+`,
+    `(\\w+\\s?)*`, `(.*,)+` ('nested_quantifier'), or alternatives that can
+    start alike, e.g. `(a|ab)*`, `(\\w|\\w\\d)+` ('ambiguous_alternation').
+    Possessive repeats and atomic groups never backtrack and are not flagged.
+    Polynomial cases such as `.*.*x` are left to the evaluation budget and
+    segment length cap. Patterns that do not parse return None (they are
+    dropped at compile time).
+    """
+    # Nesting needs a quantified group; skip the parse for patterns without one.
+    if not _MAYBE_NESTED_REPEAT.search(pattern):
+        return None
+    try:
+        parsed = _re_parser.parse(pattern, flags)
+    except Exception:
+        return None
+    all_flags = flags | parsed.state.flags
+
+    def walk(items, flags: int) -> str | None:
+        for op, av in items:
+            if op in _REPEATS:
+                lo, hi, body = av
+                if hi == _re_parser.MAXREPEAT or hi > 10:
+                    if _ambiguous_repeat(body, flags, True, _first_chars(body, flags)[0], True):
+                        return 'nested_quantifier'
+                    if _ambiguous_alternation(body, flags):
+                        return 'ambiguous_alternation'
+                reason = walk(body, flags)
+            elif op == _POSSESSIVE_REPEAT:
+                reason = walk(av[2], flags)
+            elif op == _ATOMIC_GROUP:
+                reason = walk(av, flags)
+            elif op == _re_parser.SUBPATTERN:
+                reason = walk(av[3], flags | av[1])
+            elif op == _re_parser.BRANCH:
+                reason = next((r for r in (walk(alt, flags) for alt in av[1]) if r), None)
+            elif op in (_re_parser.ASSERT, _re_parser.ASSERT_NOT):
+                reason = walk(av[1], flags)
+            elif op == _re_parser.GROUPREF_EXISTS:
+                reason = walk(av[1], flags) or (walk(av[2], flags) if av[2] else None)
+            else:
+                reason = None
+            if reason:
+                return reason
+        return None
+
+    try:
+        return walk(list(parsed), all_flags)
+    except RecursionError:
+        return 'too_complex'
+
+
+class _LazyRegexes:
+    """{index: compiled regex} for the known-valid `indices` of `patterns`, each compiled on first lookup.
+
+    Used when a PatternSet or RuleMatcher is restored from the policy artifact, so
+    loading does not pay for compiling patterns that no segment ever reaches.
+    """
+
+    def __init__(self, patterns: list[str], flags: int, indices: Iterable[int]):
+        self.patterns = patterns
+        self.flags = flags
+        self.indices = frozenset(indices)
+        self.regexes: dict[int, re.Pattern] = {}
+
+    def __getitem__(self, idx: int) -> re.Pattern:
+        rx = self.regexes.get(idx)
+        if rx is None:
+            if idx not in self.indices:
+                raise KeyError(idx)
+            rx = self.regexes[idx] = re.compile(self.patterns[idx], self.flags)
+        return rx
+
+    def __contains__(self, idx: object) -> bool:
+        return idx in self.indices
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(sorted(self.indices))
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+
+class PatternSet:
+    """Compiled set of regexes that reports every matching pattern in one pass.
+
+    `search_all(text)` returns the indices (in list order) of the patterns for
+    which `re.search(pattern, text, flags)` would succeed, without running every
+    pattern. At compile time each pattern is classified by what a match must
+    contain (see `_required_literal`):
+
+    - anchored patterns are indexed by their literal prefix, found with a few
+      dict lookups on the start of the text;
+    - patterns with a required literal are indexed by it, and all literals are
+      folded into one trie regex that a single `finditer` pass over the text
+      uses to report which of them occur;
+    - the rest are always candidates.
+
+    Only candidates are confirmed with their own compiled regex, so results are
+    identical to searching each pattern in turn. Patterns that do not compile
+    are dropped (they never matched before either).
+    """
+
+    def __init__(self, patterns: list[str], flags: int = 0):
+        self.patterns = list(patterns)
+        self.flags = flags
+        self.compiled: dict[int, re.Pattern] | _LazyRegexes = {}
+        self.always: list[int] = []
+        self.by_prefix: dict[str, list[int]] = {}
+        by_literal: dict[str, list[int]] = {}
+
+        for idx, pat in enumerate(self.patterns):
+            try:
+                self.compiled[idx] = re.compile(pat, flags)
+            except (re.error, TypeError, OverflowError, RecursionError):
+                continue
+            kind, lit = _required_literal(pat, flags)
+            if kind == 'prefix':
+                self.by_prefix.setdefault(lit, []).append(idx)
+            elif kind == 'literal':
+                by_literal.setdefault(lit, []).append(idx)
+            else:
+                self.always.append(idx)
+
+        self.prefix_lengths = sorted({len(p) for p in self.by_prefix})
+
+        # The scanner reports the longest literal starting at each position;
+        # shorter literals that are prefixes of it are implied, so fold their
+        # patterns in up front.
+        self.by_found: dict[str, list[int]] = {}
+        for lit in by_literal:
+            hits = [idx for i in range(1, len(lit) + 1) for idx in by_literal.get(lit[:i], ())]
+            self.by_found[lit] = hits
+        self.scanner = re.compile('(?=(' + _trie_regex(set(by_literal)) + '))', re.DOTALL) if by_literal else None
+
+    def state(self) -> dict[str, Any]:
+        """Marshal-able snapshot of the index; `from_state` restores it without re-analysing the patterns."""
+        return {
+            'patterns': self.patterns,
+            'flags': int(self.flags),
+            'always': self.always,
+            'byPrefix': self.by_prefix,
+            'byFound': self.by_found,
+            'scanner': self.scanner.pattern if self.scanner is not None else None,
+            'valid': sorted(self.compiled),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict[str, Any]) -> 'PatternSet':
+        ps = cls.__new__(cls)
+        ps.patterns = state['patterns']
+        ps.flags = state['flags']
+        ps.always = state['always']
+        ps.by_prefix = state['byPrefix']
+        ps.prefix_lengths = sorted({len(p) for p in ps.by_prefix})
+        ps.by_found = state['byFound']
+        ps.scanner = re.compile(state['scanner'], re.DOTALL) if state['scanner'] is not None else None
+        ps.compiled = _LazyRegexes(ps.patterns, ps.flags, state['valid'])
+        return ps
+
+    def candidates(self, text: str) -> list[int]:
+        """Indices (in list order) of the patterns that may match `text` and need confirming."""
+        candidates = set(self.always)
+        for n in self.prefix_lengths:
+            hit = self.by_prefix.get(text[:n])
+            if hit:
+                candidates.update(hit)
+        if self.scanner is not None:
+            found = {m.group(1) for m in self.scanner.finditer(text)}
+            for lit in found:
+                candidates.update(self.by_found[lit])
+        return sorted(candidates)
+
+    def search_all(self, text: str, record=None) -> list[int]:
+        """Indices of matching patterns. `record(idx, matched, seconds)` is called per evaluated candidate."""
+        if record is None:
+            return [idx for idx in self.candidates(text) if self.compiled[idx].search(text)]
+
+        hits: list[int] = []
+        for idx in self.candidates(text):
+            t0 = time.perf_counter()
+            matched = self.compiled[idx].search(text) is not None
+            record(idx, matched, time.perf_counter() - t0)
+            if matched:
+                hits.append(idx)
+        return hits
+
+    def search_first(self, text: str) -> int | None:
+        hits = self.search_all(text)
+        return hits[0] if hits else None
+
+
+# Regex safety settings, overridable per policy under "regexSafety":
+# - onUnsafe: 'reject' (default) rejects any segment that would have to evaluate
+#   a rule flagged by the static screen; 'skip' treats those rules as non-matching.
+# - budgetMs: CPU time allowed for matching one segment; a segment that runs past it
+#   is rejected (0 disables the budget). Rules are not flagged for it: the overrun
+#   belongs to that input, and later segments are evaluated normally.
+# - maxSegmentLength: longer segments are rejected without being matched.
+REGEX_SAFETY_DEFAULTS: dict[str, Any] = {'onUnsafe': 'reject', 'budgetMs': 50, 'maxSegmentLength': 65536}
+
+
+def regex_safety(policy: dict[str, Any]) -> dict[str, Any]:
+    """The policy's regexSafety settings merged over REGEX_SAFETY_DEFAULTS (invalid values ignored)."""
+    out = dict(REGEX_SAFETY_DEFAULTS)
+    cfg = policy.get('regexSafety')
+    if not isinstance(cfg, dict):
+        return out
+    if cfg.get('onUnsafe') in ('reject', 'skip'):
+        out['onUnsafe'] = cfg['onUnsafe']
+    for key in ('budgetMs', 'maxSegmentLength'):
+        val = cfg.get(key)
+        if isinstance(val, (int, float)) and not isinstance(val, bool) and val >= 0:
+            out[key] = val
+    return out
+
+
+class MatchBudgetExceeded(Exception):
+    """Rule matching ran past the per-segment budget."""
+
+
+_budget_deadline = 0.0  # main thread CPU-time deadline of the armed budget timer
+
+
+def _raise_budget_exceeded(_signum, _frame):
+    # ITIMER_VIRTUAL counts CPU time of the whole process, so other threads can
+    # fire it early; re-arm for whatever the main thread has left.
+    remaining = _budget_deadline - time.thread_time()
+    if remaining > 0.0005:
+        signal.setitimer(signal.ITIMER_VIRTUAL, remaining)
+        return
+    raise MatchBudgetExceeded
+
+
+@contextlib.contextmanager
+def _match_budget(seconds: float) -> Iterator[float | None]:
+    """Bound the CPU time of the enclosed rule matching to `seconds`.
+
+    On the main thread a SIGVTALRM timer interrupts even a single runaway
+    regex (its handler is installed on first use and left in place; the timer
+    is only armed inside the context). Signals cannot reach other threads, so
+    there the context yields a thread CPU-time deadline that the matcher checks
+    after each rule instead. Yields None when no deadline needs checking.
+    """
+    if seconds <= 0:
+        yield None
+        return
+    if threading.current_thread() is not threading.main_thread() or not hasattr(signal, 'setitimer'):
+        yield time.thread_time() + seconds
+        return
+    global _budget_deadline
+    if signal.getsignal(signal.SIGVTALRM) is not _raise_budget_exceeded:
+        signal.signal(signal.SIGVTALRM, _raise_budget_exceeded)
+    _budget_deadline = time.thread_time() + seconds
+    signal.setitimer(signal.ITIMER_VIRTUAL, seconds)
+    try:
+        yield None
+    finally:
+        signal.setitimer(signal.ITIMER_VIRTUAL, 0)
+
+
+def _argv_rule(rule: dict[str, Any]) -> tuple[str, list[str], list[str]] | None:
+    """(program, args prefix, [argsPattern, pattern]) of a program rule, None if the rule is unusable.
+
+    Regexes the rule does not set are None.
+    """
+    program, args = rule.get('program'), rule.get('args', [])
+    if not isinstance(program, str) or not program:
+        return None
+    if not isinstance(args, list) or not all(isinstance(a, str) for a in args):
+        return None
+    return program, args, [rule.get('argsPattern'), rule.get('pattern')]
+
+
+class RuleMatcher:
+    """Policy rules compiled for matching; `match(segment)` returns matching rules in policy order.
+
+    Rules with a "program" are indexed by it and only considered for segments
+    that run that program and whose next arguments start with the rule's "args";
+    their "argsPattern" is searched in the arguments joined by spaces and their
+    "pattern" (optional for them) in the segment text. argv[0] must equal the
+    program, except that a bare-name program also covers a path argv[0] with
+    that basename: always for rejected/ask rules, and for approved rules only
+    when the path is absolute and is the file the name resolves to on PATH. The
+    remaining free-form rules go into a PatternSet.
+
+    Patterns that fail the static screen (see `_unsafe_regex`) are recorded in
+    `unsafe` ({rule index: reason}) and never run. `scan` reports unsafe rules
+    that were candidates for a segment so the caller can apply onUnsafe.
+    """
+
+    def __init__(self, rules: list[dict[str, Any]], safety: dict[str, Any] | None = None):
+        self.rules = rules
+        self.patterns = [rule.get('pattern', '' if 'program' in rule else '^$') for rule in rules]
+        # Program rules are None here, which PatternSet drops like a pattern that
+        # does not compile, so its indices stay rule indices.
+        self.patterns_set = PatternSet([None if 'program' in rule else pat for rule, pat in zip(rules, self.patterns)])
+        self.safety = safety or dict(REGEX_SAFETY_DEFAULTS)
+        self.unsafe: dict[int, str] = {}
+        for idx in self.patterns_set.compiled:
+            reason = _unsafe_regex(self.patterns[idx])
+            if reason:
+                self.unsafe[idx] = reason
+
+        # by_program: {program: [rule index, ...]}; argv_rules: {rule index: [args,
+        # argsPattern slot, pattern slot]} with slots into argv_patterns (-1: unset).
+        self.by_program: dict[str, list[int]] = {}
+        self.argv_rules: dict[int, list[Any]] = {}
+        self.argv_patterns: list[str] = []
+        self.argv_compiled: dict[int, re.Pattern] | _LazyRegexes = {}
+        for idx, rule in enumerate(rules):
+            spec = _argv_rule(rule) if 'program' in rule else None
+            if spec is None:
+                continue
+            program, args, regexes = spec
+            slots, reasons = [], []
+            try:
+                for pat in regexes:
+                    if pat is None:
+                        slots.append(-1)
+                        continue
+                    rx = re.compile(pat)
+                    slot = len(self.argv_patterns)
+                    self.argv_patterns.append(pat)
+                    self.argv_compiled[slot] = rx
+                    slots.append(slot)
+                    reasons.append(_unsafe_regex(pat))
+            except (re.error, TypeError, OverflowError, RecursionError):
+                continue  # never matches, like a free-form rule whose pattern does not compile
+            self.by_program.setdefault(program, []).append(idx)
+            self.argv_rules[idx] = [args, *slots]
+            reason = next((r for r in reasons if r), None)
+            if reason:
+                self.unsafe[idx] = reason
+        self._index_approved()
+
+    def _index_approved(self) -> None:
+        # Approved program rules, which cover a path argv[0] only if it is the
+        # program's own binary; PATH lookups are cached per program.
+        self.approved = {idx for idx in self.argv_rules if self.rules[idx].get('decision', 'rejected') == 'approved'}
+        self.program_paths: dict[str, str | None] = {}
+
+    @classmethod
+    def from_state(cls, rules: list[dict[str, Any]], safety: dict[str, Any], state: dict[str, Any]) -> 'RuleMatcher':
+        """Rebuild from `state()`, skipping analysis and screening; regexes compile on first use."""
+        matcher = cls.__new__(cls)
+        matcher.rules = rules
+        matcher.patterns_set = PatternSet.from_state(state['patternSet'])
+        matcher.patterns = state['patterns']
+        matcher.safety = safety
+        matcher.unsafe = dict(state['unsafe'])
+        matcher.by_program = state['byProgram']
+        matcher.argv_rules = state['argvRules']
+        matcher.argv_patterns = state['argvPatterns']
+        matcher.argv_compiled = _LazyRegexes(matcher.argv_patterns, 0, range(len(matcher.argv_patterns)))
+        matcher._index_approved()
+        return matcher
+
+    def state(self) -> dict[str, Any]:
+        return {
+            'patternSet': self.patterns_set.state(),
+            'patterns': self.patterns,
+            'unsafe': dict(self.unsafe),
+            'byProgram': self.by_program,
+            'argvRules': self.argv_rules,
+            'argvPatterns': self.argv_patterns,
+        }
+
+    def candidates(self, segment: str, argv: list[str] | None = None) -> list[int]:
+        """Indices (in policy order) of the rules that may match and need confirming."""
+        found = self.patterns_set.candidates(segment)
+        if argv and self.by_program:
+            rules = self.by_program.get(argv[0])
+            name = os.path.basename(argv[0])
+            by_name = self.by_program.get(name) if name != argv[0] else None
+            if by_name:
+                same = self._is_program(argv[0], name)
+                by_name = [idx for idx in by_name if same or idx not in self.approved]
+                rules = (rules or []) + by_name
+            if rules:
+                argv_rules = self.argv_rules
+                found += [idx for idx in rules if argv[1:1 + len(argv_rules[idx][0])] == argv_rules[idx][0]]
+                found.sort()
+        return found
+
+    def _is_program(self, path: str, name: str) -> bool:
+        """Whether `path` is absolute and the same file that `name` resolves to on PATH."""
+        if not os.path.isabs(path):
+            return False
+        if name not in self.program_paths:
+            import shutil
+            found = shutil.which(name)
+            self.program_paths[name] = os.path.realpath(found) if found else None
+        target = self.program_paths[name]
+        return target is not None and os.path.realpath(path) == target
+
+    def _confirm(self, idx: int, segment: str, argv: list[str] | None) -> bool:
+        spec = self.argv_rules.get(idx)
+        if spec is None:
+            return self.patterns_set.compiled[idx].search(segment) is not None
+        _, args_slot, pattern_slot = spec
+        compiled = self.argv_compiled
+        if args_slot >= 0 and compiled[args_slot].search(' '.join(argv[1:])) is None:
+            return False
+        return pattern_slot < 0 or compiled[pattern_slot].search(segment) is not None
+
+    def scan(self, segment: str, record=None, deadline: float | None = None,
+             argv: list[str] | None = None) -> tuple[list[int], list[int]]:
+        """(indices of matching rules, indices of unsafe candidate rules) for `segment`.
+
+        Program rules are only considered when `argv` is given. Raises
+        MatchBudgetExceeded when `deadline` (thread CPU time) passes or the
+        budget timer fires.
+        """
+        hits: list[int] = []
+        unsafe: list[int] = []
+        for idx in self.candidates(segment, argv):
+            if idx in self.unsafe:
+                unsafe.append(idx)
+                continue
+            if record is None:
+                matched = self._confirm(idx, segment, argv)
+            else:
+                t0 = time.perf_counter()
+                matched = self._confirm(idx, segment, argv)
+                record(idx, matched, time.perf_counter() - t0)
+            if matched:
+                hits.append(idx)
+            if deadline is not None and time.thread_time() > deadline:
+                raise MatchBudgetExceeded
+        return hits, unsafe
+
+    def scan_bounded(self, segment: str, record=None,
+                     argv: list[str] | None = None) -> tuple[list[int], list[int], str | None]:
+        """`scan` under the evaluation budget: (hits, unsafe candidates, error).
+
+        A segment that runs past the budget gets the error
+        'policy_evaluation_budget_exceeded'. Only that segment fails: the rules
+        are left as they are, so one expensive input cannot change the
+        decision for later ones.
+        """
+        try:
+            with _match_budget(self.safety['budgetMs'] / 1000.0) as deadline:
+                hits, unsafe = self.scan(segment, record, deadline, argv)
+        except MatchBudgetExceeded:
+            return [], [], 'policy_evaluation_budget_exceeded'
+        return hits, unsafe, None
+
+    def match_indices(self, segment: str, record=None, argv: list[str] | None = None) -> list[int]:
+        return self.scan(segment, record, argv=argv)[0]
+
+    def describe(self, indices: list[int]) -> list[dict[str, str]]:
+        return [{
+            'id': self.rules[idx].get('id', 'unknown'),
+            'decision': self.rules[idx].get('decision', 'rejected'),
+            'pattern': self.patterns[idx],
+        } for idx in indices]
+
+    def describe_unsafe(self) -> list[dict[str, str]]:
+        out = []
+        for idx, reason in sorted(dict(self.unsafe).items()):
+            rule = self.rules[idx]
+            entry = {'id': rule.get('id', 'unknown'), 'pattern': self.patterns[idx], 'reason': reason}
+            if 'argsPattern' in rule:
+                entry['argsPattern'] = rule['argsPattern']
+            out.append(entry)
+        return out
+
+    def match(self, segment: str, argv: list[str] | None = None) -> list[dict[str, str]]:
+        return self.describe(self.match_indices(segment, argv=argv))
+
+
+_DISALLOWED = PatternSet(DISALLOWED_PATTERNS, re.IGNORECASE)
+
+
 def now_iso() -> str:
-    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat().replace('+00:00', 'Z')
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
 
 
 def _reject(reason: str, extra: dict[str, Any] | None = None) -> dict[str, Any]:
@@ -44,38 +868,457 @@ def _reject(reason: str, extra: dict[str, Any] | None = None) -> dict[str, Any]:
     return out
 
 
-def load_policy() -> dict[str, Any]:
-    if not CMD_POLICY_PATH.exists():
-        return {'rules': []}
+def parse_policy(source: bytes | str) -> dict[str, Any]:
+    """Policy document from the JSON text; anything unusable becomes an empty rule list."""
     try:
-        cfg = json.loads(CMD_POLICY_PATH.read_text() or '{}')
-        if not isinstance(cfg, dict):
-            return {'rules': []}
-        if not isinstance(cfg.get('rules'), list):
-            cfg['rules'] = []
-        return cfg
+        cfg = json.loads(source or '{}')
     except Exception:
         return {'rules': []}
+    if not isinstance(cfg, dict):
+        return {'rules': []}
+    if not isinstance(cfg.get('rules'), list):
+        cfg['rules'] = []
+    # A rule that is not an object cannot be evaluated; `policy check` reports it.
+    cfg['rules'] = [rule for rule in cfg['rules'] if isinstance(rule, dict)]
+    return cfg
 
 
-def tokenize_chain(command: str) -> Tuple[list[str], list[str]]:
+def load_policy(path: pathlib.Path | None = None) -> dict[str, Any]:
+    path = path or CMD_POLICY_PATH
+    try:
+        return parse_policy(path.read_bytes())
+    except OSError:
+        return {'rules': []}
+
+
+def validate_policy(raw: Any) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """(errors, warnings) for a parsed policy document, before any defaults are applied."""
+    if not isinstance(raw, dict):
+        return [{'error': 'policy_not_object'}], []
+    rules = raw.get('rules')
+    if not isinstance(rules, list):
+        return [{'error': 'rules_not_list'}], []
+    errors: list[dict[str, Any]] = []
+    warnings: list[dict[str, Any]] = []
+    seen: set[str] = set()
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            errors.append({'index': i, 'error': 'rule_not_object'})
+            continue
+        rid = rule.get('id')
+        where = {'index': i, 'id': rid}
+        if 'pattern' in rule and not isinstance(rule['pattern'], str):
+            errors.append({**where, 'error': 'pattern_not_string'})
+        if 'program' in rule and (not isinstance(rule['program'], str) or not rule['program']):
+            errors.append({**where, 'error': 'program_not_string'})
+        if 'args' in rule and (not isinstance(rule['args'], list) or not all(isinstance(a, str) for a in rule['args'])):
+            errors.append({**where, 'error': 'args_not_string_list'})
+        if 'argsPattern' in rule and not isinstance(rule['argsPattern'], str):
+            errors.append({**where, 'error': 'args_pattern_not_string'})
+        if ('args' in rule or 'argsPattern' in rule) and 'program' not in rule:
+            errors.append({**where, 'error': 'args_without_program'})
+        if 'decision' in rule and rule['decision'] not in ('approved', 'ask', 'rejected'):
+            errors.append({**where, 'error': 'invalid_decision', 'decision': rule['decision']})
+        if 'parallel' in rule and not isinstance(rule['parallel'], bool):
+            errors.append({**where, 'error': 'parallel_not_boolean'})
+        if 'maxConcurrent' in rule and not _is_cap(rule['maxConcurrent']):
+            errors.append({**where, 'error': 'invalid_max_concurrent', 'maxConcurrent': rule['maxConcurrent']})
+        if not isinstance(rid, str) or not rid:
+            warnings.append({**where, 'warning': 'missing_id'})
+        elif rid in seen:
+            warnings.append({**where, 'warning': 'duplicate_id'})
+        else:
+            seen.add(rid)
+        if 'pattern' not in rule and 'program' not in rule:
+            warnings.append({**where, 'warning': 'missing_pattern'})
+        if 'decision' not in rule:
+            warnings.append({**where, 'warning': 'missing_decision'})
+    if 'regexSafety' in raw:
+        safety = raw['regexSafety']
+        if not isinstance(safety, dict) or any(
+                key not in REGEX_SAFETY_DEFAULTS or regex_safety({'regexSafety': {key: val}})[key] != val
+                for key, val in safety.items()):
+            errors.append({'error': 'invalid_regex_safety', 'regexSafety': safety})
+    if 'scheduler' in raw:
+        sched = raw['scheduler']
+        if not isinstance(sched, dict) or any(
+                key not in SCHEDULER_DEFAULTS or scheduler_settings({'scheduler': {key: val}})[key] != val
+                for key, val in sched.items()):
+            errors.append({'error': 'invalid_scheduler', 'scheduler': sched})
+    return errors, warnings
+
+
+class CompiledPolicy:
+    """A loaded policy with its rules compiled, tagged with the file state it was read from."""
+
+    def __init__(self, policy: dict[str, Any], signature: tuple | None = None):
+        self.policy = policy
+        self.rules: list[dict[str, Any]] = policy.get('rules', [])
+        self.safety = regex_safety(policy)
+        self.scheduler = scheduler_settings(policy)
+        self.matcher = RuleMatcher(self.rules, self.safety)
+        self.signature = signature
+        import hashlib
+        canonical = json.dumps(policy, sort_keys=True, separators=(',', ':'), default=str)
+        self.fingerprint = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def artifact(self) -> dict[str, Any]:
+        return {'policy': self.policy, 'fingerprint': self.fingerprint, 'matcher': self.matcher.state()}
+
+    @classmethod
+    def from_artifact(cls, artifact: dict[str, Any], signature: tuple | None = None) -> 'CompiledPolicy':
+        compiled = cls.__new__(cls)
+        compiled.policy = artifact['policy']
+        compiled.rules = compiled.policy.get('rules', [])
+        compiled.safety = regex_safety(compiled.policy)
+        compiled.scheduler = scheduler_settings(compiled.policy)
+        compiled.matcher = RuleMatcher.from_state(compiled.rules, compiled.safety, artifact['matcher'])
+        compiled.signature = signature
+        compiled.fingerprint = artifact['fingerprint']
+        return compiled
+
+
+# Precompiled policy artifact (`policy compile`), stored next to the JSON as
+# <name>.compiled: magic, a 4-byte header length, a marshalled header, then the
+# marshalled CompiledPolicy.artifact(). It holds the parsed rules and the literal
+# index derived from the re parser, not compiled regexes: patterns are compiled
+# with re.compile when first needed. The index depends on the parser, so the
+# artifact is only used by the Python version that wrote it (version + cache tag),
+# only while the header's sha256 matches the JSON file's current bytes, and only if
+# the payload matches the header's checksum of it; otherwise it is ignored and the
+# JSON compiled instead.
+POLICY_ARTIFACT_MAGIC = b'GRDPOL\x00\x04'
+
+
+def policy_artifact_path(policy_path: pathlib.Path) -> pathlib.Path:
+    return policy_path.with_name(policy_path.name + '.compiled')
+
+
+def _artifact_build() -> list[Any]:
+    return [sys.implementation.cache_tag, list(sys.version_info)]
+
+
+def write_policy_artifact(compiled: CompiledPolicy, source: bytes, path: pathlib.Path) -> int:
+    """Write `compiled` as the artifact for the JSON bytes `source` (atomically); returns its size."""
+    import hashlib
+    payload = marshal.dumps(compiled.artifact())
+    header = marshal.dumps({'source': hashlib.sha256(source).hexdigest(), 'build': _artifact_build(),
+                            'payload': hashlib.sha256(payload).hexdigest()})
+    data = POLICY_ARTIFACT_MAGIC + len(header).to_bytes(4, 'big') + header + payload
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+def read_policy_artifact(path: pathlib.Path, source: bytes) -> dict[str, Any] | None:
+    """The artifact at `path` if it was compiled from `source` by this Python build, else None."""
+    import hashlib
+    try:
+        data = path.read_bytes()
+    except OSError:
+        return None
+    n = len(POLICY_ARTIFACT_MAGIC)
+    if data[:n] != POLICY_ARTIFACT_MAGIC:
+        return None
+    try:
+        size = int.from_bytes(data[n:n + 4], 'big')
+        header = marshal.loads(data[n + 4:n + 4 + size])
+        if header.get('build') != _artifact_build() or header.get('source') != hashlib.sha256(source).hexdigest():
+            return None
+        payload = data[n + 4 + size:]
+        if header.get('payload') != hashlib.sha256(payload).hexdigest():
+            return None
+        return marshal.loads(payload)
+    except (EOFError, ValueError, TypeError, AttributeError):
+        return None
+
+
+def compile_policy_source(source: bytes, signature: tuple | None = None,
+                          artifact_path: pathlib.Path | None = None) -> CompiledPolicy:
+    """CompiledPolicy for the JSON bytes `source`, from the artifact when it is current."""
+    if artifact_path is not None:
+        artifact = read_policy_artifact(artifact_path, source)
+        if artifact is not None:
+            try:
+                return CompiledPolicy.from_artifact(artifact, signature)
+            except Exception:  # unusable artifact (unexpected shape): compile the JSON
+                pass
+    return CompiledPolicy(parse_policy(source), signature)
+
+
+_compiled_policy: CompiledPolicy | None = None
+
+
+class DecisionCache:
+    """Bounded LRU of segment evaluations for one policy fingerprint.
+
+    Keys are (policy fingerprint, segment argv as a tuple); the argv from
+    split_chain determines the segment text as well. A lookup under a different
+    fingerprint drops every entry, so a policy change never serves a stale
+    decision.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.fingerprint: str | None = None
+        self.entries: collections.OrderedDict[tuple[str, tuple[str, ...]], dict[str, Any]] = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def _check_fingerprint(self, fingerprint: str) -> None:
+        if fingerprint != self.fingerprint:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, fingerprint: str, key: tuple[str, ...]) -> dict[str, Any] | None:
+        with self.lock:
+            self._check_fingerprint(fingerprint)
+            entry = self.entries.get((fingerprint, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((fingerprint, key))
+            self.hits += 1
+            return dict(entry)
+
+    def put(self, fingerprint: str, key: tuple[str, ...], evaluation: dict[str, Any]) -> None:
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self._check_fingerprint(fingerprint)
+            self.entries[(fingerprint, key)] = dict(evaluation)
+            self.entries.move_to_end((fingerprint, key))
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'fingerprint': self.fingerprint,
+            }
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+DECISION_CACHE = DecisionCache(_env_int('GUARD_DECISION_CACHE_SIZE', 4096))
+
+
+class RuleProfiler:
+    """Per-rule evaluation counters: how often a rule's regex ran, matched, and what it cost.
+
+    Rules are keyed by (id, pattern) so counters survive policy reloads for
+    unchanged rules. A rule is flagged slow once a single evaluation takes
+    longer than `slow_ms`.
+    """
+
+    def __init__(self, slow_ms: float):
+        self.slow_seconds = slow_ms / 1000.0
+        self.stats: dict[tuple[str, str], list[float]] = {}  # [evaluations, matches, seconds, max seconds]
+        self.lock = threading.Lock()
+
+    def recorder(self, rules: list[dict[str, Any]]):
+        def record(idx: int, matched: bool, seconds: float) -> None:
+            rule = rules[idx]
+            key = (str(rule.get('id', 'unknown')), str(rule.get('pattern', '^$')))
+            with self.lock:
+                st = self.stats.get(key)
+                if st is None:
+                    st = self.stats[key] = [0, 0, 0.0, 0.0]
+                st[0] += 1
+                st[1] += matched
+                st[2] += seconds
+                if seconds > st[3]:
+                    st[3] = seconds
+        return record
+
+    def report(self, rules: list[dict[str, Any]]) -> dict[str, Any]:
+        """Stats for every rule in `rules` (zeros for rules never evaluated), costliest first."""
+        with self.lock:
+            stats = {k: list(v) for k, v in self.stats.items()}
+        rows = []
+        for rule in rules:
+            key = (str(rule.get('id', 'unknown')), str(rule.get('pattern', '^$')))
+            evals, matches, seconds, max_seconds = stats.get(key, [0, 0, 0.0, 0.0])
+            rows.append({
+                'id': key[0],
+                'pattern': key[1],
+                'decision': rule.get('decision', 'rejected'),
+                'evaluations': int(evals),
+                'matches': int(matches),
+                'seconds': round(seconds, 6),
+                'maxSeconds': round(max_seconds, 6),
+                'slow': max_seconds > self.slow_seconds,
+            })
+        rows.sort(key=lambda r: r['seconds'], reverse=True)
+        return {
+            'ok': True,
+            'slowThresholdMs': self.slow_seconds * 1000,
+            'rules': rows,
+            'neverMatched': [r['id'] for r in rows if r['matches'] == 0],
+            'slow': [r['id'] for r in rows if r['slow']],
+            'ts': now_iso(),
+        }
+
+    def prometheus(self, rules: list[dict[str, Any]]) -> str:
+        def esc(v: str) -> str:
+            return v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        rows = self.report(rules)['rules']
+        metrics = [
+            ('guard_rule_evaluations_total', 'counter', 'Times the rule regex was evaluated.', 'evaluations'),
+            ('guard_rule_matches_total', 'counter', 'Times the rule regex matched.', 'matches'),
+            ('guard_rule_match_seconds_total', 'counter', 'Cumulative rule regex evaluation time.', 'seconds'),
+            ('guard_rule_match_seconds_max', 'gauge', 'Slowest single evaluation of the rule regex.', 'maxSeconds'),
+            ('guard_rule_slow', 'gauge', 'Rule exceeded the slow-evaluation threshold.', 'slow'),
+        ]
+        lines = []
+        for name, kind, help_text, field in metrics:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for r in rows:
+                lines.append(f'{name}{{rule="{esc(r["id"])}",decision="{esc(str(r["decision"]))}"}} {float(r[field]):g}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str, rules: list[dict[str, Any]]) -> None:
+        """Write the Prometheus textfile atomically (node_exporter textfile collector format)."""
+        target = pathlib.Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+        tmp.write_text(self.prometheus(rules))
+        os.replace(tmp, target)
+
+
+# Opt-in rule profiling (GUARD_PROFILE=1). While enabled, the decision cache is
+# bypassed so every segment evaluation is counted.
+PROFILER: RuleProfiler | None = (
+    RuleProfiler(_env_float('GUARD_PROFILE_SLOW_MS', 5))
+    if os.environ.get('GUARD_PROFILE', '') in ('1', 'true', 'yes') else None)
+PROFILE_TEXTFILE = os.environ.get('GUARD_PROFILE_TEXTFILE', '')
+PROFILE_FLUSH_SECONDS = max(1, _env_int('GUARD_PROFILE_FLUSH_SECONDS', 15))
+
+
+def _policy_signature() -> tuple | None:
+    try:
+        st = CMD_POLICY_PATH.stat()
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def current_policy() -> CompiledPolicy:
+    """Compiled policy for the current contents of CMD_POLICY_PATH.
+
+    The file is stat()ed on every call and only re-read and recompiled when it
+    changed, so a long-running process keeps the policy warm.
+    """
+    global _compiled_policy
+    sig = _policy_signature()
+    cached = _compiled_policy
+    if cached is not None and cached.signature == sig:
+        return cached
+    try:
+        source = CMD_POLICY_PATH.read_bytes()
+    except OSError:
+        source = b''
+    cached = compile_policy_source(source, sig, policy_artifact_path(CMD_POLICY_PATH))
+    _compiled_policy = cached
+    return cached
+
+
+# One chain segment: `text` is the canonical form rules are matched against (its
+# tokens joined by single spaces), `argv` the tokens themselves, which execute runs
+# as-is so an argument is never re-split differently from how it was analyzed.
+Segment = collections.namedtuple('Segment', 'text argv')
+
+# Tokenizer with the semantics of shlex.shlex(posix=True, punctuation_chars=';&|',
+# whitespace_split=True, commenters=''): runs of ;&| are tokens of their own, single
+# quotes are literal, a backslash escapes any character outside quotes and only " and
+# \ inside double quotes. One regex match per word piece instead of shlex's
+# per-character state machine.
+_CHAIN_TOKEN = re.compile(r"""
+    (?P<space>[ \t\r\n]+)
+  | (?P<punct>[;&|]+)
+  | (?P<bare>[^ \t\r\n;&|'"\\]+)
+  | '(?P<single>[^']*)'
+  | "(?P<double>(?:[^"\\]|\\.)*)"
+  | \\(?P<escaped>.)
+""", re.DOTALL | re.VERBOSE)
+_DOUBLE_QUOTE_ESCAPE = re.compile(r'\\(["\\])')
+_UNCLOSED_DOUBLE_ESCAPE = re.compile(r'(?:[^"\\]|\\.)*\\', re.DOTALL)
+
+
+def _chain_tokens(command: str) -> list[str]:
+    """The shlex tokens of `command`; raises ValueError with shlex's messages on bad quoting."""
+    tokens: list[str] = []
+    pos = 0
+    n = len(command)
+    word: list[str] = []
+    in_word = False
+    match = _CHAIN_TOKEN.match
+    while pos < n:
+        m = match(command, pos)
+        if m is None:
+            # An unterminated quote or a trailing backslash.
+            if command[pos] == '\\' or (
+                    command[pos] == '"' and _UNCLOSED_DOUBLE_ESCAPE.fullmatch(command, pos + 1)):
+                raise ValueError('No escaped character')
+            raise ValueError('No closing quotation')
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == 'space' or kind == 'punct':
+            if in_word:
+                tokens.append(''.join(word))
+                word = []
+                in_word = False
+            if kind == 'punct':
+                tokens.append(m.group(kind))
+            continue
+        piece = m.group(kind)
+        if kind == 'double' and '\\' in piece:
+            piece = _DOUBLE_QUOTE_ESCAPE.sub(r'\1', piece)
+        word.append(piece)
+        in_word = True
+    if in_word:
+        tokens.append(''.join(word))
+    return tokens
+
+
+def split_chain(command: str) -> tuple[list[Segment], list[str]]:
     """Returns (segments, operators) where operators are between segments.
 
     Allowed operators: ';' and '&&'
     Disallowed: single '&', pipes, redirects, etc. (We reject at parse-time for safety.)
     """
-    lexer = shlex.shlex(command, posix=True, punctuation_chars=';&|')
-    lexer.whitespace_split = True
-    lexer.commenters = ''
-    raw = list(lexer)
-
-    segments: list[str] = []
+    segments: list[Segment] = []
     ops: list[str] = []
     cur: list[str] = []
 
-    i = 0
-    while i < len(raw):
-        t = raw[i]
+    for t in _chain_tokens(command):
         if t in (';', '&', '&&', '|'):
             if t == '&&':
                 op = '&&'
@@ -90,53 +1333,94 @@ def tokenize_chain(command: str) -> Tuple[list[str], list[str]]:
             seg = ' '.join(cur).strip()
             if not seg:
                 raise ValueError('empty_segment')
-            segments.append(seg)
+            segments.append(Segment(seg, cur))
             ops.append(op)
             cur = []
         else:
             cur.append(t)
-        i += 1
 
     tail = ' '.join(cur).strip()
     if not tail:
         raise ValueError('empty_segment')
-    segments.append(tail)
+    segments.append(Segment(tail, cur))
+    return segments, ops
 
-    if len(ops) != len(segments) - 1:
-        raise ValueError('parse_mismatch')
 
-    return segments, ops
+def tokenize_chain(command: str) -> Tuple[list[str], list[str]]:
+    """(segment texts, operators) of `command`; see split_chain."""
+    segments, ops = split_chain(command)
+    return [seg.text for seg in segments], ops
 
 
-def evaluate_segment(segment: str, rules: list[dict[str, Any]]) -> dict[str, Any]:
-    for pat in DISALLOWED_PATTERNS:
-        if re.search(pat, segment, re.IGNORECASE):
-            return {
-                'segment': segment,
-                'decision': 'rejected',
-                'matchedRules': [{'id': 'disallowed-pattern', 'decision': 'rejected', 'pattern': pat}],
-                'error': 'disallowed_pattern_detected'
-            }
+def evaluate_segment(segment: str, rules: list[dict[str, Any]], matcher: RuleMatcher | None = None,
+                     profiler: RuleProfiler | None = None, argv: list[str] | None = None) -> dict[str, Any]:
+    """Decision for one segment; `argv` (default: the text split on whitespace) selects program rules."""
+    if matcher is None:
+        matcher = RuleMatcher(rules)
+    if argv is None:
+        argv = segment.split()
+    rejected = _precheck_segment(segment, matcher)
+    if rejected is not None:
+        return rejected
+    indices, unsafe, error = matcher.scan_bounded(
+        segment, profiler.recorder(matcher.rules) if profiler is not None else None, argv)
+    return _segment_result(segment, matcher, indices, unsafe, error)
 
-    matched: list[dict[str, str]] = []
-    for rule in rules:
-        pat = rule.get('pattern', '^$')
-        try:
-            if re.search(pat, segment):
-                matched.append({
-                    'id': rule.get('id', 'unknown'),
-                    'decision': rule.get('decision', 'rejected'),
-                    'pattern': pat,
-                })
-        except re.error:
-            continue
+
+def _precheck_segment(segment: str, matcher: RuleMatcher) -> dict[str, Any] | None:
+    """Rejection that does not depend on the rules (oversized segment, disallowed pattern), else None."""
+    max_len = matcher.safety['maxSegmentLength']
+    if max_len and len(segment) > max_len:
+        return {
+            'segment': segment,
+            'decision': 'rejected',
+            'matchedRules': [{'id': 'segment-too-long', 'decision': 'rejected', 'pattern': ''}],
+            'error': 'segment_too_long',
+            'maxSegmentLength': max_len,
+        }
+
+    hit = _DISALLOWED.search_first(segment)
+    if hit is not None:
+        return {
+            'segment': segment,
+            'decision': 'rejected',
+            'matchedRules': [{'id': 'disallowed-pattern', 'decision': 'rejected', 'pattern': DISALLOWED_PATTERNS[hit]}],
+            'error': 'disallowed_pattern_detected'
+        }
+    return None
+
+
+def _segment_result(segment: str, matcher: RuleMatcher, indices: list[int], unsafe: list[int],
+                    error: str | None) -> dict[str, Any]:
+    """Evaluation of `segment` from a `scan_bounded` result against `matcher`'s rules."""
+    if error:
+        return {
+            'segment': segment,
+            'decision': 'rejected',
+            'matchedRules': [{'id': 'evaluation-budget', 'decision': 'rejected', 'pattern': ''}],
+            'error': error,
+        }
+    matched = matcher.describe(indices)
+    if unsafe and matcher.safety['onUnsafe'] == 'reject':
+        return {
+            'segment': segment,
+            'decision': 'rejected',
+            'matchedRules': matched + [
+                {'id': matcher.rules[idx].get('id', 'unknown'), 'decision': 'rejected',
+                 'pattern': matcher.patterns[idx], 'unsafe': matcher.unsafe.get(idx, '')}
+                for idx in unsafe],
+            'error': 'unsafe_policy_pattern',
+        }
+
+    skipped = {'skippedUnsafeRules': [matcher.rules[idx].get('id', 'unknown') for idx in unsafe]} if unsafe else {}
 
     if not matched:
         return {
             'segment': segment,
             'decision': 'ask',
             'matchedRules': [{'id': 'no_match', 'decision': 'ask', 'pattern': ''}],
-            'error': 'no_matching_policy_rule'
+            'error': 'no_matching_policy_rule',
+            **skipped,
         }
 
     decisions = {m['decision'] for m in matched}
@@ -149,22 +1433,79 @@ def evaluate_segment(segment: str, rules: list[dict[str, Any]]) -> dict[str, Any
     else:
         d = 'rejected'
 
-    return {'segment': segment, 'decision': d, 'matchedRules': matched}
+    out = {'segment': segment, 'decision': d, 'matchedRules': matched, **skipped}
+    if all(matcher.rules[idx].get('parallel') is True for idx in indices):
+        out['parallelSafe'] = True
+    return out
+
+
+# Timing-dependent outcomes, and oversized segments that would bloat the cache.
+_UNCACHED_ERRORS = ('policy_evaluation_budget_exceeded', 'segment_too_long')
+
 
+def evaluate_segment_cached(seg: Segment, compiled: CompiledPolicy) -> dict[str, Any]:
+    if PROFILER is not None:
+        return evaluate_segment(seg.text, compiled.rules, compiled.matcher, PROFILER, seg.argv)
+    key = tuple(seg.argv)
+    cached = DECISION_CACHE.get(compiled.fingerprint, key)
+    if cached is not None:
+        return cached
+    evaluation = evaluate_segment(seg.text, compiled.rules, compiled.matcher, argv=seg.argv)
+    if evaluation.get('error') not in _UNCACHED_ERRORS:
+        DECISION_CACHE.put(compiled.fingerprint, key, evaluation)
+    return evaluation
 
-def analyze(command: str) -> dict[str, Any]:
+
+class _MainThreadRunner:
+    """Runs calls submitted from other threads on the main thread (see `serve`).
+
+    The evaluation budget can only interrupt a regex on the main thread, so the
+    daemon funnels every analysis through here.
+    """
+
+    def __init__(self):
+        self.calls: queue.Queue = queue.Queue()
+
+    def call(self, fn, *args):
+        import concurrent.futures
+        fut: concurrent.futures.Future = concurrent.futures.Future()
+        self.calls.put((fn, args, fut))
+        return fut.result()
+
+    def run_forever(self) -> None:
+        while True:
+            fn, args, fut = self.calls.get()
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(fn(*args))
+            except Exception as e:
+                fut.set_exception(e)
+
+
+_main_runner: _MainThreadRunner | None = None
+
+
+def analyze(command: str, compiled: CompiledPolicy | None = None) -> dict[str, Any]:
+    return analyze_chain(command, compiled)[0]
+
+
+def analyze_chain(command: str, compiled: CompiledPolicy | None = None) -> tuple[dict[str, Any], list[Segment]]:
+    """analyze() result plus the parsed segments (empty when the command did not parse), for execute."""
+    if _main_runner is not None and threading.current_thread() is not threading.main_thread():
+        return _main_runner.call(analyze_chain, command, compiled)
     command = (command or '').strip()
     if not command:
-        return _reject('empty_command')
+        return _reject('empty_command'), []
 
     try:
-        segments, ops = tokenize_chain(command)
+        segments, ops = split_chain(command)
     except ValueError as e:
-        return _reject(str(e))
+        return _reject(str(e)), []
 
-    policy = load_policy()
-    rules = policy.get('rules', [])
-    evals = [evaluate_segment(seg, rules) for seg in segments]
+    if compiled is None:
+        compiled = current_policy()
+    evals = [evaluate_segment_cached(seg, compiled) for seg in segments]
 
     decisions = [e['decision'] for e in evals]
     if 'rejected' in decisions:
@@ -189,17 +1530,349 @@ def analyze(command: str) -> dict[str, Any]:
         'decision': overall,
         'matchedRuleIds': matched_ids,
         'ts': now_iso(),
-    }
+    }, segments
 
 
-def run_segment(segment: str, cwd: str):
-    argv = shlex.split(segment)
-    if not argv:
-        return {'ok': False, 'error': 'empty_argv', 'segment': segment}, cwd, 2
+SEGMENT_TIMEOUT = 120
 
-    if argv[0] == 'cd':
+# Wall-clock budget for a whole chain, in seconds (execute(timeout=) / `execute --timeout`
+# override it). Each segment runs with what is left of it, capped at SEGMENT_TIMEOUT; a
+# segment that runs out is killed with its whole process group (SIGTERM, then SIGKILL
+# after KILL_GRACE seconds), and segments after the deadline do not start.
+EXECUTE_TIMEOUT = max(1, _env_int('GUARD_EXECUTE_TIMEOUT', 300))
+KILL_GRACE = 2
+TIMEOUT_EXIT_CODE = 124
+
+# Output kept per stream: the last *_TAIL bytes (reported as stdout/stderr, as
+# before) and, when the stream was longer than that, the first *_HEAD bytes plus
+# a count of the bytes dropped in between. Memory per segment stays fixed no
+# matter how much a command prints.
+STDOUT_TAIL, STDOUT_HEAD = 6000, 2000
+STDERR_TAIL, STDERR_HEAD = 4000, 1000
+
+# Optional full copy of each stream on disk, rotated (one .1 generation) once a
+# file reaches GUARD_OUTPUT_SPILL_MAX_BYTES.
+OUTPUT_SPILL_DIR = os.environ.get('GUARD_OUTPUT_SPILL_DIR', '')
+OUTPUT_SPILL_MAX_BYTES = _env_int('GUARD_OUTPUT_SPILL_MAX_BYTES', 64 * 1024 * 1024)
+
+_spill_seq = itertools.count(1)
+
+
+def _decode_output(data: bytes) -> str:
+    # Same text as subprocess.run(text=True): UTF-8 with universal newlines.
+    return data.decode('utf-8', errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+
+class _SpillFile:
+    def __init__(self, path: pathlib.Path, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.f = open(path, 'wb')
+
+    def write(self, data: bytes) -> None:
+        if self.max_bytes > 0 and self.written + len(data) > self.max_bytes and self.written:
+            self.f.close()
+            os.replace(self.path, self.path.with_name(self.path.name + '.1'))
+            self.f = open(self.path, 'wb')
+            self.written = 0
+        self.f.write(data)
+        self.written += len(data)
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class OutputWindow:
+    """Fixed-size head and tail windows over a byte stream, plus the total length seen."""
+
+    def __init__(self, head_size: int, tail_size: int, spill: _SpillFile | None = None):
+        self.head_size = head_size
+        self.tail_size = tail_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.spill = spill
+
+    def feed(self, data: bytes) -> None:
+        self.total += len(data)
+        if len(self.head) < self.head_size:
+            self.head += data[:self.head_size - len(self.head)]
+        self.tail += data[-self.tail_size:]
+        if len(self.tail) > self.tail_size:
+            del self.tail[:len(self.tail) - self.tail_size]
+        if self.spill is not None:
+            self.spill.write(data)
+
+    def close(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+
+    def fields(self, name: str) -> dict[str, Any]:
+        tail = bytes(self.tail)
+        if self.total > len(tail):
+            # The window may start inside a multi-byte character.
+            while tail[:1] and 0x80 <= tail[0] < 0xC0:
+                tail = tail[1:]
+        out: dict[str, Any] = {name: _decode_output(tail)}
+        if self.total > self.tail_size:
+            head = bytes(self.head[:min(self.head_size, self.total - self.tail_size)])
+            out[name + 'Head'] = _decode_output(head)
+            out[name + 'TruncatedBytes'] = self.total - len(head) - len(tail)
+        if self.spill is not None:
+            out[name + 'Spill'] = str(self.spill.path)
+        return out
+
+
+def _open_windows(argv: list[str]) -> dict[str, OutputWindow]:
+    spills: dict[str, _SpillFile | None] = {'stdout': None, 'stderr': None}
+    if OUTPUT_SPILL_DIR:
+        base = pathlib.Path(OUTPUT_SPILL_DIR)
+        try:
+            base.mkdir(parents=True, exist_ok=True)
+            stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_spill_seq)}-{pathlib.Path(argv[0]).name}"
+            for name in spills:
+                spills[name] = _SpillFile(base / f'{stem}.{name}.log', OUTPUT_SPILL_MAX_BYTES)
+        except OSError:
+            pass
+    return {
+        'stdout': OutputWindow(STDOUT_HEAD, STDOUT_TAIL, spills['stdout']),
+        'stderr': OutputWindow(STDERR_HEAD, STDERR_TAIL, spills['stderr']),
+    }
+
+
+def _stream_process(proc: subprocess.Popen, windows: dict[str, OutputWindow], timeout: float,
+                    on_output=None) -> bool:
+    """Pump the child's stdout/stderr into `windows` until both close; False on timeout."""
+    decoders = {name: codecs.getincrementaldecoder('utf-8')(errors='replace') for name in windows}
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as sel:
+        sel.register(proc.stdout, selectors.EVENT_READ, 'stdout')
+        sel.register(proc.stderr, selectors.EVENT_READ, 'stderr')
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            for key, _ in sel.select(remaining):
+                data = os.read(key.fd, 65536)
+                if not data:
+                    sel.unregister(key.fileobj)
+                    continue
+                windows[key.data].feed(data)
+                if on_output is not None:
+                    text = decoders[key.data].decode(data)
+                    if text:
+                        on_output(key.data, text)
+    import subprocess
+    try:
+        proc.wait(max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        return False
+    return True
+
+
+# Execution admission control (see "Admission control" above). Overridable per
+# policy under "scheduler"; a rule caps the segments it matches with "maxConcurrent".
+SCHEDULER_DEFAULTS: dict[str, Any] = {
+    'maxConcurrent': max(2, 2 * (os.cpu_count() or 1)),
+    'maxQueue': 64,
+    'maxQueueWaitMs': 30000,
+    'programs': {},
+}
+ADMISSION_EXIT_CODE = 75  # EX_TEMPFAIL: the command did not run and may be retried
+
+
+def _is_cap(val: Any) -> bool:
+    return isinstance(val, int) and not isinstance(val, bool) and val >= 1
+
+
+def scheduler_settings(policy: dict[str, Any]) -> dict[str, Any]:
+    """The policy's scheduler settings merged over SCHEDULER_DEFAULTS (invalid values ignored),
+    plus `rules`: {rule id: maxConcurrent} for the rules that set a cap."""
+    out = dict(SCHEDULER_DEFAULTS)
+    cfg = policy.get('scheduler')
+    if isinstance(cfg, dict):
+        if _is_cap(cfg.get('maxConcurrent')):
+            out['maxConcurrent'] = cfg['maxConcurrent']
+        val = cfg.get('maxQueue')
+        if isinstance(val, int) and not isinstance(val, bool) and val >= 0:
+            out['maxQueue'] = val
+        val = cfg.get('maxQueueWaitMs')
+        if isinstance(val, (int, float)) and not isinstance(val, bool) and val >= 0:
+            out['maxQueueWaitMs'] = val
+        if isinstance(cfg.get('programs'), dict):
+            out['programs'] = {k: v for k, v in cfg['programs'].items() if isinstance(k, str) and _is_cap(v)}
+    out['rules'] = {r['id']: r['maxConcurrent'] for r in policy.get('rules', [])
+                    if isinstance(r, dict) and isinstance(r.get('id'), str) and _is_cap(r.get('maxConcurrent'))}
+    return out
+
+
+class AdmissionRejected(Exception):
+    """A segment was not admitted: `error` is admission_timeout or admission_queue_full."""
+
+    def __init__(self, error: str, details: dict[str, Any]):
+        super().__init__(error)
+        self.error = error
+        self.details = details
+
+
+class ExecutionScheduler:
+    """Admits segment processes under the global limit and per-program / per-rule caps.
+
+    Waiters are granted oldest first whenever a slot frees up; one that is held back
+    only by its own program or rule cap does not block those queued behind it.
+    """
+
+    WAIT_SAMPLES = 1024
+
+    def __init__(self, settings: dict[str, Any] | None = None):
+        self.settings = settings or scheduler_settings({})
+        self._cond = threading.Condition()
+        self._running = 0
+        self._held: collections.Counter[str] = collections.Counter()
+        self._queue: collections.deque[dict[str, Any]] = collections.deque()
+        self._waits: collections.deque[float] = collections.deque(maxlen=self.WAIT_SAMPLES)
+        self.admitted = self.delayed = self.timeouts = self.shed = 0
+        self.peak_running = self.peak_queued = 0
+
+    def configure(self, settings: dict[str, Any]) -> None:
+        """Switch to a reloaded policy's settings; running segments keep the slots they hold."""
+        if settings is self.settings:
+            return
+        with self._cond:
+            self.settings = settings
+            self._grant()
+
+    def _caps(self, program: str, rule_ids: Iterable[str]) -> list[tuple[str, int]]:
+        caps = []
+        limit = self.settings['programs'].get(program)
+        if limit:
+            caps.append((f'program:{program}', limit))
+        for rid in dict.fromkeys(rule_ids):
+            limit = self.settings['rules'].get(rid)
+            if limit:
+                caps.append((f'rule:{rid}', limit))
+        return caps
+
+    def _fits(self, caps: list[tuple[str, int]]) -> bool:
+        return self._running < self.settings['maxConcurrent'] and all(self._held[k] < n for k, n in caps)
+
+    def _take(self, caps: list[tuple[str, int]]) -> None:
+        self._running += 1
+        for key, _ in caps:
+            self._held[key] += 1
+        self.peak_running = max(self.peak_running, self._running)
+
+    def _grant(self) -> None:
+        granted = False
+        for ticket in list(self._queue):
+            if self._running >= self.settings['maxConcurrent']:
+                break
+            if self._fits(ticket['caps']):
+                self._take(ticket['caps'])
+                ticket['granted'] = True
+                self._queue.remove(ticket)
+                granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, program: str, rule_ids: Iterable[str] = (), on_queued=None,
+                deadline: float | None = None) -> tuple[list[tuple[str, int]], float]:
+        """Block until a segment running `program` may start; returns (caps for release(), seconds waited).
+
+        Raises AdmissionRejected when the queue is full or the wait runs past maxQueueWaitMs, or
+        past `deadline` (time.monotonic()) if that comes first (error chain_deadline_exceeded).
+        `on_queued(depth)` is called when the segment has to wait.
+        """
+        caps = self._caps(program, rule_ids)
+        with self._cond:
+            if self._fits(caps):
+                self._take(caps)
+                self.admitted += 1
+                self._waits.append(0.0)
+                return caps, 0.0
+            if len(self._queue) >= self.settings['maxQueue']:
+                self.shed += 1
+                raise AdmissionRejected('admission_queue_full', {'queueDepth': len(self._queue)})
+            ticket = {'caps': caps, 'granted': False}
+            self._queue.append(ticket)
+            depth = len(self._queue)
+            self.peak_queued = max(self.peak_queued, depth)
+            max_wait = self.settings['maxQueueWaitMs'] / 1000
+        started = time.monotonic()
+        limit = max_wait if deadline is None else min(max_wait, deadline - started)
+        if on_queued is not None:
+            on_queued(depth)
+        with self._cond:
+            self._cond.wait_for(lambda: ticket['granted'], max(limit - (time.monotonic() - started), 0))
+            waited = time.monotonic() - started
+            if not ticket['granted']:
+                self._queue.remove(ticket)
+                self.timeouts += 1
+                error = 'admission_timeout' if limit == max_wait else 'chain_deadline_exceeded'
+                raise AdmissionRejected(error, {'queuedMs': round(waited * 1000, 3), 'queueDepth': len(self._queue)})
+            self.admitted += 1
+            self.delayed += 1
+            self._waits.append(waited)
+            return caps, waited
+
+    def release(self, caps: list[tuple[str, int]]) -> None:
+        with self._cond:
+            self._running -= 1
+            for key, _ in caps:
+                self._held[key] -= 1
+                if not self._held[key]:
+                    del self._held[key]
+            self._grant()
+
+    def stats(self) -> dict[str, Any]:
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                'maxConcurrent': self.settings['maxConcurrent'],
+                'maxQueue': self.settings['maxQueue'],
+                'maxQueueWaitMs': self.settings['maxQueueWaitMs'],
+                'running': self._running,
+                'queued': len(self._queue),
+                'held': dict(self._held),
+                'peakRunning': self.peak_running,
+                'peakQueued': self.peak_queued,
+                'admitted': self.admitted,
+                'delayed': self.delayed,
+                'timeouts': self.timeouts,
+                'shed': self.shed,
+                'waitMs': {
+                    'samples': len(waits),
+                    'p50': round(waits[len(waits) // 2] * 1000, 3) if waits else None,
+                    'p99': round(waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000, 3) if waits else None,
+                    'max': round(waits[-1] * 1000, 3) if waits else None,
+                },
+            }
+
+
+SCHEDULER = ExecutionScheduler()
+
+
+def run_segment(seg: Segment, cwd: str, on_event=None, index: int = 0, rule_ids: Iterable[str] = (),
+                deadline: float | None = None, env: dict[str, str] | None = None):
+    """Run one segment (or the `cd` builtin); returns (result, cwd after it, exit status).
+
+    `deadline` (time.monotonic(), default EXECUTE_TIMEOUT from now) bounds both the
+    admission wait and the run. `env` (default: this process's) is the environment
+    the segment runs with and the HOME that `cd ~` goes to.
+    """
+    segment, argv = seg
+    if deadline is None:
+        deadline = time.monotonic() + EXECUTE_TIMEOUT
+    if not argv:
+        return {'ok': False, 'error': 'empty_argv', 'segment': segment}, cwd, 2
+
+    if argv[0] == 'cd':
         target = argv[1] if len(argv) > 1 else '~'
-        new_cwd = pathlib.Path(target).expanduser()
+        if env is not None and 'HOME' in env and (target == '~' or target.startswith('~/')):
+            new_cwd = pathlib.Path(env['HOME'] + target[1:])
+        else:
+            new_cwd = pathlib.Path(target).expanduser()
         if not new_cwd.is_absolute():
             new_cwd = pathlib.Path(cwd) / new_cwd
         try:
@@ -211,12 +1884,91 @@ def run_segment(segment: str, cwd: str):
             return {'ok': False, 'error': 'cd_target_not_directory', 'segment': segment, 'target': target}, cwd, 1
         return {'ok': True, 'builtin': 'cd', 'cwd': resolved, 'segment': segment}, resolved, 0
 
+    on_queued = None
+    if on_event is not None:
+        def on_queued(depth: int) -> None:
+            on_event({'event': 'segment_queued', 'index': index, 'argv': argv, 'queueDepth': depth, 'ts': now_iso()})
+
     try:
-        proc = subprocess.run(argv, capture_output=True, text=True, timeout=120, cwd=cwd)
+        if deadline <= time.monotonic():
+            raise AdmissionRejected('chain_deadline_exceeded', {})
+        caps, waited = SCHEDULER.acquire(os.path.basename(argv[0]), rule_ids, on_queued, deadline)
+    except AdmissionRejected as e:
+        rc = TIMEOUT_EXIT_CODE if e.error == 'chain_deadline_exceeded' else ADMISSION_EXIT_CODE
+        if on_event is not None:
+            on_event({'event': 'segment_end', 'index': index, 'exitCode': rc, 'error': e.error})
+        return {'ok': False, 'error': e.error, 'argv': argv, 'segment': segment, **e.details}, cwd, rc
+    try:
+        out, rc = _run_process(argv, segment, cwd, on_event, index, deadline, env)
+    finally:
+        SCHEDULER.release(caps)
+    if waited:
+        out['queuedMs'] = round(waited * 1000, 3)
+    return out, cwd, rc
+
+
+def _kill_process_group(proc: subprocess.Popen) -> None:
+    """SIGTERM the child's process group, SIGKILL whatever is left after KILL_GRACE seconds, reap the child."""
+    import subprocess
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(proc.pid, sig)
+        except OSError:
+            pass  # the group is already gone
+        if sig == signal.SIGTERM:
+            try:
+                proc.wait(KILL_GRACE)
+            except subprocess.TimeoutExpired:
+                pass
+    proc.wait()
+
+
+def _run_process(argv: list[str], segment: str, cwd: str, on_event, index: int,
+                 deadline: float, env: dict[str, str] | None = None) -> tuple[dict[str, Any], int]:
+    import subprocess
+    started = time.monotonic()
+    timeout = min(SEGMENT_TIMEOUT, deadline - started)
+    if timeout <= 0:  # admitted only as the deadline passed
+        if on_event is not None:
+            on_event({'event': 'segment_end', 'index': index, 'exitCode': TIMEOUT_EXIT_CODE,
+                      'error': 'chain_deadline_exceeded'})
+        return {'ok': False, 'error': 'chain_deadline_exceeded', 'argv': argv, 'segment': segment}, TIMEOUT_EXIT_CODE
+    try:
+        # A session of its own makes the child a process-group leader, so a timeout
+        # can kill everything it started, not just the child.
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, env=env,
+                                start_new_session=True)
     except FileNotFoundError:
-        return {'ok': False, 'error': 'command_not_found', 'argv': argv, 'segment': segment}, cwd, 127
-    except subprocess.TimeoutExpired:
-        return {'ok': False, 'error': 'command_timeout', 'argv': argv, 'segment': segment}, cwd, 124
+        return {'ok': False, 'error': 'command_not_found', 'argv': argv, 'segment': segment}, 127
+
+    on_output = None
+    if on_event is not None:
+        on_event({'event': 'segment_start', 'index': index, 'argv': argv, 'ts': now_iso()})
+
+        def on_output(stream: str, text: str) -> None:
+            on_event({'event': 'output', 'index': index, 'stream': stream, 'data': text})
+
+    windows = _open_windows(argv)
+    try:
+        finished = _stream_process(proc, windows, timeout, on_output)
+        if not finished:
+            _kill_process_group(proc)
+    finally:
+        proc.stdout.close()
+        proc.stderr.close()
+        for w in windows.values():
+            w.close()
+
+    duration_ms = round((time.monotonic() - started) * 1000, 3)
+    if not finished:
+        error = 'command_timeout' if timeout == SEGMENT_TIMEOUT else 'chain_deadline_exceeded'
+        out = {'ok': False, 'error': error, 'argv': argv, 'segment': segment, 'durationMs': duration_ms,
+               'timeoutMs': round(timeout * 1000, 3)}
+        out.update(windows['stdout'].fields('stdout'))
+        out.update(windows['stderr'].fields('stderr'))
+        if on_event is not None:
+            on_event({'event': 'segment_end', 'index': index, 'exitCode': TIMEOUT_EXIT_CODE, 'error': error})
+        return out, TIMEOUT_EXIT_CODE
 
     out = {
         'ok': proc.returncode == 0,
@@ -224,14 +1976,71 @@ def run_segment(segment: str, cwd: str):
         'segment': segment,
         'cwd': cwd,
         'exitCode': proc.returncode,
-        'stdout': (proc.stdout or '')[-6000:],
-        'stderr': (proc.stderr or '')[-4000:],
+        'durationMs': duration_ms,
     }
-    return out, cwd, proc.returncode
+    out.update(windows['stdout'].fields('stdout'))
+    out.update(windows['stderr'].fields('stderr'))
+    if on_event is not None:
+        on_event({'event': 'segment_end', 'index': index, 'exitCode': proc.returncode})
+    return out, proc.returncode
+
+
+# Opt-in concurrent execution of runs of ';'-joined parallel-safe segments.
+PARALLEL_SEGMENTS = os.environ.get('GUARD_PARALLEL_SEGMENTS', '') in ('1', 'true', 'yes')
+PARALLEL_MAX = max(1, _env_int('GUARD_PARALLEL_MAX', 4))
+
+
+def _parallel_runs(evals: list[dict[str, Any]], ops: list[str], segments: list[Segment]) -> list[tuple[int, int]]:
+    """Split segment indices into [start, end) runs; runs longer than one may execute concurrently.
+
+    A run is a maximal sequence of parallelSafe segments joined by ';'. `cd` never
+    joins a run (it changes cwd for what follows), and '&&' always ends one, so
+    short-circuiting and cwd propagation stay sequential.
+    """
+    def safe(i: int) -> bool:
+        if not evals[i].get('parallelSafe'):
+            return False
+        argv = segments[i].argv
+        return bool(argv) and argv[0] != 'cd'
+
+    runs: list[tuple[int, int]] = []
+    start = 0
+    n = len(evals)
+    while start < n:
+        end = start + 1
+        if safe(start):
+            while end < n and ops[end - 1] == ';' and safe(end):
+                end += 1
+        runs.append((start, end))
+        start = end
+    return runs
 
 
-def execute(command: str) -> dict[str, Any]:
-    analysis = analyze(command)
+def execute(command: str, cwd: str | None = None, on_event=None, parallel: bool | None = None,
+            timeout: float | None = None, env: dict[str, str] | None = None) -> dict[str, Any]:
+    """Analyze `command` and run its segments if allowed, each with the argv it was analyzed with.
+
+    `on_event`, when given, receives NDJSON-ready progress dicts
+    (segment_start / output / segment_end) while segments run. With `parallel`
+    (default: GUARD_PARALLEL_SEGMENTS), runs of parallel-safe segments execute
+    concurrently on up to GUARD_PARALLEL_MAX threads; results keep input order.
+    Each spawned segment first waits for admission by SCHEDULER; one that is not
+    admitted fails with admission_timeout / admission_queue_full without running.
+    The whole chain shares a deadline `timeout` seconds (default EXECUTE_TIMEOUT)
+    after the call; every result carries elapsedMs and remainingMs against it.
+    Segments run with `env` (default: this process's environment).
+    """
+    started = time.monotonic()
+    budget = timeout if timeout is not None and timeout > 0 else EXECUTE_TIMEOUT
+    deadline = started + budget
+
+    def timed(out: dict[str, Any]) -> dict[str, Any]:
+        now = time.monotonic()
+        out['elapsedMs'] = round((now - started) * 1000, 3)
+        out['remainingMs'] = round(max(deadline - now, 0) * 1000, 3)
+        return out
+
+    analysis, segments = analyze_chain(command)
     if not analysis.get('ok'):
         return analysis
     decision = analysis.get('decision')
@@ -244,45 +2053,1145 @@ def execute(command: str) -> dict[str, Any]:
             'ts': now_iso(),
         }
 
-    segments = [s['segment'] for s in analysis['segments']]
+    rule_ids = [[m.get('id') for m in s.get('matchedRules', [])] for s in analysis['segments']]
     ops = analysis['operators']
+    SCHEDULER.configure(current_policy().scheduler)
 
-    cwd = str(pathlib.Path.cwd())
+    cwd = cwd or str(pathlib.Path.cwd())
     results = []
     prev_rc = 0
+    if parallel is None:
+        parallel = PARALLEL_SEGMENTS
+    runs = _parallel_runs(analysis['segments'], ops, segments) if parallel else [(i, i + 1) for i in range(len(segments))]
 
-    for idx, seg in enumerate(segments):
-        if idx > 0 and ops[idx - 1] == '&&' and prev_rc != 0:
-            results.append({'ok': False, 'segment': seg, 'skipped': True, 'reason': 'previous_failed_with_and'})
+    for start, end in runs:
+        if start > 0 and ops[start - 1] == '&&' and prev_rc != 0:
+            results.append(timed({'ok': False, 'segment': segments[start].text, 'skipped': True,
+                                  'reason': 'previous_failed_with_and'}))
+            start += 1
+            if start == end:
+                continue
+
+        if end - start == 1:
+            out, cwd, rc = run_segment(segments[start], cwd, on_event, start, rule_ids[start], deadline, env)
+            results.append(timed(out))
+            prev_rc = rc
             continue
 
-        out, cwd, rc = run_segment(seg, cwd)
-        results.append(out)
-        prev_rc = rc
+        # Parallel-safe segments never change cwd; the run's exit status for a
+        # following '&&' is that of its last segment, as in sequential order.
+        # Each segment is timed on its own thread when it finishes, not when
+        # its result is collected.
+        def run_timed(i: int) -> tuple[dict[str, Any], int]:
+            out, _, rc = run_segment(segments[i], cwd, on_event, i, rule_ids[i], deadline, env)
+            out['parallel'] = True
+            return timed(out), rc
+
+        import concurrent.futures
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(PARALLEL_MAX, end - start)) as pool:
+            futures = [pool.submit(run_timed, i) for i in range(start, end)]
+            for fut in futures:
+                out, rc = fut.result()
+                results.append(out)
+                prev_rc = rc
 
     overall_ok = all(r.get('ok') or r.get('skipped') for r in results)
-    return {
+    return timed({
         'ok': overall_ok,
         'decision': 'approved',
         'analysis': analysis,
         'results': results,
         'finalCwd': cwd,
+        'timeoutMs': round(budget * 1000, 3),
+        'ts': now_iso(),
+    })
+
+
+# Audit log: one JSON line per analyze/execute, appended to GUARD_AUDIT_DIR/command-audit.jsonl
+# and rotated (.1 .. .GUARD_AUDIT_KEEP) once it would exceed GUARD_AUDIT_MAX_BYTES. The
+# daemon group-commits: records queue in memory and a writer thread appends them in one
+# write per GUARD_AUDIT_FLUSH_MS window. `audit query` keeps a SQLite index next to the
+# logs, catching up on new lines only.
+AUDIT_ENABLED = os.environ.get('GUARD_AUDIT', '1') not in ('0', 'false', 'no')
+AUDIT_DIR = pathlib.Path(os.environ.get('GUARD_AUDIT_DIR', '/home/node/.openclaw/audit'))
+AUDIT_LOG_NAME = 'command-audit.jsonl'
+AUDIT_INDEX_NAME = 'command-audit.sqlite'
+AUDIT_MAX_BYTES = _env_int('GUARD_AUDIT_MAX_BYTES', 16 * 1024 * 1024)
+AUDIT_KEEP = max(1, _env_int('GUARD_AUDIT_KEEP', 5))
+AUDIT_FLUSH_MS = max(1, _env_int('GUARD_AUDIT_FLUSH_MS', 20))
+AUDIT_FSYNC = os.environ.get('GUARD_AUDIT_FSYNC', '') in ('1', 'true', 'yes')
+
+
+class AuditLog:
+    """Append-only JSONL audit log with size-based rotation.
+
+    `record(build)` takes a callable returning the entry. It appends
+    synchronously until `start()` launches the writer thread; from then on
+    entries are built, encoded and batched on that thread, and each batch is
+    written with a single append (and optional fsync). Appends take an flock on the log so the
+    daemon and in-process fallbacks can share it. Write failures never reach
+    the caller; they are counted in `stats()`.
+    """
+
+    def __init__(self, directory: pathlib.Path, max_bytes: int, keep: int, flush_seconds: float, fsync: bool):
+        self.path = directory / AUDIT_LOG_NAME
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.pending: list[Callable[[], dict[str, Any]]] = []
+        self.cond = threading.Condition()
+        self.writer: threading.Thread | None = None
+        self.stopping = False
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    def record(self, build: Callable[[], dict[str, Any]]) -> None:
+        if self.writer is None:
+            self._write([build])
+            return
+        with self.cond:
+            self.pending.append(build)
+            if len(self.pending) == 1:
+                self.cond.notify()
+
+    def start(self) -> None:
+        if self.writer is None:
+            self.stopping = False
+            self.writer = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self.writer.start()
+
+    def stop(self) -> None:
+        """Flush what is queued and return to synchronous appends."""
+        writer = self.writer
+        if writer is None:
+            return
+        with self.cond:
+            self.stopping = True
+            self.cond.notify()
+        writer.join()
+        self.writer = None
+
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopping:
+                    self.cond.wait()
+                if not self.stopping:
+                    # Group commit: give concurrent requests one window to join the batch.
+                    self.cond.wait(self.flush_seconds)
+                batch, self.pending = self.pending, []
+                stopping = self.stopping
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _open_locked(self) -> int:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)  # rotated by another process between open and lock
+
+    def _rotate(self) -> None:
+        for n in range(self.keep - 1, 0, -1):
+            src = self.path.with_name(f'{self.path.name}.{n}')
+            if src.exists():
+                os.replace(src, self.path.with_name(f'{self.path.name}.{n + 1}'))
+        os.replace(self.path, self.path.with_name(f'{self.path.name}.1'))
+
+    def _write(self, builds: list[Callable[[], dict[str, Any]]]) -> None:
+        lines = []
+        for build in builds:
+            try:
+                lines.append(json.dumps(build(), separators=(',', ':'), default=str).encode('utf-8') + b'\n')
+            except Exception:
+                self.dropped += 1
+        if not lines:
+            return
+        data = b''.join(lines)
+        try:
+            fd = self._open_locked()
+            try:
+                size = os.fstat(fd).st_size
+                if self.max_bytes > 0 and size and size + len(data) > self.max_bytes:
+                    self._rotate()
+                    os.close(fd)
+                    fd = self._open_locked()
+                os.write(fd, data)
+                if self.fsync:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            self.dropped += len(lines)
+            return
+        self.written += len(lines)
+        self.batches += 1
+
+    def stats(self) -> dict[str, Any]:
+        with self.cond:
+            pending = len(self.pending)
+        return {'path': str(self.path), 'written': self.written, 'batches': self.batches,
+                'dropped': self.dropped, 'pending': pending, 'groupCommit': self.writer is not None}
+
+
+AUDIT: AuditLog | None = (
+    AuditLog(AUDIT_DIR, AUDIT_MAX_BYTES, AUDIT_KEEP, AUDIT_FLUSH_MS / 1000.0, AUDIT_FSYNC)
+    if AUDIT_ENABLED else None)
+
+
+def audit_actor() -> str:
+    return os.environ.get('GUARD_AUDIT_ACTOR') or os.environ.get('USER') or f'uid:{os.getuid()}'
+
+
+def audit_entry(mode: str, command: str, res: dict[str, Any], seconds: float, actor: str,
+                cwd: str | None = None, peer: dict[str, int] | None = None,
+                epoch: float | None = None, fingerprint: str | None = None) -> dict[str, Any]:
+    """Audit record for one analyze/execute result: decision, per-segment rules, exit codes and durations."""
+    analysis = res.get('analysis') if isinstance(res.get('analysis'), dict) else res
+    results = res.get('results') or []
+    segments = []
+    for i, seg in enumerate(analysis.get('segments') or []):
+        row: dict[str, Any] = {
+            'segment': seg.get('segment'),
+            'decision': seg.get('decision'),
+            'ruleIds': [m.get('id') for m in seg.get('matchedRules', [])],
+        }
+        if seg.get('error'):
+            row['error'] = seg['error']
+        if i < len(results):
+            r = results[i]
+            for key in ('exitCode', 'durationMs', 'queuedMs', 'skipped', 'builtin'):
+                if key in r:
+                    row[key] = r[key]
+            if r.get('error'):
+                row['error'] = r['error']
+        segments.append(row)
+    epoch = time.time() if epoch is None else epoch
+    entry: dict[str, Any] = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch)),
+        'epoch': round(epoch, 3),
+        'event': mode,
+        'actor': actor,
+        'command': command,
+        'ok': bool(res.get('ok')),
+        'decision': analysis.get('decision') or res.get('decision'),
+        'error': res.get('error'),
+        'durationMs': round(seconds * 1000, 3),
+        'matchedRuleIds': analysis.get('matchedRuleIds', []),
+        'segments': segments,
+        'policyFingerprint': fingerprint or current_policy().fingerprint,
+    }
+    if cwd:
+        entry['cwd'] = cwd
+    if peer:
+        entry['peer'] = peer
+    return entry
+
+
+def audit(mode: str, command: str, res: dict[str, Any], seconds: float, actor: str,
+          cwd: str | None = None, peer: dict[str, int] | None = None) -> None:
+    if AUDIT is None:
+        return
+    epoch, fingerprint = time.time(), current_policy().fingerprint
+    AUDIT.record(lambda: audit_entry(mode, command, res, seconds, actor, cwd, peer, epoch, fingerprint))
+
+
+_AUDIT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    epoch REAL, ts TEXT, event TEXT, actor TEXT, decision TEXT, ok INTEGER, error TEXT,
+    command TEXT, duration_ms REAL, record TEXT
+);
+CREATE INDEX IF NOT EXISTS events_epoch ON events (epoch);
+CREATE INDEX IF NOT EXISTS events_decision_epoch ON events (decision, epoch);
+CREATE INDEX IF NOT EXISTS events_event_duration ON events (event, duration_ms);
+CREATE INDEX IF NOT EXISTS events_actor_epoch ON events (actor, epoch);
+CREATE TABLE IF NOT EXISTS event_rules (event_id INTEGER, rule_id TEXT);
+CREATE INDEX IF NOT EXISTS event_rules_rule ON event_rules (rule_id, event_id);
+CREATE TABLE IF NOT EXISTS ingested (file_key TEXT PRIMARY KEY, offset INTEGER);
+'''
+
+
+def _audit_file_key(path: pathlib.Path) -> str | None:
+    """Identity of a log file that survives rotation (renames): inode plus a hash of its first line."""
+    import hashlib
+    try:
+        with open(path, 'rb') as f:
+            first = f.readline()
+            ino = os.fstat(f.fileno()).st_ino
+    except OSError:
+        return None
+    if not first.endswith(b'\n'):
+        return None
+    return f'{ino}:{hashlib.sha256(first).hexdigest()[:16]}'
+
+
+def audit_index(directory: pathlib.Path | None = None) -> tuple[Any, int]:
+    """Open the SQLite index for the audit logs in `directory` and ingest lines appended since the last call.
+
+    Returns (connection, number of new records). Files are read oldest first,
+    each from the offset recorded for it, so rotated logs are never re-read.
+    """
+    import sqlite3
+
+    directory = directory or AUDIT_DIR
+    conn = sqlite3.connect(str(directory / AUDIT_INDEX_NAME))
+    conn.executescript(_AUDIT_SCHEMA)
+    log = directory / AUDIT_LOG_NAME
+    rotated = [p for p in directory.glob(AUDIT_LOG_NAME + '.*') if p.suffix[1:].isdigit()]
+    rotated.sort(key=lambda p: int(p.suffix[1:]), reverse=True)
+    added = 0
+    with conn:
+        for path in rotated + [log]:
+            key = _audit_file_key(path)
+            if key is None:
+                continue
+            row = conn.execute('SELECT offset FROM ingested WHERE file_key = ?', (key,)).fetchone()
+            offset = row[0] if row else 0
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for raw in f:
+                    if not raw.endswith(b'\n'):
+                        break  # partial line still being written
+                    offset += len(raw)
+                    try:
+                        rec = json.loads(raw)
+                    except ValueError:
+                        continue
+                    if not isinstance(rec, dict):
+                        continue
+                    cur = conn.execute(
+                        'INSERT INTO events (epoch, ts, event, actor, decision, ok, error, command, duration_ms, record)'
+                        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (rec.get('epoch'), rec.get('ts'), rec.get('event'), rec.get('actor'), rec.get('decision'),
+                         int(bool(rec.get('ok'))), rec.get('error'), rec.get('command'), rec.get('durationMs'),
+                         raw.decode('utf-8', errors='replace').rstrip('\n')))
+                    conn.executemany('INSERT INTO event_rules (event_id, rule_id) VALUES (?, ?)',
+                                     [(cur.lastrowid, str(r)) for r in set(rec.get('matchedRuleIds') or [])])
+                    added += 1
+            conn.execute('INSERT OR REPLACE INTO ingested (file_key, offset) VALUES (?, ?)', (key, offset))
+    return conn, added
+
+
+def _parse_since(value: str) -> float:
+    """Epoch seconds for '30m' / '12h' / '7d' / '2w' ago, or an ISO-8601 date/time (UTC when no zone)."""
+    m = re.fullmatch(r'(\d+(?:\.\d+)?)([smhdw])', value.strip())
+    if m:
+        unit = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}[m.group(2)]
+        return time.time() - float(m.group(1)) * unit
+    import datetime
+    dt = datetime.datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def audit_query(directory: pathlib.Path | None = None, since: str | None = None, until: str | None = None,
+                decision: str | None = None, event: str | None = None, actor: str | None = None,
+                rule: str | None = None, contains: str | None = None, failed: bool = False,
+                slowest: bool = False, limit: int = 100) -> dict[str, Any]:
+    """Audit records matching the filters, newest first (or slowest first), from the SQLite index."""
+    directory = directory or AUDIT_DIR
+    if not directory.is_dir():
+        return _reject('audit_dir_not_found', {'dir': str(directory)})
+    try:
+        lo = _parse_since(since) if since else None
+        hi = _parse_since(until) if until else None
+    except ValueError as e:
+        return _reject('invalid_time', {'detail': str(e)})
+    conn, added = audit_index(directory)
+    try:
+        where, params = [], []
+        for column, value in (('decision', decision), ('event', event), ('actor', actor)):
+            if value:
+                where.append(f'{column} = ?')
+                params.append(value)
+        if lo is not None:
+            where.append('epoch >= ?')
+            params.append(lo)
+        if hi is not None:
+            where.append('epoch < ?')
+            params.append(hi)
+        if rule:
+            where.append('id IN (SELECT event_id FROM event_rules WHERE rule_id = ?)')
+            params.append(rule)
+        if contains:
+            where.append("instr(command, ?) > 0")
+            params.append(contains)
+        if failed:
+            where.append('ok = 0')
+        sql = 'SELECT record FROM events'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY duration_ms DESC' if slowest else ' ORDER BY epoch DESC, id DESC'
+        sql += ' LIMIT ?'
+        params.append(limit)
+        rows = [json.loads(r[0]) for r in conn.execute(sql, params)]
+        total = conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+    finally:
+        conn.close()
+    return {'ok': True, 'count': len(rows), 'indexed': total, 'newlyIndexed': added, 'results': rows, 'ts': now_iso()}
+
+
+def engine_stats() -> dict[str, Any]:
+    compiled = current_policy()
+    return {
+        'ok': True,
+        'pid': os.getpid(),
+        'policyFingerprint': compiled.fingerprint,
+        'rules': len(compiled.rules),
+        'regexSafety': compiled.safety,
+        'unsafeRules': compiled.matcher.describe_unsafe(),
+        'decisionCache': DECISION_CACHE.stats(),
+        'scheduler': SCHEDULER.stats(),
+        'audit': AUDIT.stats() if AUDIT is not None else None,
         'ts': now_iso(),
     }
 
 
-def main() -> None:
+# analyze-batch: inputs shorter than this are evaluated in-process; larger ones
+# are split into chunks of BATCH_CHUNK_SIZE lines and spread over a process pool.
+BATCH_POOL_THRESHOLD = 512
+BATCH_CHUNK_SIZE = 128
+
+_batch_compiled: CompiledPolicy | None = None
+
+
+def _batch_init(policy: dict[str, Any]) -> None:
+    global _batch_compiled
+    _batch_compiled = CompiledPolicy(policy)
+
+
+def _analyze_batch_line(lineno: int, line: str, compiled: CompiledPolicy) -> dict[str, Any]:
+    """One JSONL input line -> analyze() result. Lines are a JSON string or {"command": ..., "id": ...}."""
+    try:
+        item = json.loads(line)
+    except ValueError:
+        return _reject('invalid_json_line', {'line': lineno})
+    item_id = None
+    if isinstance(item, dict):
+        item_id = item.get('id')
+        item = item.get('command')
+    if not isinstance(item, str):
+        return _reject('invalid_batch_item', {'line': lineno})
+    res = analyze(item, compiled)
+    if item_id is not None:
+        res['id'] = item_id
+    return res
+
+
+def _analyze_batch_chunk(chunk: list[tuple[int, str]]) -> list[str]:
+    assert _batch_compiled is not None
+    return [json.dumps(_analyze_batch_line(lineno, line, _batch_compiled)) for lineno, line in chunk]
+
+
+def _chunked(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    it = iter(items)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def analyze_batch(lines: Iterable[str], out: TextIO, workers: int) -> dict[str, Any]:
+    """Analyze JSONL commands from `lines`, writing one result line per input line in order.
+
+    The policy is loaded once. Inputs of BATCH_POOL_THRESHOLD lines or more are
+    evaluated by `workers` processes, with at most a few chunks per worker in
+    flight so memory stays bounded on large inputs. Blank lines are skipped.
+    """
+    started = time.perf_counter()
+    compiled = current_policy()
+    numbered = ((n, line) for n, line in enumerate(lines, 1) if line.strip())
+    head = list(itertools.islice(numbered, BATCH_POOL_THRESHOLD))
+    numbered = itertools.chain(head, numbered)
+    count = 0
+
+    if workers <= 1 or len(head) < BATCH_POOL_THRESHOLD:
+        workers = 1
+        for lineno, line in numbered:
+            out.write(json.dumps(_analyze_batch_line(lineno, line, compiled)) + '\n')
+            count += 1
+    else:
+        import concurrent.futures
+        pending: collections.deque[concurrent.futures.Future] = collections.deque()
+
+        def drain_one() -> int:
+            results = pending.popleft().result()
+            out.write('\n'.join(results) + '\n')
+            return len(results)
+
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_batch_init, initargs=(compiled.policy,)) as pool:
+            for chunk in _chunked(numbered, BATCH_CHUNK_SIZE):
+                pending.append(pool.submit(_analyze_batch_chunk, chunk))
+                if len(pending) >= workers * 4:
+                    count += drain_one()
+            while pending:
+                count += drain_one()
+    out.flush()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'ok': True,
+        'mode': 'analyze-batch',
+        'count': count,
+        'workers': workers,
+        'seconds': round(elapsed, 6),
+        'perSecond': round(count / elapsed, 1) if elapsed > 0 else None,
+        'ts': now_iso(),
+    }
+
+
+def handle_request(req: Any, on_event=None, peer: dict[str, int] | None = None) -> dict[str, Any]:
+    """Serve one daemon request: {"mode": "analyze"|"execute"|"stats", "command": "...", "cwd": "...", "actor": "..."}.
+
+    Execute requests carry the client's environment as "env" and run with it.
+    For execute with "progress": true, progress events are passed to `on_event`
+    before the result is returned. Analyze and execute requests are audited
+    with the client's actor and `peer` credentials.
+    """
+    if not isinstance(req, dict):
+        return _reject('invalid_request')
+    mode = req.get('mode')
+    if mode == 'stats':
+        return engine_stats()
+    if mode == 'profile':
+        if PROFILER is None:
+            return _reject('profiling_disabled', {'hint': 'start the daemon with GUARD_PROFILE=1'})
+        return PROFILER.report(current_policy().rules)
+    command = req.get('command')
+    if not isinstance(command, str):
+        return _reject('invalid_request')
+    actor = req.get('actor') if isinstance(req.get('actor'), str) else 'unknown'
+    started = time.monotonic()
+    if mode == 'analyze':
+        res = analyze(command)
+        audit(mode, command, res, time.monotonic() - started, actor, peer=peer)
+        return res
+    if mode == 'execute':
+        cwd = req.get('cwd')
+        if not isinstance(cwd, str) or not os.path.isdir(cwd):
+            return _reject('invalid_cwd')
+        env = req.get('env')
+        if not isinstance(env, dict) or not all(isinstance(k, str) and isinstance(v, str) for k, v in env.items()):
+            return _reject('invalid_env')
+        parallel = req.get('parallel')
+        timeout = req.get('timeout')
+        res = execute(command, cwd=cwd, on_event=on_event if req.get('progress') else None,
+                      parallel=parallel if isinstance(parallel, bool) else None,
+                      timeout=timeout if isinstance(timeout, (int, float)) and not isinstance(timeout, bool) else None,
+                      env=env)
+        audit(mode, command, res, time.monotonic() - started, actor, cwd, peer)
+        return res
+    return _reject('unknown_mode', {'mode': mode})
+
+
+class _EngineRequestHandler(socketserver.StreamRequestHandler):
+    def setup(self) -> None:
+        super().setup()
+        self._send_lock = threading.Lock()
+        self._peer = None
+        try:
+            pid, uid, gid = struct.unpack('3i', self.request.getsockopt(
+                socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+            self._peer = {'pid': pid, 'uid': uid, 'gid': gid}
+        except (AttributeError, OSError):
+            pass
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                req = json.loads(line)
+            except ValueError:
+                res = _reject('invalid_request')
+            else:
+                try:
+                    res = handle_request(req, self._send, self._peer)
+                except Exception as e:
+                    res = _reject('engine_internal_error', {'detail': str(e)})
+            self._send(res)
+
+    def _send(self, obj: dict[str, Any]) -> None:
+        line = json.dumps(obj).encode('utf-8') + b'\n'
+        with self._send_lock:
+            self.wfile.write(line)
+            self.wfile.flush()
+
+
+class _EngineServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128  # listen backlog; the default of 5 refuses bursts of concurrent clients
+
+
+def _flush_profile() -> None:
+    if PROFILER is None or not PROFILE_TEXTFILE:
+        return
+    try:
+        PROFILER.write_textfile(PROFILE_TEXTFILE, current_policy().rules)
+    except OSError:
+        pass
+
+
+def _profile_flush_loop(stop: threading.Event) -> None:
+    while not stop.wait(PROFILE_FLUSH_SECONDS):
+        _flush_profile()
+
+
+def profile_commands(lines: Iterable[str], slow_ms: float) -> tuple[RuleProfiler, int]:
+    """Replay JSONL commands (as for analyze-batch) under a fresh profiler; returns it and the command count."""
+    global PROFILER
+    compiled = current_policy()
+    profiler = RuleProfiler(slow_ms)
+    saved, PROFILER = PROFILER, profiler
+    count = 0
+    try:
+        for lineno, line in enumerate(lines, 1):
+            if line.strip():
+                _analyze_batch_line(lineno, line, compiled)
+                count += 1
+    finally:
+        PROFILER = saved
+    return profiler, count
+
+
+def serve(socket_path: pathlib.Path) -> None:
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(str(socket_path))
+            except OSError:
+                socket_path.unlink()  # stale socket from a previous run
+            else:
+                print(json.dumps(_reject('engine_already_running', {'socket': str(socket_path)})))
+                raise SystemExit(1)
+
+    global _main_runner
+    current_policy()
+    old_umask = os.umask(0o077)
+    try:
+        server = _EngineServer(str(socket_path), _EngineRequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    def _stop(_signum, _frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _stop)
+    stop_flush = threading.Event()
+    if PROFILER is not None and PROFILE_TEXTFILE:
+        threading.Thread(target=_profile_flush_loop, args=(stop_flush,), daemon=True).start()
+    print(json.dumps({'ok': True, 'serving': str(socket_path), 'pid': os.getpid(), 'ts': now_iso()}))
+    sys.stdout.flush()
+    # Connections are served on worker threads; analysis runs on this (main)
+    # thread so the evaluation budget timer can interrupt it.
+    _main_runner = _MainThreadRunner()
+    if AUDIT is not None:
+        AUDIT.start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        _main_runner.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        _main_runner = None
+        server.shutdown()
+        if AUDIT is not None:
+            AUDIT.stop()
+        stop_flush.set()
+        _flush_profile()
+        server.server_close()
+        try:
+            socket_path.unlink()
+        except OSError:
+            pass
+
+
+def _read_policy_file(path: pathlib.Path) -> tuple[bytes, dict[str, Any] | None, dict[str, Any] | None]:
+    """(source bytes, parsed document, error result) for a policy file given on the command line."""
+    try:
+        source = path.read_bytes()
+    except OSError as e:
+        return b'', None, _reject('policy_not_readable', {'policy': str(path), 'detail': str(e)})
+    try:
+        return source, json.loads(source or b'{}'), None
+    except ValueError as e:
+        return source, None, _reject('policy_not_json', {'policy': str(path), 'detail': str(e)})
+
+
+def _policy_report(path: pathlib.Path, raw: Any, compiled: CompiledPolicy) -> dict[str, Any]:
+    errors, warnings = validate_policy(raw)
+    invalid = []
+    for rule, pat in zip(compiled.rules, compiled.matcher.patterns):
+        for pat in (pat, rule['argsPattern']) if 'argsPattern' in rule else (pat,):
+            try:
+                re.compile(pat)
+            except (re.error, TypeError, OverflowError, RecursionError) as e:
+                invalid.append({'id': rule.get('id', 'unknown'), 'pattern': pat, 'error': str(e)})
+    unsafe = compiled.matcher.describe_unsafe()
+    return {
+        'ok': not errors and not invalid and not unsafe,
+        'policy': str(path),
+        'rules': len(compiled.rules),
+        'regexSafety': compiled.safety,
+        'errors': errors,
+        'warnings': warnings,
+        'invalid': invalid,
+        'unsafe': unsafe,
+        'ts': now_iso(),
+    }
+
+
+def check_policy(path: pathlib.Path) -> dict[str, Any]:
+    """Static report on a policy file: structural errors, patterns that do not compile or fail the regex screen."""
+    source, raw, error = _read_policy_file(path)
+    if error:
+        return error
+    return _policy_report(path, raw, CompiledPolicy(parse_policy(source)))
+
+
+def compile_policy(path: pathlib.Path, output: pathlib.Path | None = None) -> dict[str, Any]:
+    """Validate a policy file and write its precompiled artifact (default: next to it).
+
+    Structural errors and patterns that do not compile abort without writing;
+    unsafe patterns are kept (flagged, as at load time).
+    """
+    started = time.perf_counter()
+    source, raw, error = _read_policy_file(path)
+    if error:
+        return error
+    compiled = CompiledPolicy(parse_policy(source))
+    report = _policy_report(path, raw, compiled)
+    if report['errors'] or report['invalid']:
+        return {**report, 'ok': False, 'error': 'policy_invalid'}
+    target = output or policy_artifact_path(path)
+    try:
+        size = write_policy_artifact(compiled, source, target)
+    except OSError as e:
+        return _reject('artifact_not_writable', {'artifact': str(target), 'detail': str(e)})
+    return {
+        'ok': True,
+        'policy': str(path),
+        'artifact': str(target),
+        'bytes': size,
+        'rules': len(compiled.rules),
+        'fingerprint': compiled.fingerprint,
+        'warnings': report['warnings'],
+        'unsafe': report['unsafe'],
+        'seconds': round(time.perf_counter() - started, 6),
+        'ts': now_iso(),
+    }
+
+
+def _rule_key(rule: dict[str, Any]) -> str:
+    return json.dumps(rule, sort_keys=True, separators=(',', ':'), default=str)
+
+
+class PolicyDiff:
+    """Evaluates segments under two compiled policies, re-running only what differs between them.
+
+    Rules are compared by their canonical JSON. When the regexSafety settings
+    are the same, a segment is scanned in full under the old policy only; under
+    the new one just the rules the old policy lacks are scanned, and hits (and
+    unsafe candidates) of rules present in both are carried over to their new
+    positions. Otherwise the new policy is evaluated in full. Results are
+    memoized per segment argv.
+    """
+
+    def __init__(self, old: CompiledPolicy, new: CompiledPolicy):
+        self.old = old
+        self.new = new
+        self.incremental = old.safety == new.safety
+        self.old_keys = [_rule_key(rule) for rule in old.rules]
+        old_set = set(self.old_keys)
+        self.carried: dict[str, list[int]] = {}
+        self.added: list[int] = []
+        for idx, key in enumerate(_rule_key(rule) for rule in new.rules):
+            if key in old_set:
+                self.carried.setdefault(key, []).append(idx)
+            else:
+                self.added.append(idx)
+        self.removed = sum(1 for key in self.old_keys if key not in self.carried)
+        self.added_matcher = RuleMatcher([new.rules[idx] for idx in self.added], new.safety)
+        self.memo: dict[tuple[str, ...], tuple[tuple[str, tuple[str, ...]], tuple[str, tuple[str, ...]]]] = {}
+
+    def _carry(self, indices: list[int]) -> set[int]:
+        return {new_idx for idx in indices for new_idx in self.carried.get(self.old_keys[idx], ())}
+
+    def _evaluate(self, seg: Segment) -> tuple[dict[str, Any], dict[str, Any]]:
+        old, new = self.old, self.new
+        rejected = _precheck_segment(seg.text, old.matcher)
+        if rejected is not None and self.incremental:
+            return rejected, rejected
+        if rejected is not None:
+            return rejected, evaluate_segment(seg.text, new.rules, new.matcher, argv=seg.argv)
+        hits, unsafe, error = old.matcher.scan_bounded(seg.text, argv=seg.argv)
+        old_eval = _segment_result(seg.text, old.matcher, hits, unsafe, error)
+        if not self.incremental or error:
+            return old_eval, evaluate_segment(seg.text, new.rules, new.matcher, argv=seg.argv)
+        added_hits, added_unsafe, error = self.added_matcher.scan_bounded(seg.text, argv=seg.argv)
+        if error:
+            return old_eval, _segment_result(seg.text, new.matcher, [], [], error)
+        new_hits = self._carry(hits) | {self.added[i] for i in added_hits}
+        new_unsafe = self._carry(unsafe) | {self.added[i] for i in added_unsafe}
+        return old_eval, _segment_result(seg.text, new.matcher, sorted(new_hits), sorted(new_unsafe), None)
+
+    def segment(self, seg: Segment) -> tuple[tuple[str, tuple[str, ...]], tuple[str, tuple[str, ...]]]:
+        """((old decision, old matched rule ids), (new decision, new matched rule ids)) for `seg`."""
+        key = tuple(seg.argv)
+        cached = self.memo.get(key)
+        if cached is None:
+            cached = tuple((ev['decision'], tuple(m.get('id') for m in ev['matchedRules']))
+                           for ev in self._evaluate(seg))
+            self.memo[key] = cached
+        return cached
+
+
+def _chain_outcome(results: list[tuple[str, tuple[str, ...]]]) -> dict[str, Any]:
+    """Whole-command decision and matched rule ids from per-segment results, as analyze() combines them."""
+    decisions = {d for d, _ in results}
+    ids: list[str] = []
+    for _, rule_ids in results:
+        for rid in rule_ids:
+            if rid and rid not in ids:
+                ids.append(rid)
+    decision = 'rejected' if 'rejected' in decisions else 'ask' if 'ask' in decisions else 'approved'
+    return {'decision': decision, 'matchedRuleIds': ids}
+
+
+def _command_change(diff: PolicyDiff, command: str) -> Any:
+    """'unparsable', 'same', or {old, new, segments} outcomes of `command` under the two policies."""
+    try:
+        segments, _ = split_chain(command)
+    except ValueError:
+        return 'unparsable'
+    per_segment = [diff.segment(seg) for seg in segments]
+    old = _chain_outcome([o for o, _ in per_segment])
+    new = _chain_outcome([n for _, n in per_segment])
+    if old['decision'] == new['decision'] and set(old['matchedRuleIds']) == set(new['matchedRuleIds']):
+        return 'same'
+    return {'old': old, 'new': new,
+            'segments': [{'segment': seg.text, 'old': _chain_outcome([o]), 'new': _chain_outcome([n])}
+                         for seg, (o, n) in zip(segments, per_segment) if o != n]}
+
+
+def policy_diff(old_path: pathlib.Path, new_path: pathlib.Path, lines: Iterable[str], out: TextIO) -> dict[str, Any]:
+    """Replay JSONL commands against two policy files; write a line per command whose outcome changes.
+
+    Input lines are in analyze-batch format (the audit log works as-is). A
+    command changes when its decision or its set of matched rule ids differs;
+    commands that do not parse are the same under both policies and are only
+    counted. See PolicyDiff for how the new policy is evaluated.
+    """
+    started = time.perf_counter()
+    compiled = []
+    for path in (old_path, new_path):
+        source, _, error = _read_policy_file(path)
+        if error:
+            return error
+        compiled.append(compile_policy_source(source, None, policy_artifact_path(path)))
+    diff = PolicyDiff(*compiled)
+
+    count = changed = unparsable = invalid = 0
+    transitions: collections.Counter[str] = collections.Counter()
+    # command -> 'same', 'unparsable' or (transition, encoded change) to report for each occurrence.
+    settled: dict[str, Any] = {}
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            invalid += 1
+            continue
+        item_id = None
+        if isinstance(item, dict):
+            item_id = item.get('id')
+            item = item.get('command')
+        if not isinstance(item, str):
+            invalid += 1
+            continue
+        count += 1
+        command = item.strip()
+        change = settled.get(command)
+        if change is None:
+            change = _command_change(diff, command)
+            if isinstance(change, dict):
+                # Encoded once: the rest of the record after "line" and "id".
+                change = (f"{change['old']['decision']}->{change['new']['decision']}",
+                          json.dumps({'command': command, **change})[1:])
+            settled[command] = change
+        if change == 'unparsable':
+            unparsable += 1
+            continue
+        if change == 'same':
+            continue
+        transition, tail = change
+        changed += 1
+        transitions[transition] += 1
+        head = f'{{"line": {lineno}, ' if item_id is None else f'{{"line": {lineno}, "id": {json.dumps(item_id)}, '
+        out.write(head + tail + '\n')
+    out.flush()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'ok': True,
+        'mode': 'policy-diff',
+        'old': str(old_path),
+        'new': str(new_path),
+        'incremental': diff.incremental,
+        'rulesAdded': len(diff.added),
+        'rulesRemoved': diff.removed,
+        'commands': count,
+        'changed': changed,
+        'transitions': dict(transitions),
+        'unparsable': unparsable,
+        'invalidLines': invalid,
+        'distinctSegments': len(diff.memo),
+        'seconds': round(elapsed, 6),
+        'perSecond': round(count / elapsed, 1) if elapsed > 0 else None,
+        'ts': now_iso(),
+    }
+
+
+class DaemonUnavailable(Exception):
+    """The engine daemon could not be reached; the request was not sent."""
+
+
+def daemon_request(payload: dict[str, Any], socket_path: pathlib.Path | None = None, on_event=None) -> dict[str, Any]:
+    """Send one request to the engine daemon and return its response.
+
+    Raises DaemonUnavailable when nothing is listening (safe to fall back to
+    in-process evaluation). Once the request has been sent, a broken connection
+    is reported as an error instead, so an execute is never run twice. Progress
+    lines (objects with an "event" key) that precede the response are passed to
+    `on_event`.
+    """
+    path = str(socket_path or ENGINE_SOCKET_PATH)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(1.0)
+        try:
+            s.connect(path)
+        except OSError as e:
+            raise DaemonUnavailable(str(e)) from None
+        s.settimeout(None)
+        try:
+            s.sendall(json.dumps(payload).encode('utf-8') + b'\n')
+            with s.makefile('rb') as f:
+                for line in f:
+                    msg = json.loads(line)
+                    if isinstance(msg, dict) and 'event' in msg:
+                        if on_event is not None:
+                            on_event(msg)
+                        continue
+                    return msg
+            raise ValueError('connection closed before response')
+        except (OSError, ValueError) as e:
+            return _reject('engine_daemon_connection_lost', {'detail': str(e)})
+    finally:
+        s.close()
+
+
+def _use_daemon() -> bool:
+    return os.environ.get('GUARD_ENGINE_LOCAL', '') not in ('1', 'true', 'yes')
+
+
+def _fast_args(argv: list[str]) -> types.SimpleNamespace | None:
+    """Arguments for a plain `analyze CMD` / `execute CMD [flags]` without building the argparse
+    parser, which costs more than the rest of a daemon round trip; None for anything else."""
+    if len(argv) < 2 or argv[0] not in ('analyze', 'execute') or argv[1].startswith('-'):
+        return None
+    flags = {'--local', '--progress', '--parallel'} if argv[0] == 'execute' else {'--local'}
+    if not set(argv[2:]) <= flags:
+        return None
+    args = types.SimpleNamespace(mode=argv[0], command=argv[1], local='--local' in argv[2:])
+    if argv[0] == 'execute':
+        args.progress = '--progress' in argv[2:]
+        args.parallel = True if '--parallel' in argv[2:] else None
+        args.timeout = None
+    return args
+
+
+def _parse_args() -> Any:
+    import argparse
     ap = argparse.ArgumentParser()
-    ap.add_argument('mode', choices=['analyze', 'execute'])
-    ap.add_argument('command')
-    args = ap.parse_args()
+    sub = ap.add_subparsers(dest='mode', required=True)
+    for mode in ('analyze', 'execute'):
+        p = sub.add_parser(mode)
+        p.add_argument('command')
+        p.add_argument('--local', action='store_true', help='evaluate in-process, bypassing the engine daemon')
+        if mode == 'execute':
+            p.add_argument('--progress', action='store_true', help='stream NDJSON progress events (segment output) to stderr')
+            p.add_argument('--parallel', action='store_true', default=None,
+                           help="run ';'-joined parallel-safe segments concurrently (default: GUARD_PARALLEL_SEGMENTS)")
+            p.add_argument('--timeout', type=float, help='seconds for the whole chain (default: GUARD_EXECUTE_TIMEOUT)')
+    p_serve = sub.add_parser('serve')
+    p_serve.add_argument('--socket', default=str(ENGINE_SOCKET_PATH))
+    sub.add_parser('stats', help='decision-cache counters of the running engine daemon')
+    p_batch = sub.add_parser('analyze-batch', help='analyze JSONL commands, one result line per input line')
+    p_batch.add_argument('--input', default='-', help='JSONL file (default: stdin)')
+    p_batch.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    p_profile = sub.add_parser('profile', help='per-rule evaluation/match counts and cost')
+    p_profile.add_argument('--input', help='replay JSONL commands ("-" for stdin); default: query the running daemon')
+    p_profile.add_argument('--slow-ms', type=float, default=_env_float('GUARD_PROFILE_SLOW_MS', 5))
+    p_profile.add_argument('--textfile', default=PROFILE_TEXTFILE, help='also write a Prometheus textfile here')
+    p_policy = sub.add_parser('policy', help='policy maintenance')
+    policy_sub = p_policy.add_subparsers(dest='policy_mode', required=True)
+    p_check = policy_sub.add_parser('check', help='report rules with invalid or catastrophic-backtracking patterns')
+    p_check.add_argument('--file', default=str(CMD_POLICY_PATH), help='policy file (default: the active policy)')
+    p_compile = policy_sub.add_parser('compile', help='validate the policy and write its precompiled artifact')
+    p_compile.add_argument('--file', default=str(CMD_POLICY_PATH), help='policy file (default: the active policy)')
+    p_compile.add_argument('--output', help='artifact path (default: <policy>.compiled, which the engine loads)')
+    p_diff = policy_sub.add_parser('diff', help='replay commands against two policies and list those whose outcome changes')
+    p_diff.add_argument('old', help='current policy file')
+    p_diff.add_argument('new', help='candidate policy file')
+    p_diff.add_argument('--corpus', default='-', help='JSONL commands, e.g. the audit log (default: stdin)')
+    p_audit = sub.add_parser('audit', help='audit log of analyze/execute decisions')
+    audit_sub = p_audit.add_subparsers(dest='audit_mode', required=True)
+    p_query = audit_sub.add_parser('query', help='query the audit log through its SQLite index')
+    p_query.add_argument('--dir', default=str(AUDIT_DIR), help='audit directory (default: GUARD_AUDIT_DIR)')
+    p_query.add_argument('--since', help="start time: ISO-8601, or relative like '30m', '12h', '7d', '2w'")
+    p_query.add_argument('--until', help='end time (exclusive), same formats as --since')
+    p_query.add_argument('--decision', choices=['approved', 'ask', 'rejected'])
+    p_query.add_argument('--event', choices=['analyze', 'execute'])
+    p_query.add_argument('--actor')
+    p_query.add_argument('--rule', help='only records that matched this rule id')
+    p_query.add_argument('--contains', help='only commands containing this text')
+    p_query.add_argument('--failed', action='store_true', help='only records with ok=false')
+    p_query.add_argument('--slowest', action='store_true', help='order by duration instead of time')
+    p_query.add_argument('--limit', type=int, default=100)
+    return ap.parse_args()
+
+
+def main() -> None:
+    args = _fast_args(sys.argv[1:]) or _parse_args()
+
+    if args.mode == 'audit':
+        res = audit_query(pathlib.Path(args.dir), since=args.since, until=args.until, decision=args.decision,
+                          event=args.event, actor=args.actor, rule=args.rule, contains=args.contains,
+                          failed=args.failed, slowest=args.slowest, limit=args.limit)
+        print(json.dumps(res))
+        raise SystemExit(0 if res.get('ok') else 1)
+
+    if args.mode == 'policy':
+        if args.policy_mode == 'diff':
+            old, new = pathlib.Path(args.old), pathlib.Path(args.new)
+            if args.corpus == '-':
+                res = policy_diff(old, new, sys.stdin, sys.stdout)
+            else:
+                try:
+                    with open(args.corpus, encoding='utf-8') as f:
+                        res = policy_diff(old, new, f, sys.stdout)
+                except OSError as e:
+                    res = _reject('input_not_readable', {'path': args.corpus, 'detail': str(e)})
+            print(json.dumps(res), file=sys.stderr)
+            # Like diff(1): 1 when some command changes, 2 on errors.
+            raise SystemExit(2 if not res.get('ok') else 1 if res['changed'] else 0)
+        if args.policy_mode == 'compile':
+            res = compile_policy(pathlib.Path(args.file), pathlib.Path(args.output) if args.output else None)
+        else:
+            res = check_policy(pathlib.Path(args.file))
+        print(json.dumps(res))
+        raise SystemExit(0 if res.get('ok') else 1)
+
+    if args.mode == 'profile':
+        if args.input is None:
+            try:
+                res = daemon_request({'mode': 'profile'})
+            except DaemonUnavailable:
+                res = _reject('engine_daemon_not_running', {'socket': str(ENGINE_SOCKET_PATH)})
+            print(json.dumps(res))
+            raise SystemExit(0 if res.get('ok') else 1)
+        if args.input == '-':
+            profiler, count = profile_commands(sys.stdin, args.slow_ms)
+        else:
+            try:
+                with open(args.input, encoding='utf-8') as f:
+                    profiler, count = profile_commands(f, args.slow_ms)
+            except OSError as e:
+                print(json.dumps(_reject('input_not_readable', {'path': args.input, 'detail': str(e)})))
+                raise SystemExit(2)
+        res = profiler.report(current_policy().rules)
+        res['commands'] = count
+        if args.textfile:
+            profiler.write_textfile(args.textfile, current_policy().rules)
+            res['textfile'] = args.textfile
+        print(json.dumps(res))
+        return
+
+    if args.mode == 'analyze-batch':
+        if args.input == '-':
+            summary = analyze_batch(sys.stdin, sys.stdout, args.workers)
+        else:
+            try:
+                with open(args.input, encoding='utf-8') as f:
+                    summary = analyze_batch(f, sys.stdout, args.workers)
+            except OSError as e:
+                print(json.dumps(_reject('input_not_readable', {'path': args.input, 'detail': str(e)})))
+                raise SystemExit(2)
+        print(json.dumps(summary), file=sys.stderr)
+        return
+
+    if args.mode == 'serve':
+        serve(pathlib.Path(args.socket))
+        return
+
+    if args.mode == 'stats':
+        try:
+            res = daemon_request({'mode': 'stats'})
+        except DaemonUnavailable:
+            res = _reject('engine_daemon_not_running', {'socket': str(ENGINE_SOCKET_PATH)})
+        print(json.dumps(res))
+        raise SystemExit(0 if res.get('ok') else 1)
+
+    on_event = None
+    if getattr(args, 'progress', False):
+        progress_lock = threading.Lock()
+
+        def on_event(ev: dict[str, Any]) -> None:
+            with progress_lock:
+                sys.stderr.write(json.dumps(ev) + '\n')
+                sys.stderr.flush()
+
+    res = None
+    if _use_daemon() and not args.local:
+        payload = {'mode': args.mode, 'command': args.command, 'actor': audit_actor()}
+        if args.mode == 'execute':
+            payload['cwd'] = str(pathlib.Path.cwd())
+            payload['env'] = dict(os.environ)
+            payload['progress'] = on_event is not None
+            if args.parallel:
+                payload['parallel'] = True
+            if args.timeout is not None:
+                payload['timeout'] = args.timeout
+        try:
+            res = daemon_request(payload, on_event=on_event)
+        except DaemonUnavailable:
+            res = None
 
+    started = time.monotonic()
     if args.mode == 'analyze':
-        res = analyze(args.command)
+        if res is None or res.get('error') == 'engine_daemon_connection_lost':
+            res = analyze(args.command)
+            audit('analyze', args.command, res, time.monotonic() - started, audit_actor())
         print(json.dumps(res))
         raise SystemExit(0 if res.get('ok') else 2)
 
-    res = execute(args.command)
+    if res is None:
+        res = execute(args.command, on_event=on_event, parallel=args.parallel, timeout=args.timeout)
+        audit('execute', args.command, res, time.monotonic() - started, audit_actor(), str(pathlib.Path.cwd()))
     print(json.dumps(res))
     raise SystemExit(0 if res.get('ok') else 1)
 
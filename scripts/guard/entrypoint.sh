@@ -1,4 +1,11 @@
 #!/usr/bin/env bash
-# Guard entrypoint: exec OpenClaw. Bitwarden runs in the worker only; no bridge.
+# Guard entrypoint: start the command-engine daemon, then exec OpenClaw. Bitwarden runs in the worker only; no bridge.
 set -euo pipefail
+SCRIPT_DIR=$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)
+# Keeps the command policy warm for command-engine.py analyze/execute (they fall back to in-process when it is not running).
+# Started through run-cached.py, which also leaves the bytecode cache warm for the `command-engine` wrapper.
+# Set GUARD_ENGINE_DAEMON=0 to disable.
+if [ "${GUARD_ENGINE_DAEMON:-1}" = "1" ]; then
+  python3 "$SCRIPT_DIR/../run-cached.py" "$SCRIPT_DIR/command-engine.py" serve >/dev/null 2>&1 &
+fi
 exec "$@"
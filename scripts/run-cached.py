@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Start a CLI script from cached bytecode: run-cached.py SCRIPT [ARGS...].
+
+`python3 SCRIPT` compiles SCRIPT from source on every run (only imported modules get a
+__pycache__ entry), which for command-engine.py is a large part of a short call. This
+imports SCRIPT as a module instead, so its bytecode is cached, and calls its main() with
+sys.argv as if SCRIPT had been run directly. /opt/op-and-chloe is mounted read-only in the
+containers, so when SCRIPT's directory is not writable the bytecode is kept under
+$XDG_CACHE_HOME/op-and-chloe/pycache (default ~/.cache).
+"""
+import importlib.util
+import os
+import sys
+
+
+def main():
+    if len(sys.argv) < 2:
+        print('usage: run-cached.py SCRIPT [ARGS...]', file=sys.stderr)
+        raise SystemExit(2)
+    path = os.path.abspath(sys.argv[1])
+    if not os.access(os.path.dirname(path), os.W_OK):
+        cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        sys.pycache_prefix = os.path.join(cache_home, 'op-and-chloe', 'pycache')
+    # Registered under its own name so pickling (analyze-batch's process pool) finds it.
+    name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    sys.argv = sys.argv[1:]
+    spec.loader.exec_module(module)
+    module.main()
+
+
+if __name__ == '__main__':
+    main()
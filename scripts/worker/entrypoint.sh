@@ -7,4 +7,10 @@ BW_SESSION_FILE="/home/node/.openclaw/secrets/bw-session"
 export BITWARDENCLI_APPDATA_DIR="/home/node/.openclaw/bitwarden-cli"
 [ -f "$BW_ENV" ] && . "$BW_ENV"
 [ -f "$BW_SESSION_FILE" ] && export BW_SESSION=$(cat "$BW_SESSION_FILE")
+# Keeps the M365 token and Graph connections warm for `m365` (which runs in-process when it is not running).
+# Set M365_AGENT_DAEMON=0 to disable.
+if [ "${M365_AGENT_DAEMON:-1}" = "1" ]; then
+  SCRIPT_DIR=$(cd -- "$(dirname -- "${BASH_SOURCE[0]}")" && pwd)
+  python3 "$SCRIPT_DIR/../run-cached.py" "$SCRIPT_DIR/m365.py" agent >/dev/null 2>&1 &
+fi
 exec "$@"
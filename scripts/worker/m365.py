@@ -1,21 +1,52 @@
 #!/usr/bin/env python3
 import argparse
-import datetime as dt
 import json
 import os
 import pathlib
-import subprocess
 import sys
+import threading
 import time
 import urllib.parse
-import urllib.request
-import urllib.error
+# http.client (with ssl and email), zlib, subprocess, datetime, sqlite3 and random are
+# imported where they are used: every call pays for module-level imports.
+
+
+def env_float(name, default):
+    # Settings from the environment; a malformed value falls back to the default
+    # instead of breaking every subcommand at import.
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
 
 BW_ENV = pathlib.Path('/home/node/.openclaw/secrets/bitwarden.env')
 BW_APPDATA = '/home/node/.openclaw/bitwarden-cli'
 ITEM_NAME = os.environ.get('M365_BW_ITEM', 'o365')
 TOKEN_FILE = pathlib.Path('/home/node/.openclaw/secrets/m365-token.json')
-GRAPH_BASE = 'https://graph.microsoft.com/v1.0'
+TOKEN_LOCK_TIMEOUT = 60  # seconds a caller waits for another one's refresh
+# Overridable so the client can be pointed at a stand-in server (with its CA in M365_CA_BUNDLE).
+GRAPH_BASE = os.environ.get('M365_GRAPH_BASE', 'https://graph.microsoft.com/v1.0').rstrip('/')
+LOGIN_BASE = os.environ.get('M365_LOGIN_BASE', 'https://login.microsoftonline.com').rstrip('/')
+CA_BUNDLE = os.environ.get('M365_CA_BUNDLE', '')
+# Local mail/calendar store kept current with Graph delta queries; empty to always query Graph.
+STORE_PATH = os.environ.get('M365_STORE_PATH', '/home/node/.openclaw/m365-store.sqlite')
+SYNC_MAX_AGE = env_float('M365_SYNC_MAX_AGE', 60)  # seconds a sync is reused
+CALENDAR_SYNC_DAYS = 90
+# Ceiling for the adaptive number of Graph requests in flight at once.
+GRAPH_MAX_CONCURRENCY = max(1, int(env_float('M365_GRAPH_CONCURRENCY', 16)))
+GRAPH_RETRIES = 5
+# `m365 agent` serves the other subcommands from one warm process (see cmd_agent).
+AGENT_SOCKET = pathlib.Path(os.environ.get('M365_AGENT_SOCKET', '/home/node/.openclaw/m365-agent.sock'))
+AGENT_WORKERS = 8
+# While a command runs the agent tells its client it is alive every AGENT_HEARTBEAT
+# seconds; a client that hears nothing for AGENT_TIMEOUT seconds gives up on it.
+AGENT_HEARTBEAT = 5
+AGENT_TIMEOUT = 30
+# Refresh the access token once it has less than this many seconds left, instead of only
+# once it has expired (the agent always uses at least AGENT_REFRESH_AHEAD).
+TOKEN_REFRESH_AHEAD = env_float('M365_TOKEN_REFRESH_AHEAD', 0)
+AGENT_REFRESH_AHEAD = 300
 SCOPES = ['offline_access', 'Mail.Read', 'Calendars.Read']
 
 
@@ -30,26 +61,124 @@ def fail(code, msg, **extra):
     raise SystemExit(code)
 
 
+# Per-thread state: keep-alive connections by (scheme, host, port), shared by every Graph
+# and OAuth call of the thread so only the first call to a host pays for DNS + TCP + TLS,
+# and the store connection. Both go away with the thread.
+_local = threading.local()
+_ssl_context = None
+
+
+def _proxy_for(scheme, host):
+    """(host, port) of the proxy from https_proxy/http_proxy for this host, unless no_proxy exempts it."""
+    proxy = os.environ.get(f'{scheme}_proxy') or os.environ.get(f'{scheme.upper()}_PROXY')
+    if not proxy:
+        return None
+    for entry in (os.environ.get('no_proxy') or os.environ.get('NO_PROXY') or '').split(','):
+        entry = entry.strip().lstrip('.')
+        if entry == '*' or (entry and (host == entry or host.endswith('.' + entry))):
+            return None
+    parts = urllib.parse.urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+    return parts.hostname, parts.port or 80
+
+
+def _connection(scheme, host, port):
+    connections = _local.__dict__.setdefault('connections', {})
+    key = (scheme, host, port)
+    conn = connections.get(key)
+    if conn is None:
+        import http.client
+        proxy = _proxy_for(scheme, host)
+        if scheme == 'https':
+            global _ssl_context
+            if _ssl_context is None:
+                import ssl
+                _ssl_context = ssl.create_default_context(cafile=CA_BUNDLE or None)
+            conn = http.client.HTTPSConnection(*(proxy or (host, port)), context=_ssl_context)
+        else:
+            conn = http.client.HTTPConnection(*(proxy or (host, port)))
+        if proxy:
+            conn.set_tunnel(host, port)
+        connections[key] = conn
+    return conn
+
+
+def http_open(method, url, body=None, headers=None, timeout=30, redirects=5):
+    """Send a request on the pooled connection for url's host and return the unread response.
+
+    Read the response to the end before the next request to the same host. A reused
+    connection that the server has closed in the meantime is reopened and the request
+    sent once more. Redirects are followed as urlopen did (303, and 301/302 after a
+    POST, continue as a GET without the body), except that Authorization is only
+    sent on to the same scheme, host and port. More than `redirects` of them raise
+    HTTPError, as urlopen did.
+    """
+    import http.client
+    parts = urllib.parse.urlsplit(url)
+    target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+    while True:
+        conn = _connection(parts.scheme, parts.hostname, parts.port)
+        reused = conn.sock is not None
+        conn.timeout = timeout
+        if reused:
+            conn.sock.settimeout(timeout)
+        try:
+            conn.request(method, target, body=body, headers=headers or {})
+            resp = conn.getresponse()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused:
+                raise
+        except Exception:
+            conn.close()
+            raise
+    location = resp.getheader('Location')
+    if resp.status not in (301, 302, 303, 307, 308) or not location:
+        return resp
+    resp.read()
+    if redirects <= 0:
+        from urllib.error import HTTPError
+        raise HTTPError(url, resp.status, f'too many redirects (last: {resp.status} {resp.reason})',
+                        resp.headers, None)
+    drop = set()
+    if resp.status == 303 or (resp.status in (301, 302) and method == 'POST'):
+        method, body = 'GET', None
+        drop |= {'content-type', 'content-length'}
+    new_url = urllib.parse.urljoin(url, location)
+    origin = lambda u: (u.scheme, u.hostname, u.port or {'http': 80, 'https': 443}.get(u.scheme))
+    if origin(urllib.parse.urlsplit(new_url)) != origin(parts):
+        drop.add('authorization')  # the bearer token is for this host only
+    headers = {k: v for k, v in (headers or {}).items() if k.lower() not in drop}
+    return http_open(method, new_url, body, headers, timeout, redirects - 1)
+
+
+def read_body(resp):
+    raw = resp.read()
+    if (resp.getheader('Content-Encoding') or '').lower() == 'gzip':
+        import zlib
+        raw = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+    return raw
+
+
 def http_json(method, url, data=None, headers=None, timeout=30):
-    h = {'Accept': 'application/json'}
+    h = {'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
     if headers:
         h.update(headers)
     body = None
     if data is not None:
         body = urllib.parse.urlencode(data).encode('utf-8')
         h['Content-Type'] = 'application/x-www-form-urlencoded'
-    req = urllib.request.Request(url, data=body, headers=h, method=method)
+    resp = http_open(method, url, body, h, timeout)
+    raw = read_body(resp)
+    if resp.status < 400:
+        raw = raw.decode('utf-8')
+        return resp.status, json.loads(raw) if raw else {}
+    raw = raw.decode('utf-8', errors='replace')
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            raw = r.read().decode('utf-8')
-            return r.status, json.loads(raw) if raw else {}
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode('utf-8', errors='replace')
-        try:
-            payload = json.loads(raw)
-        except Exception:
-            payload = {'raw': raw}
-        return e.code, payload
+        payload = json.loads(raw)
+    except Exception:
+        payload = {'raw': raw}
+    return resp.status, payload
 
 
 def load_bw_env():
@@ -67,6 +196,7 @@ def load_bw_env():
 
 
 def bw(env, *args):
+    import subprocess
     p = subprocess.run(['bw', *args], env=env, capture_output=True, text=True)
     if p.returncode != 0:
         raise RuntimeError((p.stderr or p.stdout or '').strip())
@@ -88,9 +218,28 @@ def ensure_bw_session(env):
     return env
 
 
+_config_cache = (None, None)
+
+
 def get_o365_config():
-    # Worker (Chloe): read from config file populated by setup (via bridge from guard's BW)
+    # Cached for as long as the config file is unchanged (or, from Bitwarden, for the
+    # life of the process), which only matters to the long-lived agent.
+    global _config_cache
     config_path = os.environ.get('M365_CONFIG_PATH') or '/home/node/.openclaw/secrets/o365-config.json'
+    try:
+        st = os.stat(config_path)
+        key = (config_path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = (config_path, 'bitwarden')
+    if _config_cache[0] == key:
+        return dict(_config_cache[1])
+    cfg = _load_o365_config(config_path)
+    _config_cache = (key, cfg)
+    return dict(cfg)
+
+
+def _load_o365_config(config_path):
+    # Worker (Chloe): read from config file populated by setup (via bridge from guard's BW)
     cfg_file = pathlib.Path(config_path)
     if cfg_file.exists():
         try:
@@ -127,28 +276,42 @@ def get_o365_config():
     return {'tenant_id': tenant_id, 'client_id': client_id, 'user_email': user_email}
 
 
+_token_cache = (None, {})
+
+
 def token_load():
-    if not TOKEN_FILE.exists():
-        return {}
+    # Parsed once per version of the file (the agent calls this for every command).
+    global _token_cache
     try:
-        return json.loads(TOKEN_FILE.read_text())
-    except Exception:
+        st = TOKEN_FILE.stat()
+    except OSError:
         return {}
+    key = (str(TOKEN_FILE), st.st_mtime_ns, st.st_size, st.st_ino)
+    if _token_cache[0] != key:
+        try:
+            _token_cache = (key, json.loads(TOKEN_FILE.read_text()))
+        except Exception:
+            return {}
+    return dict(_token_cache[1])
 
 
 def token_save(obj):
+    # Written aside and renamed over the old file, so a concurrent reader never sees half of it.
     TOKEN_FILE.parent.mkdir(parents=True, exist_ok=True)
-    TOKEN_FILE.write_text(json.dumps(obj, indent=2) + '\n')
-    os.chmod(TOKEN_FILE, 0o600)
+    tmp = TOKEN_FILE.with_name(f'.{TOKEN_FILE.name}.{os.getpid()}.{threading.get_ident()}')
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        f.write(json.dumps(obj, indent=2) + '\n')
+    os.replace(tmp, TOKEN_FILE)
 
 
-def token_valid(tok):
+def token_valid(tok, ahead=0):
     exp = tok.get('expires_at', 0)
-    return isinstance(exp, (int, float)) and exp > time.time() + 60 and bool(tok.get('access_token'))
+    return isinstance(exp, (int, float)) and exp > time.time() + 60 + ahead and bool(tok.get('access_token'))
 
 
 def oauth_base(tenant_id):
-    return f'https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0'
+    return f'{LOGIN_BASE}/{tenant_id}/oauth2/v2.0'
 
 
 def refresh_token(cfg, tok):
@@ -175,24 +338,668 @@ def refresh_token(cfg, tok):
     return new
 
 
+def refresh_single_flight(cfg, ahead=0, wait=True):
+    # Refresh under an flock on a file next to the token, so concurrent callers (other
+    # processes, agent threads) refresh once: whoever takes the lock first refreshes, the
+    # others wait for it and find its token already saved. wait=False gives up at once
+    # (returning None) while someone else holds the lock.
+    import fcntl
+    TOKEN_FILE.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(TOKEN_FILE.with_name(TOKEN_FILE.name + '.lock'), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if not wait:
+                    return None
+                if time.monotonic() > deadline:
+                    fail(3, 'm365_token_refresh_locked', lock=TOKEN_FILE.name + '.lock')
+                time.sleep(0.05)
+        tok = token_load()
+        if token_valid(tok, ahead):
+            return tok
+        return refresh_token(cfg, tok)
+    finally:
+        os.close(fd)
+
+
 def ensure_access_token(cfg):
     tok = token_load()
-    if token_valid(tok):
+    if token_valid(tok, TOKEN_REFRESH_AHEAD):
         return tok['access_token']
-    new = refresh_token(cfg, tok)
+    if token_valid(tok):
+        # Early refresh: only if nobody else is refreshing, and the current token still
+        # serves if it fails, including when the token endpoint cannot be reached.
+        import http.client
+        try:
+            new = refresh_single_flight(cfg, TOKEN_REFRESH_AHEAD, wait=False)
+        except (OSError, http.client.HTTPException, ValueError):
+            new = None
+        return (new if new and token_valid(new) else tok)['access_token']
+    new = refresh_single_flight(cfg)
     if new and token_valid(new):
         return new['access_token']
     fail(3, 'm365_not_authenticated', hint='run: m365 auth login')
 
 
+class Throttle:
+    # AIMD cap on concurrent Graph requests, shared by every thread: each success raises
+    # the cap by 1/cap (about +1 per round of requests), a 429/503 halves it (once per
+    # round: requests started before the last cut do not cut again) and holds every new
+    # request back until its Retry-After has passed.
+    def __init__(self, start, ceiling):
+        self.cond = threading.Condition()
+        self.limit = float(min(start, ceiling))
+        self.ceiling = ceiling
+        self.inflight = 0
+        self.resume_at = self.cut_at = 0.0
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self.resume_at - time.monotonic()
+                if wait <= 0 and self.inflight < int(self.limit):
+                    break
+                self.cond.wait(wait if wait > 0 else None)
+            self.inflight += 1
+            return time.monotonic()
+
+    def release(self, started, ok=True):
+        with self.cond:
+            self.inflight -= 1
+            if ok:
+                self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def backoff(self, started, delay):
+        with self.cond:
+            now = time.monotonic()
+            if started >= self.cut_at:
+                self.limit = max(1.0, self.limit / 2)
+                self.cut_at = now
+            self.resume_at = max(self.resume_at, now + delay)
+            self.cond.notify_all()
+
+
+_throttle = None
+
+
+def throttle():
+    global _throttle
+    if _throttle is None:
+        _throttle = Throttle(4, GRAPH_MAX_CONCURRENCY)
+    return _throttle
+
+
+RETRYABLE = (429, 500, 502, 503, 504)
+
+
+def retry_delay(headers, attempt):
+    # Retry-After when the response has one, else exponential backoff with full jitter.
+    value = next((v for k, v in (headers or {}).items() if k.lower() == 'retry-after'), None)
+    try:
+        return min(max(float(value), 0), 60)
+    except (TypeError, ValueError):
+        import random
+        return random.uniform(0, min(0.5 * 2 ** attempt, 30))
+
+
+def graph_call(method, url, token, body=None, headers=None, timeout=30):
+    # (status, headers, payload) of a Graph request. Throttled (429/503) and other
+    # transient 5xx answers are retried up to GRAPH_RETRIES times; a throttle also slows
+    # every other request through the shared Throttle.
+    h = {'Authorization': f'Bearer {token}', 'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+    if body is not None:
+        body = json.dumps(body).encode('utf-8')
+        h['Content-Type'] = 'application/json'
+    h.update(headers or {})
+    limiter = throttle()
+    for attempt in range(GRAPH_RETRIES + 1):
+        started = limiter.acquire()
+        try:
+            resp = http_open(method, url, body, h, timeout)
+            raw = read_body(resp)
+        except BaseException:
+            limiter.release(started, ok=False)
+            raise
+        status, resp_headers = resp.status, dict(resp.getheaders())
+        if status in (429, 503):
+            limiter.backoff(started, retry_delay(resp_headers, attempt + 1))
+        limiter.release(started, ok=status < 400)
+        if status not in RETRYABLE or attempt == GRAPH_RETRIES:
+            break
+        if status not in (429, 503):
+            time.sleep(retry_delay(resp_headers, attempt + 1))
+    raw = raw.decode('utf-8', errors='replace')
+    try:
+        payload = json.loads(raw) if raw else {}
+    except ValueError:
+        payload = {'raw': raw}
+    return status, resp_headers, payload
+
+
+def graph_concurrently(calls):
+    # Results of independent zero-argument calls, in order; Throttle decides how many
+    # of their requests are in flight at once. Each call runs in a copy of the caller's
+    # context, so in the agent its output still goes to the caller's client.
+    import concurrent.futures
+    import contextvars
+    calls = list(calls)
+    if len(calls) < 2:
+        return [c() for c in calls]
+    runs = [(contextvars.copy_context(), c) for c in calls]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(calls), GRAPH_MAX_CONCURRENCY)) as pool:
+        return list(pool.map(lambda run: run[0].run(run[1]), runs))
+
+
+def graph_get_url(url, token):
+    status, _, payload = graph_call('GET', url, token)
+    if status >= 400:
+        fail(4, 'graph_request_failed', status=status, response=payload)
+    return payload
+
+
 def graph_get(path, token, query=None):
     url = GRAPH_BASE + path
     if query:
         url += '?' + urllib.parse.urlencode(query)
-    status, payload = http_json('GET', url, headers={'Authorization': f'Bearer {token}'})
+    return graph_get_url(url, token)
+
+
+def graph_pages(path, token, query=None):
+    # Generator: the next page (@odata.nextLink) is only requested once the caller
+    # asks for it, so stopping early never fetches more than needed.
+    payload = graph_get(path, token, query)
+    while True:
+        yield payload
+        link = payload.get('@odata.nextLink')
+        if not link:
+            return
+        if not link.startswith(GRAPH_BASE + '/'):
+            fail(4, 'graph_next_link_unexpected', next_link=link)
+        payload = graph_get_url(link, token)
+
+
+BATCH_MAX = 20  # Graph's limit of requests per JSON $batch
+# Items of a $batch answered with a 429 or transient 5xx are sent once more in a later
+# batch. The $batch POST itself is retried by graph_call, so retrying a whole failed
+# batch here as well would multiply the attempts and undo the Throttle's back-off.
+BATCH_RETRIES = 1
+
+
+def graph_batch(requests, token):
+    # One JSON $batch POST: (status, headers, {request id: response}).
+    status, headers, payload = graph_call('POST', GRAPH_BASE + '/$batch', token, {'requests': requests}, timeout=60)
     if status >= 400:
-        fail(4, 'graph_request_failed', status=status, response=payload)
-    return payload
+        return status, headers, payload
+    return status, {}, {str(r.get('id')): r for r in payload.get('responses', []) if isinstance(r, dict)}
+
+
+DOWNLOAD_CHUNK = 1 << 16
+
+
+def _discard_connection(url):
+    # Close this thread's connection to url's host (e.g. after a response was abandoned
+    # part-way, which leaves the rest of its body on the socket).
+    parts = urllib.parse.urlsplit(url)
+    conn = getattr(_local, 'connections', {}).pop((parts.scheme, parts.hostname, parts.port), None)
+    if conn is not None:
+        conn.close()
+
+
+def download_sidecar(dest):
+    # .<name>.m365 next to a download: {"source": ..., "etag": ..., "length": ...}. It ties
+    # the file (and its .part while incomplete) to what was downloaded into it.
+    return dest.with_name(f'.{dest.name}.m365')
+
+
+def download_source(url):
+    # What a download is of: its Graph path (message and attachment id), not the host.
+    return url[len(GRAPH_BASE):] if url.startswith(GRAPH_BASE + '/') else url
+
+
+def _sidecar_save(dest, state):
+    side = download_sidecar(dest)
+    tmp = side.with_name(side.name + '.tmp')
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, side)
+
+
+def claim_download(dest, source):
+    # Reserve dest for download_source() `source`: 'done' when dest already holds its bytes, 'claimed'
+    # when they are to go there (resuming a .part left by an earlier run for the same
+    # source), None when dest or its .part belongs to something else.
+    side = download_sidecar(dest)
+    try:
+        fd = os.open(side, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        try:
+            owner = json.loads(side.read_text()).get('source')
+        except (OSError, ValueError, AttributeError):
+            owner = None
+        if owner != source:
+            return None
+        return 'done' if dest.exists() else 'claimed'
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'source': source}, f)
+    if dest.exists() or dest.with_name(dest.name + '.part').exists():
+        side.unlink()  # not ours to overwrite or resume
+        return None
+    return 'claimed'
+
+
+def graph_download(url, token, dest):
+    # Stream url's body to dest, DOWNLOAD_CHUNK bytes at a time, through dest + '.part'.
+    # What an interrupted attempt (or an earlier run) left in the .part is kept and the
+    # rest requested with a Range header, and If-Range with the ETag of the bytes already
+    # there; a 200 instead of a 206, or a 206 for a different total length, starts over.
+    # The ETag and length are kept in dest's sidecar (see claim_download).
+    # Returns (status, result): {'bytes', 'resumedFrom'} on success.
+    import http.client
+    part = dest.with_name(dest.name + '.part')
+    try:
+        state = json.loads(download_sidecar(dest).read_text())
+    except (OSError, ValueError):
+        state = {}
+    source = download_source(url)
+    if not isinstance(state, dict) or state.get('source') != source:
+        state = {'source': source}
+    limiter = throttle()
+    resumed_from = None
+    for attempt in range(GRAPH_RETRIES + 1):
+        offset = part.stat().st_size if part.exists() else 0
+        headers = {'Authorization': f'Bearer {token}'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if state.get('etag'):
+                headers['If-Range'] = state['etag']
+        started = limiter.acquire()
+        try:
+            resp = http_open('GET', url, None, headers, timeout=60)
+        except (OSError, http.client.HTTPException):
+            limiter.release(started, ok=False)
+            _discard_connection(url)
+            if attempt == GRAPH_RETRIES:
+                raise
+            time.sleep(retry_delay(None, attempt + 1))
+            continue
+        status = resp.status
+        if status == 416 and offset:
+            resp.read()
+            limiter.release(started)
+            if offset == state.get('length'):
+                break  # nothing left past the end of the .part: an earlier attempt got everything
+            part.unlink()
+            continue
+        if status >= 400:
+            raw = read_body(resp).decode('utf-8', errors='replace')
+            resp_headers = dict(resp.getheaders())
+            if status in (429, 503):
+                limiter.backoff(started, retry_delay(resp_headers, attempt + 1))
+            limiter.release(started, ok=False)
+            if status in RETRYABLE and attempt < GRAPH_RETRIES:
+                if status not in (429, 503):
+                    time.sleep(retry_delay(resp_headers, attempt + 1))
+                continue
+            try:
+                return status, json.loads(raw) if raw else {}
+            except ValueError:
+                return status, {'raw': raw}
+        expected = resp.getheader('Content-Length')
+        total = expected
+        if status == 206:
+            # Content-Range: bytes <first>-<last>/<total>
+            span, _, total = (resp.getheader('Content-Range') or '').rpartition(' ')[2].partition('/')
+            if span.partition('-')[0] != str(offset) or (state.get('length') and total != str(state['length'])):
+                # Not the rest of what the .part holds: drop it and start over.
+                limiter.release(started)
+                _discard_connection(url)
+                part.unlink()
+                continue
+        etag = resp.getheader('ETag') or (state.get('etag') if status == 206 else None)
+        fresh = {'source': source, 'etag': etag if etag and not etag.startswith('W/') else None,
+                 'length': int(total) if total and total.isdigit() else None}
+        if fresh != state:
+            state = fresh
+            _sidecar_save(dest, state)
+        if resumed_from is None:
+            resumed_from = offset if status == 206 else 0
+        received = 0
+        try:
+            with open(part, 'ab' if status == 206 else 'wb') as f:
+                while True:
+                    chunk = resp.read(DOWNLOAD_CHUNK)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    received += len(chunk)
+            complete = expected is None or received == int(expected)
+        except (OSError, http.client.HTTPException):
+            complete = False
+        limiter.release(started, ok=complete)
+        if complete:
+            break
+        _discard_connection(url)
+        if attempt == GRAPH_RETRIES:
+            return 0, {'error': 'download_incomplete', 'bytes': part.stat().st_size if part.exists() else 0}
+        time.sleep(retry_delay(None, attempt + 1))
+    else:
+        return 0, {'error': 'download_incomplete'}
+    os.replace(part, dest)
+    return 200, {'bytes': dest.stat().st_size, 'resumedFrom': resumed_from or 0}
+
+
+def graph_get_many(urls, token, concurrency=2):
+    """Yield (index, status, body) for GETs of Graph `urls` (relative to GRAPH_BASE), in input order.
+
+    URLs go out in $batch requests of up to BATCH_MAX, `concurrency` at a time. Items
+    answered with a 429 or transient 5xx are retried after their Retry-After,
+    up to BATCH_RETRIES times; a $batch POST that fails as a whole (after graph_call's
+    own retries) fails its items. Results that arrive early wait until the ones before
+    them have been yielded.
+    """
+    import concurrent.futures
+    import heapq
+    concurrency = max(1, concurrency)
+    todo = list(range(len(urls)))  # heap of indices ready to send
+    delayed = []  # heap of (monotonic time, index)
+    attempts = [0] * len(urls)
+    done = {}
+    next_out = 0
+
+    def send(indices):
+        reqs = [{'id': str(i), 'method': 'GET', 'url': urls[i]} for i in indices]
+        return indices, graph_batch(reqs, token)
+
+    def settle(i, status, headers, body):
+        if status in RETRYABLE and attempts[i] < BATCH_RETRIES:
+            attempts[i] += 1
+            delay = retry_delay(headers, attempts[i])
+            if status == 429:
+                throttle().backoff(time.monotonic(), delay)
+            heapq.heappush(delayed, (time.monotonic() + delay, i))
+        else:
+            done[i] = (status, body)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        inflight = {}
+        while next_out < len(urls):
+            now = time.monotonic()
+            while delayed and delayed[0][0] <= now:
+                heapq.heappush(todo, heapq.heappop(delayed)[1])
+            while todo and len(inflight) < concurrency:
+                batch = [heapq.heappop(todo) for _ in range(min(BATCH_MAX, len(todo)))]
+                inflight[pool.submit(send, batch)] = batch
+            if inflight:
+                wait = max(delayed[0][0] - now, 0) if delayed else None
+                finished, _ = concurrent.futures.wait(inflight, wait, concurrent.futures.FIRST_COMPLETED)
+                for fut in finished:
+                    del inflight[fut]
+                    indices, (status, headers, responses) = fut.result()
+                    for i in indices:
+                        if status >= 400:
+                            done[i] = (status, responses)
+                        elif str(i) in responses:
+                            r = responses[str(i)]
+                            settle(i, r.get('status', 500), r.get('headers'), r.get('body'))
+                        else:
+                            done[i] = (500, {'error': 'graph_batch_missing_response'})
+            elif delayed:
+                time.sleep(max(delayed[0][0] - time.monotonic(), 0))
+            while next_out in done:
+                status, body = done.pop(next_out)
+                yield next_out, status, body
+                next_out += 1
+
+
+def stream_items(pages, convert, limit=None):
+    # NDJSON: one record per item, flushed as each page arrives, then a summary line.
+    count = npages = 0
+    more = False
+    for payload in pages:
+        npages += 1
+        items = payload.get('value', [])
+        for item in items:
+            if limit is not None and count >= limit:
+                more = True
+                break
+            jprint(convert(item))
+            count += 1
+        sys.stdout.flush()
+        if limit is not None and count >= limit:
+            more = more or bool(payload.get('@odata.nextLink'))
+            break
+    jprint({'ok': True, 'done': True, 'count': count, 'pages': npages, 'more': more})
+
+
+def streaming(args):
+    return args.all or args.limit is not None
+
+
+def page_top(args):
+    # $top is the page size: --top for a single page, --page-size when streaming.
+    if not streaming(args):
+        return args.top
+    return min(args.page_size, args.limit) if args.limit is not None else args.page_size
+
+
+def iso_utc(value):
+    import datetime as dt
+    try:
+        d = dt.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        fail(2, 'invalid_datetime', value=value)
+    if d.tzinfo is None:
+        d = d.replace(tzinfo=dt.timezone.utc)
+    return d.astimezone(dt.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+# Delta-synced store. Each scope ('mail:<folder>', 'calendar') keeps the link to resume
+# from: the @odata.nextLink while a sync is under way (so an interrupted first sync picks
+# up where it stopped), then the @odata.deltaLink, which returns only what changed since.
+_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync (
+    scope TEXT PRIMARY KEY,
+    link TEXT,
+    synced_at REAL,
+    params TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    folder TEXT NOT NULL,
+    id TEXT NOT NULL,
+    received TEXT,
+    is_read INTEGER,
+    data TEXT NOT NULL,
+    message TEXT,
+    PRIMARY KEY (folder, id)
+);
+CREATE INDEX IF NOT EXISTS messages_received ON messages (folder, received);
+CREATE INDEX IF NOT EXISTS messages_id ON messages (id);
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    start_time TEXT,
+    end_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (start_time);
+"""
+MAIL_SELECT = 'id,subject,from,receivedDateTime,isRead,importance,hasAttachments'
+def store():
+    db = getattr(_local, 'store', None)
+    if db is None:
+        import sqlite3
+        path = pathlib.Path(STORE_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Message contents: the database and its -wal/-shm files are created owner-only.
+        umask = os.umask(0o077)
+        try:
+            db = sqlite3.connect(str(path), timeout=30)
+            os.chmod(path, 0o600)  # stores created before the umask was set
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(_STORE_SCHEMA)
+        finally:
+            os.umask(umask)
+        _local.store = db
+    return db
+
+
+def sync_state(db, scope):
+    row = db.execute('SELECT link, synced_at, params FROM sync WHERE scope = ?', (scope,)).fetchone()
+    if not row:
+        return None
+    return {'link': row[0], 'synced_at': row[1], 'params': json.loads(row[2]) if row[2] else {}}
+
+
+def store_reset(db, scope):
+    with db:
+        db.execute('DELETE FROM sync WHERE scope = ?', (scope,))
+        if scope == 'calendar':
+            db.execute('DELETE FROM events')
+        else:
+            db.execute('DELETE FROM messages WHERE folder = ?', (scope.split(':', 1)[1],))
+
+
+def apply_message(db, folder, item):
+    row = db.execute('SELECT data FROM messages WHERE folder = ? AND id = ?', (folder, item['id'])).fetchone()
+    data = {**json.loads(row[0]), **item} if row else item
+    # A changed message drops its cached body; `mail read` fetches it again.
+    db.execute('INSERT OR REPLACE INTO messages (folder, id, received, is_read, data, message) VALUES (?, ?, ?, ?, ?, NULL)',
+               (folder, data['id'], data.get('receivedDateTime'), int(bool(data.get('isRead'))), json.dumps(data)))
+
+
+def apply_event(db, item):
+    item.pop('body', None)
+    db.execute('INSERT OR REPLACE INTO events (id, start_time, end_time, data) VALUES (?, ?, ?, ?)',
+               (item['id'], (item.get('start') or {}).get('dateTime'), (item.get('end') or {}).get('dateTime'), json.dumps(item)))
+
+
+def delta_sync(db, scope, first_url, token, params=None):
+    # Follow the scope's saved link (or start over at first_url) to the next deltaLink,
+    # applying and committing one page at a time. Graph answers 410 when a delta token
+    # has expired; the scope is then emptied and synced from scratch.
+    state = sync_state(db, scope)
+    url = (state or {}).get('link') or first_url
+    if state and state.get('params') != (params or {}):
+        store_reset(db, scope)
+        url = first_url
+    folder = scope.split(':', 1)[1] if scope.startswith('mail:') else None
+    changed = removed = 0
+    while True:
+        status, _, payload = graph_call('GET', url, token, headers={'Prefer': 'odata.maxpagesize=200'})
+        if status == 410 and url != first_url:
+            store_reset(db, scope)
+            url = first_url
+            continue
+        if status >= 400:
+            fail(4, 'graph_request_failed', status=status, response=payload)
+        link = payload.get('@odata.nextLink') or payload.get('@odata.deltaLink')
+        if not link or not link.startswith(GRAPH_BASE + '/'):
+            fail(4, 'graph_delta_link_unexpected', link=link)
+        with db:
+            for item in payload.get('value', []):
+                if '@removed' in item:
+                    if folder is None:
+                        db.execute('DELETE FROM events WHERE id = ?', (item['id'],))
+                    else:
+                        db.execute('DELETE FROM messages WHERE folder = ? AND id = ?', (folder, item['id']))
+                    removed += 1
+                else:
+                    if folder is None:
+                        apply_event(db, item)
+                    else:
+                        apply_message(db, folder, item)
+                    changed += 1
+            done = '@odata.deltaLink' in payload
+            db.execute('INSERT OR REPLACE INTO sync (scope, link, synced_at, params) VALUES (?, ?, ?, ?)',
+                       (scope, link, time.time() if done else None, json.dumps(params or {})))
+        if done:
+            return {'scope': scope, 'changed': changed, 'removed': removed}
+        url = link
+
+
+def ensure_synced(db, scope, first_url, token, fresh=False, params=None):
+    # Sync unless the last complete sync is recent; returns its time (epoch seconds).
+    state = sync_state(db, scope)
+    if (fresh or not state or not state['synced_at'] or state['params'] != (params or {})
+            or time.time() - state['synced_at'] > SYNC_MAX_AGE):
+        delta_sync(db, scope, first_url, token, params)
+        state = sync_state(db, scope)
+    return state['synced_at']
+
+
+def mail_delta_url(folder):
+    return f'{GRAPH_BASE}/me/mailFolders/{urllib.parse.quote(folder)}/messages/delta?' + urllib.parse.urlencode({'$select': MAIL_SELECT})
+
+
+def calendar_delta_url(params):
+    return f'{GRAPH_BASE}/me/calendarView/delta?' + urllib.parse.urlencode({'startDateTime': params['start'], 'endDateTime': params['end']})
+
+
+def calendar_window(db, days):
+    # The calendarView delta covers a fixed window; a new one (and a full resync) is
+    # only needed once a request reaches past it.
+    import datetime as dt
+    now = dt.datetime.now(dt.timezone.utc)
+    want_end = now + dt.timedelta(days=days)
+    params = (sync_state(db, 'calendar') or {}).get('params') or {}
+    fmt = '%Y-%m-%dT%H:%M:%SZ'
+    if params and params['start'] <= now.strftime(fmt) and want_end.strftime(fmt) <= params['end']:
+        return params
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + dt.timedelta(days=max(CALENDAR_SYNC_DAYS, days + 1))
+    return {'start': start.strftime(fmt), 'end': end.strftime(fmt)}
+
+
+def synced_at(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+
+def sync_in_background(folder):
+    # First use of a folder: sync it in a detached `sync --background` process while the
+    # caller answers from Graph directly, instead of making it wait for the whole folder.
+    import subprocess
+    subprocess.Popen([sys.executable, os.path.abspath(__file__), 'sync', '--background', '--folder', folder],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def cmd_sync_background(args):
+    # One background sync at a time; a folder skipped here is started again by the next
+    # `mail list` that finds it unsynced.
+    import fcntl
+    lock = os.open(STORE_PATH + '.sync.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        token = ensure_access_token(get_o365_config())
+        calls = [lambda f=f: delta_sync(store(), 'mail:' + f, mail_delta_url(f), token) for f in args.folder]
+        jprint({'ok': True, 'scopes': graph_concurrently(calls)})
+    finally:
+        os.close(lock)
+
+
+def cmd_sync(args):
+    if args.background:
+        return cmd_sync_background(args)
+    cfg = get_o365_config()
+    token = ensure_access_token(cfg)
+    db = store()
+    folders = args.folder or ['inbox']
+    if args.reset:
+        for scope in ['mail:' + f for f in folders] + ['calendar']:
+            store_reset(db, scope)
+    params = calendar_window(db, args.days)
+    # Scopes sync concurrently, each thread on its own store connection.
+    calls = [lambda f=f: delta_sync(store(), 'mail:' + f, mail_delta_url(f), token) for f in folders]
+    calls.append(lambda: delta_sync(store(), 'calendar', calendar_delta_url(params), token, params))
+    jprint({'ok': True, 'scopes': graph_concurrently(calls)})
 
 
 def cmd_auth_login(_args):
@@ -248,60 +1055,300 @@ def cmd_auth_status(_args):
     jprint({'ok': True, 'configured': True, 'user_email': cfg.get('user_email'), 'token_cached': bool(tok.get('access_token')), 'token_valid': token_valid(tok)})
 
 
+def mail_summary(m):
+    return {
+        'id': m.get('id'),
+        'subject': m.get('subject'),
+        'from': (((m.get('from') or {}).get('emailAddress') or {}).get('address')),
+        'received': m.get('receivedDateTime'),
+        'isRead': m.get('isRead'),
+        'importance': m.get('importance'),
+        'hasAttachments': m.get('hasAttachments'),
+    }
+
+
 def cmd_mail_list(args):
     cfg = get_o365_config()
     token = ensure_access_token(cfg)
-    payload = graph_get('/me/messages', token, {
-        '$top': str(args.top),
-        '$select': 'id,subject,from,receivedDateTime,isRead,importance,hasAttachments',
+    # Delta sync is per folder, so only a listing of one folder can come from the store;
+    # without --folder the listing covers every folder and is read live.
+    db = store() if STORE_PATH and args.folder else None
+    if db is not None and not args.fresh and not (sync_state(db, 'mail:' + args.folder) or {}).get('synced_at'):
+        sync_in_background(args.folder)
+        db = None
+    if db is not None:
+        synced = ensure_synced(db, 'mail:' + args.folder, mail_delta_url(args.folder), token, args.fresh)
+        sql = 'SELECT data FROM messages WHERE folder = ?'
+        params = [args.folder]
+        if args.since:
+            sql += ' AND received >= ?'
+            params.append(iso_utc(args.since))
+        if args.unread:
+            sql += ' AND is_read = 0'
+        sql += ' ORDER BY received DESC'
+        if not streaming(args):
+            sql += f' LIMIT {int(args.top)}'
+        rows = db.execute(sql, params)
+        if streaming(args):
+            stream_items([{'value': rows}], lambda row: mail_summary(json.loads(row[0])), args.limit)
+            return
+        jprint({'ok': True, 'items': [mail_summary(json.loads(r[0])) for r in rows], 'syncedAt': synced_at(synced)})
+        return
+    query = {
+        '$top': str(page_top(args)),
+        '$select': MAIL_SELECT,
         '$orderby': 'receivedDateTime desc'
-    })
-    msgs = []
-    for m in payload.get('value', []):
-        msgs.append({
-            'id': m.get('id'),
-            'subject': m.get('subject'),
-            'from': (((m.get('from') or {}).get('emailAddress') or {}).get('address')),
-            'received': m.get('receivedDateTime'),
-            'isRead': m.get('isRead'),
-            'importance': m.get('importance'),
-            'hasAttachments': m.get('hasAttachments'),
-        })
-    jprint({'ok': True, 'items': msgs})
+    }
+    filters = []
+    if args.since or args.unread:
+        # Graph rejects a $filter that does not start with the $orderby property.
+        filters.append('receivedDateTime ge ' + (iso_utc(args.since) if args.since else '1900-01-01T00:00:00Z'))
+    if args.unread:
+        filters.append('isRead eq false')
+    if filters:
+        query['$filter'] = ' and '.join(filters)
+    path = f'/me/mailFolders/{urllib.parse.quote(args.folder)}/messages' if args.folder else '/me/messages'
+    if streaming(args):
+        stream_items(graph_pages(path, token, query), mail_summary, args.limit)
+        return
+    payload = graph_get(path, token, query)
+    jprint({'ok': True, 'items': [mail_summary(m) for m in payload.get('value', [])]})
+
+
+MESSAGE_SELECT = 'id,subject,from,toRecipients,ccRecipients,receivedDateTime,bodyPreview,body,isRead,importance'
+
+
+def read_ids(lines):
+    # One id per line, or NDJSON objects with an "id" (e.g. `mail list --all` output).
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('{'):
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict):
+                if obj.get('id'):
+                    yield obj['id']
+                continue
+        yield line
 
 
 def cmd_mail_read(args):
+    ids = list(args.id or [])
+    if args.stdin:
+        ids.extend(read_ids(sys.stdin))
+    if not ids:
+        fail(2, 'no_message_ids', hint='pass --id (repeatable) or --stdin')
     cfg = get_o365_config()
     token = ensure_access_token(cfg)
-    m = graph_get(f'/me/messages/{urllib.parse.quote(args.id)}', token, {
-        '$select': 'id,subject,from,toRecipients,ccRecipients,receivedDateTime,bodyPreview,body,isRead,importance'
-    })
-    jprint({'ok': True, 'message': m})
+    # Bodies of messages in the store are cached there until the message changes.
+    db = store() if STORE_PATH else None
+    cached = {}
+    if db and not args.fresh:
+        for mid in set(ids):
+            row = db.execute('SELECT message FROM messages WHERE id = ? AND message IS NOT NULL', (mid,)).fetchone()
+            if row:
+                cached[mid] = json.loads(row[0])
+
+    def keep(mid, message):
+        if db:
+            with db:
+                db.execute('UPDATE messages SET message = ? WHERE id = ?', (json.dumps(message), mid))
+
+    if len(ids) == 1 and not args.stdin:
+        m = cached.get(ids[0])
+        if m is None:
+            m = graph_get(f'/me/messages/{urllib.parse.quote(ids[0])}', token, {'$select': MESSAGE_SELECT})
+            keep(ids[0], m)
+        jprint({'ok': True, 'message': m})
+        return
+
+    # NDJSON in input order, one line per id, then a summary line.
+    query = '?' + urllib.parse.urlencode({'$select': MESSAGE_SELECT})
+    fetch = [i for i in ids if i not in cached]
+    fetched = graph_get_many([f'/me/messages/{urllib.parse.quote(i)}{query}' for i in fetch], token, args.concurrency)
+    failed = 0
+    for i, mid in enumerate(ids):
+        if mid in cached:
+            status, body = 200, cached[mid]
+        else:
+            _, status, body = next(fetched)
+            if 200 <= status < 300:
+                keep(mid, body)
+        if 200 <= status < 300:
+            jprint({'ok': True, 'id': ids[i], 'message': body})
+        else:
+            failed += 1
+            jprint({'ok': False, 'id': ids[i], 'error': 'graph_request_failed', 'status': status, 'response': body})
+        sys.stdout.flush()
+    jprint({'ok': not failed, 'done': True, 'count': len(ids), 'failed': failed})
+    if failed:
+        raise SystemExit(4)
+
+
+def attachment_summary(a):
+    return {
+        'id': a.get('id'),
+        'name': a.get('name'),
+        'type': (a.get('@odata.type') or '').rsplit('.', 1)[-1].replace('Attachment', '') or None,
+        'contentType': a.get('contentType'),
+        'size': a.get('size'),
+        'isInline': a.get('isInline'),
+    }
+
+
+def message_attachments(message_id, token):
+    path = f'/me/messages/{urllib.parse.quote(message_id)}/attachments'
+    query = {'$select': 'id,name,contentType,size,isInline'}
+    return [attachment_summary(a) for page in graph_pages(path, token, query) for a in page.get('value', [])]
+
+
+def cmd_mail_attachments(args):
+    cfg = get_o365_config()
+    token = ensure_access_token(cfg)
+    jprint({'ok': True, 'items': message_attachments(args.id, token)})
+
+
+def caller_path(path):
+    # A path argument relative to the caller's directory (the agent runs commands for
+    # clients in other directories).
+    return pathlib.Path(getattr(_local, 'cwd', None) or os.getcwd(), path)
+
+
+def safe_filename(name, fallback):
+    name = ''.join('_' if c in '/\\' or ord(c) < 32 else c for c in (name or '')).strip().lstrip('.')
+    return name[:200] or fallback
+
+
+def download_dest(out_dir, name, source, used):
+    # (path, already downloaded) for download_source() `source`: the first of name, "stem (2).ext", ...
+    # that this run has not used and that is free for, or already holds, source's bytes.
+    stem, ext = os.path.splitext(name)
+    n = 1
+    while True:
+        if name not in used:
+            claim = claim_download(out_dir / name, source)
+            if claim:
+                used.add(name)
+                return out_dir / name, claim == 'done'
+        n += 1
+        name = f'{stem} ({n}){ext}'
+
+
+def cmd_mail_download(args):
+    cfg = get_o365_config()
+    token = ensure_access_token(cfg)
+    out_dir = caller_path(args.dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    message_url = f'{GRAPH_BASE}/me/messages/{urllib.parse.quote(args.id)}'
+    jobs = []  # (result fields, url, destination, already downloaded)
+    used = set()
+    if args.mime:
+        url = message_url + '/$value'
+        jobs.append(({'mime': True}, url, *download_dest(out_dir, safe_filename(args.id, 'message') + '.eml', download_source(url), used)))
+    files = []
+    if args.attachment or not args.mime:
+        attachments = message_attachments(args.id, token)
+        if args.attachment:
+            known = {a['id'] for a in attachments}
+            files.extend({'ok': False, 'attachment': a, 'error': 'attachment_not_found'} for a in args.attachment if a not in known)
+            attachments = [a for a in attachments if a['id'] in args.attachment]
+        for a in attachments:
+            meta = {'attachment': a['id'], 'name': a['name']}
+            if a['type'] == 'reference':
+                # A link to a file kept elsewhere (OneDrive, SharePoint): nothing to download.
+                if args.attachment:
+                    files.append({'ok': False, **meta, 'error': 'reference_attachment_not_downloadable'})
+                else:
+                    files.append({'ok': True, **meta, 'skipped': 'reference_attachment'})
+                continue
+            # Item attachments (attached messages, events) come down as MIME.
+            name = safe_filename(a['name'], a['id']) + ('.eml' if a['type'] == 'item' else '')
+            url = f'{message_url}/attachments/{urllib.parse.quote(a["id"])}/$value'
+            jobs.append((meta, url, *download_dest(out_dir, name, download_source(url), used)))
+
+    def download(meta, url, dest, done):
+        if done:
+            return {'ok': True, **meta, 'path': str(dest), 'bytes': dest.stat().st_size, 'existing': True}
+        status, result = graph_download(url, token, dest)
+        if status == 200:
+            return {'ok': True, **meta, 'path': str(dest), **result}
+        return {'ok': False, **meta, 'path': str(dest), 'error': 'graph_request_failed', 'status': status, 'response': result}
+
+    files.extend(graph_concurrently([lambda job=job: download(*job) for job in jobs]))
+    ok = all(f['ok'] for f in files)
+    jprint({'ok': ok, 'dir': str(out_dir), 'files': files})
+    if not ok:
+        raise SystemExit(4)
+
+
+def event_summary(e):
+    return {
+        'id': e.get('id'),
+        'subject': e.get('subject'),
+        'start': (e.get('start') or {}).get('dateTime'),
+        'end': (e.get('end') or {}).get('dateTime'),
+        'timezone': (e.get('start') or {}).get('timeZone'),
+        'location': ((e.get('location') or {}).get('displayName')),
+        'isAllDay': e.get('isAllDay'),
+    }
 
 
 def cmd_calendar_events(args):
     cfg = get_o365_config()
     token = ensure_access_token(cfg)
+    import datetime as dt
     now = dt.datetime.now(dt.timezone.utc)
     end = now + dt.timedelta(days=args.days)
-    payload = graph_get('/me/calendarView', token, {
+    query = {
         'startDateTime': now.isoformat(),
         'endDateTime': end.isoformat(),
         '$orderby': 'start/dateTime',
-        '$top': str(args.top),
-    })
-    items = []
-    for e in payload.get('value', []):
-        items.append({
-            'id': e.get('id'),
-            'subject': e.get('subject'),
-            'start': (e.get('start') or {}).get('dateTime'),
-            'end': (e.get('end') or {}).get('dateTime'),
-            'timezone': (e.get('start') or {}).get('timeZone'),
-            'location': ((e.get('location') or {}).get('displayName')),
-            'isAllDay': e.get('isAllDay'),
-        })
-    jprint({'ok': True, 'items': items})
+        '$top': str(page_top(args)),
+    }
+    if args.all_calendars:
+        # The store holds the default calendar; the others are read live, concurrently,
+        # each up to as many events as the merged (by start) output can use.
+        cap = args.top if not streaming(args) else args.limit
+
+        def events(c):
+            out = []
+            for page in graph_pages(f'/me/calendars/{urllib.parse.quote(c["id"])}/calendarView', token, query):
+                out.extend({**event_summary(e), 'calendar': c.get('name')} for e in page.get('value', []))
+                if not streaming(args) or (cap is not None and len(out) >= cap):
+                    break
+            return out
+
+        calendars = graph_get('/me/calendars', token, {'$select': 'id,name'}).get('value', [])
+        items = sorted((e for batch in graph_concurrently([lambda c=c: events(c) for c in calendars]) for e in batch),
+                       key=lambda e: e['start'] or '')
+        if streaming(args):
+            stream_items([{'value': items}], lambda e: e, args.limit)
+            return
+        jprint({'ok': True, 'items': items[:args.top]})
+        return
+    if STORE_PATH:
+        db = store()
+        params = calendar_window(db, args.days)
+        synced = ensure_synced(db, 'calendar', calendar_delta_url(params), token, args.fresh, params)
+        # Events overlapping [now, end], as calendarView returns them (times are UTC).
+        sql = 'SELECT data FROM events WHERE end_time > ? AND start_time < ? ORDER BY start_time'
+        if not streaming(args):
+            sql += f' LIMIT {int(args.top)}'
+        rows = db.execute(sql, (now.strftime('%Y-%m-%dT%H:%M:%S'), end.strftime('%Y-%m-%dT%H:%M:%S')))
+        if streaming(args):
+            stream_items([{'value': rows}], lambda row: event_summary(json.loads(row[0])), args.limit)
+            return
+        jprint({'ok': True, 'items': [event_summary(json.loads(r[0])) for r in rows], 'syncedAt': synced_at(synced)})
+        return
+    if streaming(args):
+        stream_items(graph_pages('/me/calendarView', token, query), event_summary, args.limit)
+        return
+    payload = graph_get('/me/calendarView', token, query)
+    jprint({'ok': True, 'items': [event_summary(e) for e in payload.get('value', [])]})
 
 
 def cmd_calendar_list(_args):
@@ -311,6 +1358,267 @@ def cmd_calendar_list(_args):
     jprint({'ok': True, 'items': payload.get('value', [])})
 
 
+def positive_int(value):
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1: {value}')
+    return n
+
+
+def add_paging_args(p):
+    p.add_argument('--all', action='store_true', help='follow every page; print NDJSON (one item per line, then a summary)')
+    p.add_argument('--limit', type=positive_int, help='like --all, but stop after N items')
+    p.add_argument('--page-size', type=positive_int, default=100, help='items per Graph request with --all/--limit')
+
+
+class _ContextStream:
+    # The agent's sys.stdout and sys.stdin: the streams of the request being served in
+    # the current context, or the agent's own outside a request.
+    def __init__(self, var, default):
+        self._var = var
+        self._default = default
+
+    def __getattr__(self, name):
+        return getattr(self._var.get(self._default), name)
+
+    def __iter__(self):
+        return iter(self._var.get(self._default))
+
+
+class _AgentOutput:
+    # A request's stdout: what the command prints is sent to the client as {"out": text}
+    # lines whenever it flushes (stream_items flushes per page), and when it finishes.
+    def __init__(self, wfile, lock):
+        self.wfile = wfile
+        self.lock = lock
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+        return len(text)
+
+    def flush(self):
+        if self.parts:
+            text, self.parts = ''.join(self.parts), []
+            self.send({'out': text})
+
+    def send(self, obj):
+        with self.lock:
+            self.wfile.write(json.dumps(obj, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+def run_argv(argv):
+    # Run one command line in this process; (exit status, traceback text or None).
+    try:
+        args = build_parser().parse_args(argv)
+        args.fn(args)
+        return 0, None
+    except SystemExit as e:
+        return (e.code if isinstance(e.code, int) else 0 if e.code is None else 1), None
+    except Exception:
+        import traceback
+        return 1, traceback.format_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+        except OSError:
+            pass  # client went away
+
+
+# Environment a command reads besides M365_*: HOME, the proxy settings (_proxy_for), the
+# CA locations of the default TLS context and the Bitwarden CLI's settings (load_bw_env).
+AGENT_ENV_NAMES = ('HOME', 'http_proxy', 'HTTP_PROXY', 'https_proxy', 'HTTPS_PROXY', 'no_proxy', 'NO_PROXY',
+                   'SSL_CERT_FILE', 'SSL_CERT_DIR')
+AGENT_ENV_PREFIXES = ('M365_', 'BW_', 'BITWARDENCLI_')
+
+
+def m365_env():
+    # The settings a command runs with (M365_AGENT_* only pick where it runs).
+    return {k: v for k, v in os.environ.items()
+            if (k in AGENT_ENV_NAMES or k.startswith(AGENT_ENV_PREFIXES)) and not k.startswith('M365_AGENT_')}
+
+
+def cmd_agent(args):
+    # Serve the other subcommands over a Unix socket from this one process, which keeps
+    # the O365 config and token in memory (refreshing the token before it expires), its
+    # keep-alive Graph connections (one set per worker thread), store connections and
+    # throttle state. Protocol: one JSON line {"argv": [...], "stdin": text?, "cwd": ...,
+    # "env": {...}} per connection, with the caller's "cwd" for path arguments and its
+    # m365_env(); the reply is {"out": text} lines (and {"alive": true} every
+    # AGENT_HEARTBEAT seconds) and then {"exit": status}, or just {"local": true} when the
+    # caller's settings differ from the agent's, so the caller runs the command itself.
+    import concurrent.futures
+    import contextvars
+    import io
+    import signal
+    import socket
+    import socketserver
+    path = pathlib.Path(args.socket)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            try:
+                s.connect(str(path))
+            except OSError:
+                path.unlink()  # stale socket from a previous run
+            else:
+                fail(1, 'm365_agent_already_running', socket=str(path))
+
+    out_var = contextvars.ContextVar('m365_stdout')
+    in_var = contextvars.ContextVar('m365_stdin')
+    sys.stdout = _ContextStream(out_var, sys.stdout)
+    sys.stdin = _ContextStream(in_var, sys.stdin)
+    # Fixed worker threads, so their connections stay warm from one request to the next.
+    workers = concurrent.futures.ThreadPoolExecutor(max_workers=AGENT_WORKERS)
+    env = m365_env()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            out = _AgentOutput(self.wfile, threading.Lock())
+            try:
+                req = json.loads(self.rfile.readline())
+                argv = req['argv']
+                if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+                    raise ValueError(argv)
+            except (ValueError, KeyError, TypeError):
+                out.send({'exit': 2, 'error': 'm365 agent: invalid request\n'})
+                return
+            if req.get('env', env) != env:
+                try:
+                    out.send({'local': True})
+                except OSError:
+                    pass
+                return
+
+            def serve_one():
+                out_var.set(out)
+                in_var.set(io.StringIO(req.get('stdin') or ''))
+                _local.cwd = req.get('cwd')
+                try:
+                    return run_argv(argv)
+                finally:
+                    _local.cwd = None
+
+            try:
+                running = workers.submit(contextvars.copy_context().run, serve_one)
+                while True:
+                    try:
+                        code, error = running.result(timeout=AGENT_HEARTBEAT)
+                        break
+                    except concurrent.futures.TimeoutError:
+                        out.send({'alive': True})
+                reply = {'exit': code}
+                if error:
+                    reply['error'] = error
+                out.send(reply)
+            except OSError:
+                pass  # client went away
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        request_queue_size = 64
+
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(str(path), Handler)
+    finally:
+        os.umask(old_umask)
+
+    stop = threading.Event()
+
+    def refresh_loop():
+        # Keep the access token ahead of its expiry so commands never wait for a refresh.
+        while True:
+            try:
+                ahead = max(TOKEN_REFRESH_AHEAD, AGENT_REFRESH_AHEAD)
+                tok = token_load()
+                if tok.get('refresh_token') and not token_valid(tok, ahead):
+                    refresh_single_flight(get_o365_config(), ahead, wait=False)
+            except (Exception, SystemExit):
+                pass
+            if stop.wait(30):
+                return
+
+    def _stop(_signum, _frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _stop)
+    threading.Thread(target=refresh_loop, daemon=True).start()
+    jprint({'ok': True, 'serving': str(path), 'pid': os.getpid()})
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        workers.shutdown(wait=False)
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def agent_call(argv, stdin=None):
+    # Run argv in the agent, copying its output here; None when no agent is listening, it
+    # runs with different settings, or it stops answering before sending any output (the
+    # caller then runs argv itself).
+    import socket
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.settimeout(1.0)
+        try:
+            s.connect(str(AGENT_SOCKET))
+        except OSError:
+            return None
+        s.settimeout(AGENT_TIMEOUT)
+        req = {'argv': argv, 'cwd': os.getcwd(), 'env': m365_env()}
+        if stdin is not None:
+            req['stdin'] = stdin.read()
+        copied = False
+        try:
+            s.sendall(json.dumps(req).encode('utf-8') + b'\n')
+            with s.makefile('rb') as f:
+                for line in f:
+                    msg = json.loads(line)
+                    if msg.get('local'):
+                        break
+                    if 'out' in msg:
+                        copied = True
+                        sys.stdout.write(msg['out'])
+                        sys.stdout.flush()
+                    elif 'exit' in msg:
+                        if msg.get('error'):
+                            sys.stderr.write(msg['error'])
+                        return msg['exit']
+                else:
+                    raise ValueError('connection closed before the command finished')
+        except socket.timeout:
+            if copied:
+                fail(1, 'm365_agent_timeout', timeout=AGENT_TIMEOUT)
+        except (OSError, ValueError) as e:
+            # Output may already have been copied, so the command is not run again here.
+            fail(1, 'm365_agent_connection_lost', detail=str(e))
+        if stdin is not None:
+            import io
+            sys.stdin = io.StringIO(req['stdin'])
+        return None
+    finally:
+        s.close()
+
+
+def use_agent(args):
+    # `auth login` stays in the caller's process: it is interactive and rewrites the token.
+    return (args.fn not in (cmd_agent, cmd_auth_login) and AGENT_SOCKET.exists()
+            and os.environ.get('M365_AGENT_LOCAL', '') not in ('1', 'true', 'yes'))
+
+
+def add_fresh_arg(p):
+    p.add_argument('--fresh', action='store_true', help=f'sync the local store first even if it synced in the last {SYNC_MAX_AGE:g}s')
+
+
 def build_parser():
     p = argparse.ArgumentParser(description='Guard-side Microsoft 365 Graph helper')
     sub = p.add_subparsers(dest='cmd', required=True)
@@ -323,27 +1631,65 @@ def build_parser():
     m = sub.add_parser('mail')
     m_sub = m.add_subparsers(dest='mail_cmd', required=True)
     m_list = m_sub.add_parser('list')
-    m_list.add_argument('--top', type=int, default=20)
+    m_list.add_argument('--top', type=positive_int, default=20)
+    m_list.add_argument('--unread', action='store_true', help='only unread messages')
+    m_list.add_argument('--since', help='only messages received at or after this ISO date/time (UTC unless given)')
+    m_list.add_argument('--folder', help='only this mail folder (id or well-known name, e.g. inbox), served from the '
+                                         'local store; default: every folder, read live')
+    add_paging_args(m_list)
+    add_fresh_arg(m_list)
     m_list.set_defaults(fn=cmd_mail_list)
     m_read = m_sub.add_parser('read')
-    m_read.add_argument('--id', required=True)
+    m_read.add_argument('--id', action='append', help='message id (repeatable)')
+    m_read.add_argument('--stdin', action='store_true', help='also read ids from stdin: one per line, or NDJSON with "id"')
+    m_read.add_argument('--concurrency', type=positive_int, default=2, help='$batch requests (of up to 20 ids) in flight')
+    m_read.add_argument('--fresh', action='store_true', help='fetch from Graph even if the body is in the local store')
     m_read.set_defaults(fn=cmd_mail_read)
+    m_att = m_sub.add_parser('attachments', help='list a message\'s attachments')
+    m_att.add_argument('--id', required=True, help='message id')
+    m_att.set_defaults(fn=cmd_mail_attachments)
+    m_dl = m_sub.add_parser('download', help='save a message\'s attachments (or its MIME) to disk; reruns resume')
+    m_dl.add_argument('--id', required=True, help='message id')
+    m_dl.add_argument('--attachment', action='append', help='only this attachment id (repeatable; default: all)')
+    m_dl.add_argument('--mime', action='store_true', help='save the whole message as <id>.eml (with --attachment: as well)')
+    m_dl.add_argument('--dir', default='.', help='directory to save into (default: current)')
+    m_dl.set_defaults(fn=cmd_mail_download)
 
     c = sub.add_parser('calendar')
     c_sub = c.add_subparsers(dest='cal_cmd', required=True)
     c_events = c_sub.add_parser('events')
     c_events.add_argument('--days', type=int, default=7)
-    c_events.add_argument('--top', type=int, default=50)
+    c_events.add_argument('--top', type=positive_int, default=50)
+    c_events.add_argument('--all-calendars', action='store_true', help='events of every calendar (read live, concurrently), with a "calendar" field')
+    add_paging_args(c_events)
+    add_fresh_arg(c_events)
     c_events.set_defaults(fn=cmd_calendar_events)
     c_list = c_sub.add_parser('list')
     c_list.set_defaults(fn=cmd_calendar_list)
 
+    s = sub.add_parser('sync', help='bring the local store up to date (mail folders and calendar)')
+    s.add_argument('--folder', action='append', help='mail folder to sync (repeatable; default: inbox)')
+    s.add_argument('--days', type=int, default=CALENDAR_SYNC_DAYS, help='calendar days ahead to cover')
+    s.add_argument('--reset', action='store_true', help='drop what is stored and sync from scratch')
+    s.add_argument('--background', action='store_true', help=argparse.SUPPRESS)  # see sync_in_background
+    s.set_defaults(fn=cmd_sync)
+
+    ag = sub.add_parser('agent', help='serve the other subcommands from this process (warm token and connections)')
+    ag.add_argument('--socket', default=str(AGENT_SOCKET))
+    ag.set_defaults(fn=cmd_agent)
+
     return p
 
 
 def main():
     parser = build_parser()
     args = parser.parse_args()
+    if use_agent(args):
+        code = agent_call(sys.argv[1:], sys.stdin if getattr(args, 'stdin', False) else None)
+        if code is not None:
+            if code:
+                raise SystemExit(code)
+            return
     args.fn(args)
 
 
@@ -0,0 +1,562 @@
+"""Tests for scripts/guard/command-engine.py."""
+import importlib.util
+import json
+import os
+import pathlib
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+ENGINE = pathlib.Path(__file__).resolve().parents[2] / 'scripts' / 'guard' / 'command-engine.py'
+
+# Runs the engine with CMD_POLICY_PATH (hard-coded in the module) pointed at argv[1].
+BOOTSTRAP = (
+    'import importlib.util, pathlib, sys\n'
+    f'spec = importlib.util.spec_from_file_location("command_engine", {str(ENGINE)!r})\n'
+    'engine = importlib.util.module_from_spec(spec)\n'
+    'spec.loader.exec_module(engine)\n'
+    'engine.CMD_POLICY_PATH = pathlib.Path(sys.argv[1])\n'
+    'sys.argv = ["command-engine"] + sys.argv[2:]\n'
+    'engine.main()\n'
+)
+
+
+def load_engine():
+    spec = importlib.util.spec_from_file_location('command_engine', ENGINE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def engine():
+    return load_engine()
+
+
+@pytest.fixture
+def policy(tmp_path, engine, monkeypatch):
+    """Write rules to a temporary policy file and make it the engine's active policy."""
+    path = tmp_path / 'command-policy.json'
+
+    def write(rules):
+        path.write_text(json.dumps({'rules': rules}))
+        monkeypatch.setattr(engine, 'CMD_POLICY_PATH', path)
+        return path
+    return write
+
+
+def run_engine(policy_path, *args, env=None):
+    return subprocess.run([sys.executable, '-c', BOOTSTRAP, str(policy_path), *args],
+                          capture_output=True, text=True, env=env, timeout=60)
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    """Start an engine daemon on a temporary socket; yields (socket path, audit dir, stop())."""
+    procs = []
+
+    def start(policy_path):
+        sock = tmp_path / 'engine.sock'
+        audit_dir = tmp_path / 'audit'
+        env = dict(os.environ, GUARD_AUDIT_DIR=str(audit_dir), GUARD_AUDIT_FLUSH_MS='0')
+        proc = subprocess.Popen([sys.executable, '-c', BOOTSTRAP, str(policy_path), 'serve', '--socket', str(sock)],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+        procs.append(proc)
+        assert json.loads(proc.stdout.readline())['ok']
+
+        def stop():
+            proc.terminate()
+            proc.wait(timeout=10)
+        return sock, audit_dir, stop
+
+    yield start
+    for proc in procs:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+
+def audit_entries(audit_dir):
+    path = audit_dir / 'command-audit.jsonl'
+    return [json.loads(line) for line in path.read_text().splitlines()] if path.exists() else []
+
+
+# user-001: the literal index finds exactly the patterns re.search would.
+
+INDEX_PATTERNS = [
+    '^git status\\b', '^git (push|pull)\\b', '--force', 'rm\\s+-rf', '(^|/)ls( |$)', 'curl.*\\|\\s*sh',
+    '^(sudo )?apt(-get)? install', 'x?y?z?', '^$', 'a{2,}b', '[Gg]it', '(?i)DROP TABLE', 'bad(', '\\bnpm\\b',
+    '^echo', '^echo hello', 'ello', 'h(e|a)llo', '(?=.*secret)', '\\.env$', '',
+]
+INDEX_TEXTS = [
+    '', 'git status', 'git push --force', 'GIT STATUS', 'rm  -rf /', '/bin/ls', 'lsblk', 'curl x | sh',
+    'sudo apt install vim', 'apt-get install', 'aab', 'ab', 'drop table users', 'npm i', 'npmx',
+    'echo hello', 'echo hallo', 'cat .env', 'cat .envrc', 'the secret', 'yellow',
+]
+
+
+@pytest.mark.parametrize('flags', [0, re.IGNORECASE])
+def test_pattern_set_matches_searching_each_pattern(engine, flags):
+    ps = engine.PatternSet(INDEX_PATTERNS, flags)
+    for text in INDEX_TEXTS:
+        expected = []
+        for idx, pat in enumerate(INDEX_PATTERNS):
+            try:
+                if re.search(pat, text, flags):
+                    expected.append(idx)
+            except re.error:
+                pass
+        assert ps.search_all(text) == expected, text
+
+
+# user-002: daemon executes run with the caller's environment.
+
+def test_daemon_execute_runs_with_callers_environment(tmp_path, daemon):
+    policy_path = tmp_path / 'command-policy.json'
+    policy_path.write_text(json.dumps({'rules': [{'id': 'printenv', 'pattern': '^printenv\\b', 'decision': 'approved'}]}))
+    sock, audit_dir, stop = daemon(policy_path)
+    env = dict(os.environ, GUARD_ENGINE_SOCKET=str(sock), GUARD_AUDIT_DIR=str(tmp_path / 'client-audit'),
+               GUARD_TEST_VALUE='from-the-caller')
+    env.pop('GUARD_ENGINE_LOCAL', None)
+    proc = run_engine(policy_path, 'execute', 'printenv GUARD_TEST_VALUE', env=env)
+    stop()
+    res = json.loads(proc.stdout)
+    assert res['ok'], res
+    assert res['results'][0]['stdout'] == 'from-the-caller\n'
+    # Served by the daemon: only its audit entries record the peer.
+    entries = audit_entries(audit_dir)
+    assert [e['command'] for e in entries] == ['printenv GUARD_TEST_VALUE']
+    assert 'peer' in entries[0]
+
+
+def test_execute_env_sets_home_for_cd(tmp_path, engine, policy):
+    policy([{'id': 'cd', 'pattern': '^cd\\b', 'decision': 'approved'},
+            {'id': 'pwd', 'pattern': '^pwd$', 'decision': 'approved'}])
+    env = dict(os.environ, HOME=str(tmp_path))
+    res = engine.execute('cd ~ && pwd', cwd='/', env=env)
+    assert res['ok'], res
+    assert res['results'][-1]['stdout'] == f'{tmp_path}\n'
+
+
+@pytest.mark.parametrize('env', [None, ['FOO=1'], {'FOO': 1}])
+def test_daemon_execute_rejects_invalid_env(tmp_path, engine, policy, env):
+    policy([{'id': 'true', 'pattern': '^true$', 'decision': 'approved'}])
+    req = {'mode': 'execute', 'command': 'true', 'cwd': str(tmp_path), 'actor': 'test'}
+    if env is not None:
+        req['env'] = env
+    res = engine.handle_request(req)
+    assert res['ok'] is False
+    assert res['error'] == 'invalid_env'
+
+
+# user-003: cached decisions are reused only under the policy that made them.
+
+def test_decision_cache_hits_and_is_dropped_when_the_policy_changes(engine, policy, monkeypatch):
+    cache = engine.DecisionCache(16)
+    monkeypatch.setattr(engine, 'DECISION_CACHE', cache)
+    policy([{'id': 'ls', 'pattern': '^ls\\b', 'decision': 'approved'}])
+    assert engine.analyze('ls -la')['decision'] == 'approved'
+    assert engine.analyze('ls -la')['decision'] == 'approved'
+    assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+    policy([{'id': 'no-ls', 'pattern': '^ls\\b', 'decision': 'rejected', 'reason': 'changed'}])
+    assert engine.analyze('ls -la')['decision'] == 'rejected'
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_decision_cache_evicts_least_recently_used(engine):
+    cache = engine.DecisionCache(2)
+    for key in ('a', 'b'):
+        cache.put('f', (key,), {'decision': key})
+    assert cache.get('f', ('a',)) == {'decision': 'a'}
+    cache.put('f', ('c',), {'decision': 'c'})
+    assert cache.get('f', ('b',)) is None
+    assert cache.get('f', ('a',)) and cache.get('f', ('c',))
+    assert cache.stats()['evictions'] == 1
+
+
+# user-004: analyze-batch answers every line in input order, in-process or over a pool.
+
+def test_analyze_batch_pool_matches_serial_results_in_order(engine, policy, monkeypatch):
+    import io
+    policy([{'id': 'ls', 'pattern': '^ls\\b', 'decision': 'approved'},
+            {'id': 'rm', 'pattern': '^rm\\b', 'decision': 'rejected'}])
+    # Pool workers find the worker function by module name.
+    monkeypatch.setitem(sys.modules, engine.__name__, engine)
+    monkeypatch.setattr(engine, 'BATCH_POOL_THRESHOLD', 8)
+    monkeypatch.setattr(engine, 'BATCH_CHUNK_SIZE', 3)
+    lines = [json.dumps({'id': i, 'command': f'ls -{i}' if i % 3 else 'rm -rf x'}) for i in range(40)]
+    lines[5] = 'not json'
+    lines[6] = json.dumps(['not', 'a', 'command'])
+    lines.insert(10, '')
+    outputs = []
+    for workers in (1, 2):
+        out = io.StringIO()
+        summary = engine.analyze_batch(lines, out, workers)
+        assert summary['count'] == 40 and summary['workers'] == workers
+        outputs.append([{k: v for k, v in json.loads(line).items() if k != 'ts'} for line in out.getvalue().splitlines()])
+    assert outputs[0] == outputs[1]
+    serial = outputs[0]
+    assert [r.get('id') for r in serial if 'id' in r] == [i for i in range(40) if i not in (5, 6)]
+    assert (serial[5]['error'], serial[5]['line']) == ('invalid_json_line', 6)
+    assert (serial[6]['error'], serial[6]['line']) == ('invalid_batch_item', 7)
+    assert serial[0]['decision'] == 'rejected' and serial[1]['decision'] == 'approved'
+
+
+# user-005: output is kept as a fixed head and tail window, with an optional full copy on disk.
+
+def test_output_window_keeps_head_and_tail_of_long_output(engine):
+    window = engine.OutputWindow(4, 6)
+    for chunk in (b'0123', b'456789', b'abcdef', b'g'):
+        window.feed(chunk)
+    assert window.fields('stdout') == {'stdout': 'bcdefg', 'stdoutHead': '0123', 'stdoutTruncatedBytes': 7}
+    short = engine.OutputWindow(4, 6)
+    short.feed(b'abc')
+    assert short.fields('stdout') == {'stdout': 'abc'}
+
+
+def test_output_window_tail_does_not_start_mid_character(engine):
+    window = engine.OutputWindow(0, 3)
+    window.feed('aé€'.encode())
+    assert window.fields('stdout')['stdout'] == '€'
+
+
+def test_execute_streams_long_output_through_windows_and_spill(tmp_path, engine, policy, monkeypatch):
+    policy([{'id': 'seq', 'pattern': '^seq\\b', 'decision': 'approved'}])
+    monkeypatch.setattr(engine, 'STDOUT_HEAD', 10)
+    monkeypatch.setattr(engine, 'STDOUT_TAIL', 20)
+    monkeypatch.setattr(engine, 'OUTPUT_SPILL_DIR', str(tmp_path / 'spill'))
+    full = ''.join(f'{i}\n' for i in range(1, 100001))
+    res = engine.execute('seq 100000', cwd=str(tmp_path))
+    assert res['ok'], res
+    out = res['results'][0]
+    assert out['stdout'] == full[-20:] and out['stdoutHead'] == full[:10]
+    assert out['stdoutTruncatedBytes'] == len(full) - 30
+    assert pathlib.Path(out['stdoutSpill']).read_text() == full
+
+
+# user-006: parallel segments report their own elapsed time.
+
+def test_parallel_segments_are_timed_when_they_finish(tmp_path, engine, policy):
+    policy([{'id': 'sleep', 'pattern': '^sleep\\b', 'decision': 'approved', 'parallel': True},
+            {'id': 'true', 'pattern': '^true$', 'decision': 'approved', 'parallel': True}])
+    res = engine.execute('sleep 0.5; true', cwd=str(tmp_path), parallel=True)
+    assert res['ok'], res
+    slow, fast = res['results']
+    assert slow['parallel'] and fast['parallel']
+    # `true` finishes long before the sleep it is collected after.
+    assert fast['elapsedMs'] < slow['elapsedMs'] - 300
+
+
+# user-008: rule profiling counts every rule regex evaluation.
+
+def test_rule_profiler_counts_evaluations_and_exports_them(engine, policy, monkeypatch):
+    profiler = engine.RuleProfiler(1000)
+    monkeypatch.setattr(engine, 'PROFILER', profiler)
+    policy([{'id': 'ls', 'pattern': '^ls\\b', 'decision': 'approved'},
+            {'id': 'rm', 'pattern': '^rm\\b', 'decision': 'rejected'},
+            {'id': 'force', 'pattern': '--force', 'decision': 'rejected'}])
+    for command in ('ls -la', 'ls', 'ls && rm -rf x'):
+        engine.analyze(command)
+    report = profiler.report(engine.current_policy().rules)
+    counts = {r['id']: (r['evaluations'], r['matches'], r['slow']) for r in report['rules']}
+    assert counts == {'ls': (3, 3, False), 'rm': (1, 1, False), 'force': (0, 0, False)}
+    assert report['neverMatched'] == ['force'] and report['slow'] == []
+    text = profiler.prometheus(engine.current_policy().rules)
+    assert 'guard_rule_evaluations_total{rule="ls",decision="approved"} 3' in text
+    assert '# TYPE guard_rule_match_seconds_max gauge' in text
+
+
+# user-009: catastrophic-backtracking patterns never run, and matching is bounded.
+
+@pytest.mark.parametrize('pattern,reason', [
+    ('(a+)+$', 'nested_quantifier'),
+    ('^(\\w+\\s?)*$', 'nested_quantifier'),
+    ('(.*,)+x', 'nested_quantifier'),
+    ('(a|ab)*c', 'ambiguous_alternation'),
+    ('(\\w|\\w\\d)+!', 'ambiguous_alternation'),
+    ('(\\w|\\d)+!', None),  # single characters: folded into one character class
+    ('^git (push|pull)\\b', None),
+    ('(ab)+c', None),
+    ('(a++)+b', None),
+    ('(?>a+)+b', None),
+    ('.*.*x', None),
+])
+def test_unsafe_regex_screen(engine, pattern, reason):
+    assert engine._unsafe_regex(pattern) == reason
+
+
+def test_unsafe_rules_reject_or_are_skipped_per_policy(tmp_path, engine, monkeypatch):
+    rules = [{'id': 'ls', 'pattern': '^ls\\b', 'decision': 'approved'},
+             {'id': 'bad', 'pattern': '^ls (a+)+$', 'decision': 'rejected'}]
+    path = tmp_path / 'command-policy.json'
+    monkeypatch.setattr(engine, 'CMD_POLICY_PATH', path)
+    path.write_text(json.dumps({'rules': rules}))
+    res = engine.analyze('ls aaaa')
+    assert res['decision'] == 'rejected' and res['segments'][0]['error'] == 'unsafe_policy_pattern'
+    path.write_text(json.dumps({'rules': rules, 'regexSafety': {'onUnsafe': 'skip'}}))
+    res = engine.analyze('ls aaaa')
+    assert res['decision'] == 'approved' and res['segments'][0]['skippedUnsafeRules'] == ['bad']
+    assert [r['id'] for r in engine.check_policy(path)['unsafe']] == ['bad']
+
+
+def test_long_and_slow_segments_are_rejected_on_their_own(tmp_path, engine, monkeypatch):
+    path = tmp_path / 'command-policy.json'
+    monkeypatch.setattr(engine, 'CMD_POLICY_PATH', path)
+    path.write_text(json.dumps({
+        'rules': [{'id': 'echo', 'pattern': '^echo\\b', 'decision': 'approved'},
+                  {'id': 'slow', 'pattern': '.*.*.*.*[xy]', 'decision': 'rejected'}],
+        'regexSafety': {'budgetMs': 20, 'maxSegmentLength': 10000}}))
+    res = engine.analyze('echo ' + 'a' * 20000)
+    assert res['segments'][0]['error'] == 'segment_too_long'
+    res = engine.analyze('echo ' + 'a' * 3000 + ' ; echo ok')
+    assert [s.get('error') for s in res['segments']] == ['policy_evaluation_budget_exceeded', None]
+    assert res['segments'][1]['decision'] == 'approved'
+
+
+# user-010: the precompiled artifact holds no regex bytecode and is tied to the Python version.
+
+ARTIFACT_RULES = [
+    {'id': 'git-status', 'pattern': '^git status\\b', 'decision': 'approved'},
+    {'id': 'force', 'pattern': '--force', 'decision': 'rejected'},
+    {'id': 'any-ls', 'pattern': '(^|/)ls( |$)', 'decision': 'approved'},
+    {'id': 'npm', 'program': 'npm', 'args': ['install'], 'argsPattern': '--global', 'decision': 'ask'},
+]
+ARTIFACT_COMMANDS = ['git status', 'git push --force', 'ls -la', '/bin/ls', 'npm install --global x',
+                     'npm install x', 'rm -rf /']
+
+
+def test_artifact_matches_json_compile(tmp_path, engine, policy):
+    path = policy(ARTIFACT_RULES)
+    expected = [engine.analyze(c, engine.CompiledPolicy(engine.parse_policy(path.read_bytes()))) for c in ARTIFACT_COMMANDS]
+    assert engine.compile_policy(path)['ok']
+    source = path.read_bytes()
+    artifact = engine.read_policy_artifact(engine.policy_artifact_path(path), source)
+    assert artifact is not None
+    compiled = engine.compile_policy_source(source, None, engine.policy_artifact_path(path))
+    assert isinstance(compiled.matcher.patterns_set.compiled, engine._LazyRegexes)
+    strip = lambda res: {k: v for k, v in res.items() if k != 'ts'}
+    assert [strip(engine.analyze(c, compiled)) for c in ARTIFACT_COMMANDS] == [strip(r) for r in expected]
+
+
+def test_artifact_from_another_python_version_is_ignored(tmp_path, engine, policy, monkeypatch):
+    path = policy(ARTIFACT_RULES)
+    assert engine.compile_policy(path)['ok']
+    monkeypatch.setattr(engine, '_artifact_build', lambda: ['cpython-0', [0, 0, 0, 'final', 0]])
+    assert engine.read_policy_artifact(engine.policy_artifact_path(path), path.read_bytes()) is None
+    compiled = engine.compile_policy_source(path.read_bytes(), None, engine.policy_artifact_path(path))
+    assert not isinstance(compiled.matcher.patterns_set.compiled, engine._LazyRegexes)
+    assert engine.analyze('git push --force', compiled)['decision'] == 'rejected'
+
+
+# user-011: audit entries are batched, rotate by size and are queried through an incremental index.
+
+def test_audit_log_rotates_and_query_reads_every_generation(tmp_path, engine, policy, monkeypatch):
+    policy([{'id': 'ls', 'pattern': '^ls\\b', 'decision': 'approved'},
+            {'id': 'rm', 'pattern': '^rm\\b', 'decision': 'rejected'}])
+    log = engine.AuditLog(tmp_path, 4000, 5, 0.05, False)
+    monkeypatch.setattr(engine, 'AUDIT', log)
+    for i in range(20):
+        if i == 10:
+            log.start()  # group commit from here on
+        command = f'ls {i}' if i % 4 else f'rm {i}'
+        engine.handle_request({'mode': 'analyze', 'command': command, 'actor': 'alice' if i < 10 else 'bob'})
+    log.stop()
+    assert log.stats()['written'] == 20 and log.stats()['batches'] < 20
+    assert (tmp_path / 'command-audit.jsonl.1').exists()
+
+    res = engine.audit_query(tmp_path, decision='rejected')
+    assert res['ok'] and res['indexed'] == 20 and res['newlyIndexed'] == 20
+    assert [r['command'] for r in res['results']] == ['rm 16', 'rm 12', 'rm 8', 'rm 4', 'rm 0']
+    assert engine.audit_query(tmp_path, rule='ls', actor='alice')['count'] == 7
+
+    engine.handle_request({'mode': 'analyze', 'command': 'rm again', 'actor': 'carol'})
+    res = engine.audit_query(tmp_path, actor='carol')
+    assert res['newlyIndexed'] == 1 and res['indexed'] == 21
+    assert res['results'][0]['segments'][0]['ruleIds'] == ['rm']
+
+
+# user-013: segments are admitted under the global limit and program/rule caps.
+
+def test_scheduler_caps_do_not_block_other_programs(engine):
+    scheduler = engine.ExecutionScheduler(engine.scheduler_settings(
+        {'scheduler': {'maxConcurrent': 2, 'maxQueue': 1, 'maxQueueWaitMs': 50, 'programs': {'npm': 1}}}))
+    held, _ = scheduler.acquire('npm')
+    with pytest.raises(engine.AdmissionRejected) as info:
+        scheduler.acquire('npm')
+    assert info.value.error == 'admission_timeout'
+    other, waited = scheduler.acquire('ls')
+    assert waited == 0.0
+    with pytest.raises(engine.AdmissionRejected):
+        scheduler.acquire('cat')  # global limit reached: waits, then times out
+    scheduler.release(held)
+    scheduler.release(other)
+    stats = scheduler.stats()
+    assert (stats['running'], stats['admitted'], stats['timeouts'], stats['peakRunning']) == (0, 2, 2, 2)
+
+
+def test_scheduler_sheds_when_the_queue_is_full(engine):
+    scheduler = engine.ExecutionScheduler(engine.scheduler_settings(
+        {'scheduler': {'maxConcurrent': 1, 'maxQueue': 1, 'maxQueueWaitMs': 5000}}))
+    held, _ = scheduler.acquire('a')
+    queued = threading.Event()
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(scheduler.acquire('b', on_queued=lambda depth: queued.set())))
+    waiter.start()
+    assert queued.wait(5)
+    with pytest.raises(engine.AdmissionRejected) as info:
+        scheduler.acquire('c')
+    assert info.value.error == 'admission_queue_full'
+    scheduler.release(held)
+    waiter.join(5)
+    caps, seconds = waited[0]
+    assert seconds > 0
+    scheduler.release(caps)
+    assert scheduler.stats()['shed'] == 1
+
+
+def test_execute_reports_segments_that_were_not_admitted(tmp_path, engine, monkeypatch):
+    path = tmp_path / 'command-policy.json'
+    monkeypatch.setattr(engine, 'CMD_POLICY_PATH', path)
+    path.write_text(json.dumps({'rules': [{'id': 'true', 'pattern': '^true$', 'decision': 'approved', 'maxConcurrent': 1}],
+                                'scheduler': {'maxQueueWaitMs': 50}}))
+    scheduler = engine.ExecutionScheduler()
+    monkeypatch.setattr(engine, 'SCHEDULER', scheduler)
+    scheduler.configure(engine.current_policy().scheduler)
+    held, _ = scheduler.acquire('true', ['true'])
+    res = engine.execute('true', cwd=str(tmp_path))
+    scheduler.release(held)
+    assert not res['ok']
+    assert res['results'][0]['error'] == 'admission_timeout' and res['results'][0]['queuedMs'] > 0
+    assert engine.execute('true', cwd=str(tmp_path))['ok']
+
+
+# user-014: commands are tokenized once, as shlex would, and run with the argv that was analyzed.
+
+TOKENIZER_INPUTS = [
+    'ls -la', '  echo   "a  b"  ', "echo 'it''s'", 'echo "q\\"x\\\\y\\n"', 'echo a\\ b', 'a;b&&c', 'a ;; b',
+    'echo "x;y" && echo z', "git commit -m 'a | b'", 'a|b', 'a & b', 'echo "', "echo 'x", 'echo x\\', 'echo "a\\',
+    'echo é "ü"', 'x=1 y="2 3"', '',
+]
+
+
+def shlex_tokens(command):
+    import shlex
+    lex = shlex.shlex(command, posix=True, punctuation_chars=';&|')
+    lex.whitespace_split = True
+    lex.commenters = ''
+    return list(lex)
+
+
+@pytest.mark.parametrize('command', TOKENIZER_INPUTS)
+def test_chain_tokens_match_shlex(engine, command):
+    try:
+        expected = shlex_tokens(command)
+    except ValueError as e:
+        with pytest.raises(ValueError, match=str(e)):
+            engine._chain_tokens(command)
+        return
+    assert engine._chain_tokens(command) == expected
+
+
+def test_execute_runs_the_analyzed_argv(tmp_path, engine, policy):
+    policy([{'id': 'printf', 'pattern': '^printf\\b', 'decision': 'approved'}])
+    res = engine.execute("printf '%s|' \"a  b\" 'c;d' e\\ f", cwd=str(tmp_path))
+    assert res['ok'], res
+    assert res['results'][0]['stdout'] == 'a  b|c;d|e f|'
+    segments, ops = engine.split_chain('printf x && printf "y  z"; true')
+    assert [seg.argv for seg in segments] == [['printf', 'x'], ['printf', 'y  z'], ['true']] and ops == ['&&', ';']
+
+
+# user-015: bare-name program rules and paths to the program.
+
+def test_approved_program_rule_needs_the_programs_own_binary(tmp_path, engine, policy):
+    import shutil
+    policy([{'id': 'ls', 'program': 'ls', 'decision': 'approved'}])
+    evil = tmp_path / 'evil'
+    evil.mkdir()
+    (evil / 'ls').write_text('#!/bin/sh\n')
+    assert engine.analyze('ls -la')['decision'] == 'approved'
+    assert engine.analyze('./ls -la')['decision'] != 'approved'
+    assert engine.analyze(f'{evil}/ls -la')['decision'] != 'approved'
+    assert engine.analyze('bin/ls')['decision'] != 'approved'
+    assert engine.analyze(f'{shutil.which("ls")} -la')['decision'] == 'approved'
+
+
+def test_rejecting_program_rule_covers_any_path_to_the_program(engine, policy):
+    policy([{'id': 'git', 'program': 'git', 'decision': 'approved'},
+            {'id': 'git-force', 'program': 'git', 'args': ['push'], 'argsPattern': '--force', 'decision': 'rejected'}])
+    for argv0 in ('git', './git', '/tmp/evil/git', '/usr/bin/git'):
+        assert engine.analyze(f'{argv0} push --force origin')['decision'] == 'rejected', argv0
+
+
+# user-016: policy diff reports exactly the commands whose outcome changes.
+
+def test_policy_diff_matches_analyzing_under_both_policies(tmp_path, engine):
+    import io
+    old_rules = [{'id': 'ls', 'pattern': '^ls\\b', 'decision': 'approved'},
+                 {'id': 'git', 'program': 'git', 'decision': 'approved'},
+                 {'id': 'rm', 'pattern': '^rm\\b', 'decision': 'ask'}]
+    new_rules = [{'id': 'rm', 'pattern': '^rm\\b', 'decision': 'ask'},
+                 {'id': 'ls', 'pattern': '^ls\\b', 'decision': 'approved'},
+                 {'id': 'rm-rf', 'pattern': '^rm -rf\\b', 'decision': 'rejected'},
+                 {'id': 'git-push', 'program': 'git', 'args': ['push'], 'decision': 'ask'}]
+    old, new = tmp_path / 'old.json', tmp_path / 'new.json'
+    old.write_text(json.dumps({'rules': old_rules}))
+    new.write_text(json.dumps({'rules': new_rules}))
+    commands = ['ls', 'rm x', 'rm -rf /', 'git status', 'git push', 'ls && rm -rf x', 'cat f', 'ls "unclosed', 'rm x']
+    lines = [json.dumps({'command': c, 'id': i, 'actor': 'a'}) for i, c in enumerate(commands)] + ['', 'junk']
+    out = io.StringIO()
+    summary = engine.policy_diff(old, new, lines, out)
+
+    def outcome(path, command):
+        res = engine.analyze(command, engine.CompiledPolicy(engine.parse_policy(path.read_bytes())))
+        return res['decision'], set(res.get('matchedRuleIds', []))
+    expected = [i for i, c in enumerate(commands) if c != 'ls "unclosed' and outcome(old, c) != outcome(new, c)]
+    changes = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [c['id'] for c in changes] == expected == [2, 3, 4, 5]
+    assert changes[0]['old']['decision'] == 'ask' and changes[0]['new'] == {'decision': 'rejected',
+                                                                           'matchedRuleIds': ['rm', 'rm-rf']}
+    assert (summary['commands'], summary['changed'], summary['unparsable'], summary['invalidLines']) == (9, 4, 1, 1)
+    assert summary['transitions'] == {'ask->rejected': 2, 'approved->ask': 2}
+    assert (summary['rulesAdded'], summary['rulesRemoved']) == (2, 1)
+
+
+# user-017: a chain shares one deadline, and a timed-out segment takes its process group with it.
+
+def process_running(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rpartition(')')[2].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def test_chain_deadline_kills_the_process_group_and_skips_later_segments(tmp_path, engine, policy):
+    policy([{'id': 'sh', 'pattern': '^sh\\b', 'decision': 'approved'},
+            {'id': 'true', 'pattern': '^true$', 'decision': 'approved'}])
+    script = tmp_path / 'spawn.sh'
+    script.write_text('sleep 30 &\necho $!\nwait\n')
+    started = time.monotonic()
+    res = engine.execute(f'sh {script}; true', cwd=str(tmp_path), timeout=1)
+    assert time.monotonic() - started < 5
+    first, second = res['results']
+    assert (first['error'], second['error']) == ('chain_deadline_exceeded', 'chain_deadline_exceeded')
+    assert 'durationMs' not in second and first['remainingMs'] == 0
+    grandchild = int(first['stdout'])
+    deadline = time.monotonic() + 5
+    while process_running(grandchild) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not process_running(grandchild)
+
+
+def test_results_carry_elapsed_and_remaining_time(tmp_path, engine, policy):
+    policy([{'id': 'true', 'pattern': '^true$', 'decision': 'approved'}])
+    res = engine.execute('true; true', cwd=str(tmp_path), timeout=60)
+    assert res['ok'] and res['timeoutMs'] == 60000
+    first, second = res['results']
+    assert 0 <= first['elapsedMs'] <= second['elapsedMs'] <= res['elapsedMs']
+    assert first['elapsedMs'] + first['remainingMs'] == pytest.approx(60000, abs=1)
@@ -0,0 +1,58 @@
+"""Tests for scripts/run-cached.py."""
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+RUN_CACHED = pathlib.Path(__file__).resolve().parents[1] / 'scripts' / 'run-cached.py'
+
+SCRIPT = '''import sys
+
+
+def main():
+    print(__name__, sys.argv[1:])
+'''
+
+
+def run(*args, env=None):
+    return subprocess.run([sys.executable, str(RUN_CACHED), *args], capture_output=True, text=True,
+                          env=env, timeout=30)
+
+
+def test_runs_main_with_arguments_and_caches_bytecode(tmp_path):
+    script = tmp_path / 'my-tool.py'
+    script.write_text(SCRIPT)
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env.pop('PYTHONPYCACHEPREFIX', None)
+    proc = run(str(script), 'a', '--b', env=env)
+    assert proc.returncode == 0, proc.stderr
+    assert proc.stdout == "my_tool ['a', '--b']\n"
+    assert list((tmp_path / '__pycache__').glob('my-tool.*.pyc'))
+
+
+def test_read_only_script_dir_caches_under_xdg_cache_home(tmp_path):
+    if os.geteuid() == 0:
+        pytest.skip('root can write to read-only directories')
+    scripts = tmp_path / 'scripts'
+    scripts.mkdir()
+    (scripts / 'tool.py').write_text(SCRIPT)
+    scripts.chmod(0o555)
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache'))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    try:
+        proc = run(str(scripts / 'tool.py'), env=env)
+    finally:
+        scripts.chmod(0o755)
+    assert proc.returncode == 0, proc.stderr
+    assert list((tmp_path / 'cache' / 'op-and-chloe' / 'pycache').rglob('tool.*.pyc'))
+    assert not (scripts / '__pycache__').exists()
+
+
+def test_executable_entry_point():
+    assert os.access(RUN_CACHED, os.X_OK)
+    proc = subprocess.run([str(RUN_CACHED)], capture_output=True, text=True, timeout=30)
+    assert proc.returncode == 2
+    assert 'usage: run-cached.py SCRIPT' in proc.stderr
@@ -0,0 +1,437 @@
+"""Tests for scripts/worker/m365.py."""
+import http.server
+import importlib.util
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[2]
+M365 = ROOT / 'scripts' / 'worker' / 'm365.py'
+GRAPH_MOCK = ROOT / 'scripts' / 'bench' / 'graph-mock.py'
+
+
+def load_m365():
+    spec = importlib.util.spec_from_file_location('m365', M365)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope='module')
+def m365():
+    return load_m365()
+
+
+@pytest.fixture(scope='module')
+def graph_mock():
+    """A scripts/bench/graph-mock.py server; yields its {"url", "login"} and a stats() function."""
+    proc = subprocess.Popen([sys.executable, str(GRAPH_MOCK), '--latency', '0', '--limit', '50', '--messages', '30',
+                             '--attachment-size', '300000'], stdout=subprocess.PIPE, text=True)
+    try:
+        info = json.loads(proc.stdout.readline())
+        info['stats'] = lambda: json.loads(urllib.request.urlopen(info['login'] + '/_stats').read())
+        yield info
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+@pytest.fixture
+def mailbox(tmp_path, graph_mock, monkeypatch, capsys):
+    """A fresh m365 module pointed at graph_mock with its token, config and store under tmp_path.
+
+    Yields run(*argv) -> (exit status, list of stdout JSON lines).
+    """
+    module = load_m365()
+    config = tmp_path / 'o365-config.json'
+    config.write_text(json.dumps({'tenant_id': 't', 'client_id': 'c', 'user_email': 'user@example.com'}))
+    monkeypatch.setenv('M365_CONFIG_PATH', str(config))
+    monkeypatch.setenv('M365_AGENT_LOCAL', '1')
+    token = tmp_path / 'm365-token.json'
+    token.write_text(json.dumps({'access_token': 'AT', 'refresh_token': 'RT', 'expires_at': time.time() + 3600}))
+    monkeypatch.setattr(module, 'TOKEN_FILE', token)
+    monkeypatch.setattr(module, 'GRAPH_BASE', graph_mock['url'])
+    monkeypatch.setattr(module, 'LOGIN_BASE', graph_mock['login'])
+    monkeypatch.setattr(module, 'STORE_PATH', str(tmp_path / 'm365-store.sqlite'))
+
+    def run(*argv):
+        capsys.readouterr()
+        monkeypatch.setattr(sys, 'argv', ['m365', *argv])
+        code = 0
+        try:
+            module.main()
+        except SystemExit as e:
+            code = e.code or 0
+        return code, [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    run.module = module
+    yield run
+    store = getattr(module._local, 'store', None)
+    if store is not None:
+        store.close()
+
+
+@pytest.fixture
+def http_server():
+    """Start a local HTTP server answering from `routes` ({path: (status, headers)}, or a list of those
+    answered in turn); yields (port, routes, requests)."""
+    requests = []
+    routes = {}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append((self.headers.get('Host'), self.path, self.headers.get('Authorization')))
+            route = routes.get(self.path, (200, {}))
+            status, headers = route.pop(0) if isinstance(route, list) else route
+            body = b'{}'
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v.format(port=self.server.server_port))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_port, routes, requests
+    server.shutdown()
+    server.server_close()
+
+
+# user-018: redirects keep the bearer token on its host and are bounded.
+
+def test_redirect_to_another_host_drops_authorization(m365, http_server):
+    port, routes, requests = http_server
+    routes['/same'] = (302, {'Location': '/other'})
+    routes['/other'] = (302, {'Location': 'http://localhost:{port}/done'})
+    resp = m365.http_open('GET', f'http://127.0.0.1:{port}/same', headers={'Authorization': 'Bearer T'})
+    assert resp.status == 200
+    resp.read()
+    assert [(path, auth) for _, path, auth in requests] == [
+        ('/same', 'Bearer T'), ('/other', 'Bearer T'), ('/done', None)]
+
+
+def test_redirect_budget_exhausted_raises(m365, http_server):
+    port, routes, requests = http_server
+    routes['/loop'] = (302, {'Location': '/loop'})
+    with pytest.raises(urllib.error.HTTPError) as info:
+        m365.http_open('GET', f'http://127.0.0.1:{port}/loop', redirects=3)
+    assert info.value.code == 302
+    assert len(requests) == 4
+
+
+# user-019: paging sizes must be positive.
+
+@pytest.mark.parametrize('argv', [
+    ['mail', 'list', '--top', '-1'],
+    ['mail', 'list', '--top', '0'],
+    ['mail', 'list', '--limit', '0'],
+    ['mail', 'list', '--all', '--page-size', '-5'],
+    ['calendar', 'events', '--top', '-1'],
+    ['calendar', 'events', '--limit', '-2'],
+    ['calendar', 'events', '--page-size', 'x'],
+])
+def test_paging_sizes_reject_non_positive_values(m365, argv, capsys):
+    with pytest.raises(SystemExit) as info:
+        m365.build_parser().parse_args(argv)
+    assert info.value.code == 2
+    err = capsys.readouterr().err
+    assert 'must be at least 1' in err or 'invalid positive_int value' in err
+
+
+def test_paging_sizes_accept_positive_values(m365):
+    args = m365.build_parser().parse_args(['mail', 'list', '--top', '5', '--limit', '7', '--page-size', '3'])
+    assert (args.top, args.limit, args.page_size) == (5, 7, 3)
+
+
+# user-020: $batch items are retried once, and failed $batch POSTs not at all.
+
+def test_batch_retries_failed_items_once(m365, monkeypatch):
+    sent = []
+
+    def graph_batch(requests, token):
+        sent.append([r['id'] for r in requests])
+        return 200, {}, {r['id']: {'id': r['id'], 'status': 429 if r['id'] == '1' else 200,
+                                   'headers': {'Retry-After': '0'}, 'body': {'n': r['id']}} for r in requests}
+    monkeypatch.setattr(m365, 'graph_batch', graph_batch)
+    monkeypatch.setattr(m365, 'retry_delay', lambda headers, attempt: 0)
+    results = list(m365.graph_get_many(['/a', '/b', '/c'], 'T'))
+    assert sent == [['0', '1', '2'], ['1']]
+    assert [(i, status) for i, status, _ in results] == [(0, 200), (1, 429), (2, 200)]
+
+
+def test_failed_batch_post_is_not_retried_again(m365, monkeypatch):
+    sent = []
+
+    def graph_batch(requests, token):
+        sent.append([r['id'] for r in requests])
+        return 503, {'Retry-After': '0'}, {'error': {'code': 'ServiceUnavailable'}}
+    monkeypatch.setattr(m365, 'graph_batch', graph_batch)
+    monkeypatch.setattr(m365, 'retry_delay', lambda headers, attempt: 0)
+    results = list(m365.graph_get_many(['/a', '/b'], 'T'))
+    assert sent == [['0', '1']]
+    assert [(i, status) for i, status, _ in results] == [(0, 503), (1, 503)]
+
+
+# user-021: the store answers only explicit folders; plain `mail list` covers every folder, live.
+
+def test_mail_list_without_folder_lists_every_folder_live(mailbox, monkeypatch):
+    started = []
+    monkeypatch.setattr(mailbox.module, 'sync_in_background', started.append)
+    code, [out] = mailbox('mail', 'list', '--top', '20')
+    assert code == 0 and out['ok']
+    assert 'syncedAt' not in out
+    assert {item['id'].rpartition('-m')[0] for item in out['items']} == {'inbox', 'folder-1', 'folder-2'}
+    assert started == []
+    assert not pathlib.Path(mailbox.module.STORE_PATH).exists()
+
+
+def test_mail_list_folder_cold_store_answers_live_and_syncs_in_background(mailbox, monkeypatch):
+    started = []
+    monkeypatch.setattr(mailbox.module, 'sync_in_background', started.append)
+    code, [out] = mailbox('mail', 'list', '--folder', 'folder-1', '--top', '5')
+    assert code == 0 and 'syncedAt' not in out
+    assert [item['id'] for item in out['items']] == [f'folder-1-m{i}' for i in range(5)]
+    assert started == ['folder-1']
+
+
+def test_mail_list_folder_is_served_from_the_delta_store(mailbox, graph_mock):
+    code, [fresh] = mailbox('mail', 'list', '--folder', 'inbox', '--top', '5', '--fresh')
+    assert code == 0 and fresh['syncedAt']
+    assert [item['id'] for item in fresh['items']] == [f'inbox-m{i}' for i in range(5)]
+    before = graph_mock['stats']()['requests']
+    code, [cached] = mailbox('mail', 'list', '--folder', 'inbox', '--top', '5')
+    assert cached == fresh
+    assert graph_mock['stats']()['requests'] == before  # within M365_SYNC_MAX_AGE: no Graph request
+    code, lines = mailbox('mail', 'list', '--folder', 'inbox', '--all')
+    assert lines[-1]['done'] and lines[-1]['count'] == 30
+    assert os.stat(mailbox.module.STORE_PATH).st_mode & 0o777 == 0o600
+
+
+# user-022: throttled and transient Graph answers are retried, and a throttle slows every request.
+
+def test_graph_call_retries_throttled_and_transient_answers(m365, http_server, monkeypatch):
+    port, routes, requests = http_server
+    routes['/x'] = [(429, {'Retry-After': '0'}), (503, {'Retry-After': '0'}), (502, {}), (200, {})]
+    monkeypatch.setattr(m365, '_throttle', m365.Throttle(4, 16))
+    monkeypatch.setattr(m365, 'retry_delay', lambda headers, attempt: 0)
+    status, _, payload = m365.graph_call('GET', f'http://127.0.0.1:{port}/x', 'T')
+    assert (status, payload, len(requests)) == (200, {}, 4)
+    assert m365._throttle.limit < 4  # halved by the throttles, then raised by the success
+
+
+def test_graph_call_gives_up_after_its_retries(m365, http_server, monkeypatch):
+    port, routes, requests = http_server
+    routes['/x'] = (500, {})
+    monkeypatch.setattr(m365, '_throttle', m365.Throttle(4, 16))
+    monkeypatch.setattr(m365, 'retry_delay', lambda headers, attempt: 0)
+    monkeypatch.setattr(m365, 'GRAPH_RETRIES', 2)
+    assert m365.graph_call('GET', f'http://127.0.0.1:{port}/x', 'T')[0] == 500
+    assert len(requests) == 3
+
+
+def test_throttle_halves_once_per_round_and_holds_requests_back(m365):
+    throttle = m365.Throttle(8, 16)
+    first, second = throttle.acquire(), throttle.acquire()
+    throttle.backoff(first, 0.2)
+    throttle.backoff(second, 0.2)  # started before the cut: same round, no second cut
+    assert throttle.limit == 4
+    throttle.release(first, ok=False)
+    throttle.release(second, ok=False)
+    started = time.monotonic()
+    throttle.release(throttle.acquire())
+    assert time.monotonic() - started >= 0.15
+    assert 4 < throttle.limit < 5
+    assert m365.retry_delay({'retry-after': '7'}, 1) == 7 and m365.retry_delay({'Retry-After': '999'}, 1) == 60
+    assert 0 <= m365.retry_delay({}, 3) <= 4
+
+
+# user-023: the agent serves only callers with its settings, and a silent agent is bounded.
+
+def test_m365_env_covers_every_setting_a_command_reads(m365, monkeypatch):
+    for name in ('HOME', 'https_proxy', 'NO_PROXY', 'BW_SESSION', 'BITWARDENCLI_APPDATA_DIR', 'M365_STORE_PATH',
+                 'M365_AGENT_LOCAL', 'UNRELATED'):
+        monkeypatch.setenv(name, 'x')
+    env = m365.m365_env()
+    assert {'HOME', 'https_proxy', 'NO_PROXY', 'BW_SESSION', 'BITWARDENCLI_APPDATA_DIR', 'M365_STORE_PATH'} <= set(env)
+    assert 'M365_AGENT_LOCAL' not in env and 'UNRELATED' not in env
+
+
+@pytest.fixture
+def agent(tmp_path):
+    """Start `m365 agent` on a temporary socket with HOME=tmp_path; yields the socket path."""
+    sock = tmp_path / 'agent.sock'
+    env = dict(os.environ, HOME=str(tmp_path), M365_AGENT_SOCKET=str(sock))
+    proc = subprocess.Popen([sys.executable, str(M365), 'agent'], env=env, stdout=subprocess.PIPE, text=True)
+    try:
+        assert json.loads(proc.stdout.readline())['ok']
+        yield sock
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def test_agent_serves_callers_with_the_same_settings(m365, agent, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(m365, 'AGENT_SOCKET', agent)
+    monkeypatch.setenv('HOME', str(tmp_path))
+    assert m365.agent_call(['auth', 'status']) is not None
+    assert json.loads(capsys.readouterr().out)
+
+
+def test_agent_leaves_callers_with_other_settings_to_run_locally(m365, agent, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(m365, 'AGENT_SOCKET', agent)
+    for name, value in (('HOME', str(tmp_path / 'elsewhere')), ('https_proxy', 'http://proxy:3128')):
+        with monkeypatch.context() as m:
+            m.setenv('HOME', str(tmp_path))
+            m.setenv(name, value)
+            assert m365.agent_call(['auth', 'status']) is None
+    assert capsys.readouterr().out == ''
+
+
+@pytest.fixture
+def silent_agent(tmp_path, m365, monkeypatch):
+    """A stand-in agent that reads a request, sends the lines appended to the yielded list, then goes quiet."""
+    import socket
+    sock = tmp_path / 'silent.sock'
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(sock))
+    server.listen()
+    conns = []
+    lines = []
+
+    def serve():
+        conn, _ = server.accept()
+        conns.append(conn)
+        conn.recv(65536)
+        for line in lines:
+            conn.sendall(json.dumps(line).encode() + b'\n')
+
+    threading.Thread(target=serve, daemon=True).start()
+    monkeypatch.setattr(m365, 'AGENT_SOCKET', sock)
+    monkeypatch.setattr(m365, 'AGENT_TIMEOUT', 0.5)
+    yield lines
+    for conn in conns:
+        conn.close()
+    server.close()
+
+
+def test_silent_agent_falls_back_to_running_locally(m365, silent_agent):
+    started = time.monotonic()
+    assert m365.agent_call(['auth', 'status']) is None
+    assert time.monotonic() - started < 5
+
+
+def test_agent_silent_after_output_fails(m365, silent_agent, capsys):
+    silent_agent.append({'out': '{"ok": true}\n'})
+    with pytest.raises(SystemExit) as info:
+        m365.agent_call(['mail', 'list'])
+    assert info.value.code == 1
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == '{"ok": true}'
+    assert json.loads(out[1])['error'] == 'm365_agent_timeout'
+
+
+# user-024: token refresh is single-flight, and an early refresh never loses a valid token.
+
+def test_concurrent_expired_token_is_refreshed_once(mailbox, graph_mock):
+    module = mailbox.module
+    module.TOKEN_FILE.write_text(json.dumps({'access_token': 'old', 'refresh_token': 'RT', 'expires_at': 0}))
+    before = graph_mock['stats']()['tokenRequests']
+    cfg = module.get_o365_config()
+    tokens = []
+    threads = [threading.Thread(target=lambda: tokens.append(module.ensure_access_token(cfg))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert graph_mock['stats']()['tokenRequests'] == before + 1
+    assert len(tokens) == 8 and len(set(tokens)) == 1 and tokens[0] != 'old'
+
+
+def test_early_refresh_keeps_the_valid_token_when_the_endpoint_is_unreachable(mailbox, monkeypatch):
+    module = mailbox.module
+    monkeypatch.setattr(module, 'TOKEN_REFRESH_AHEAD', 7200)
+    monkeypatch.setattr(module, 'LOGIN_BASE', 'http://127.0.0.1:9')
+    assert module.ensure_access_token(module.get_o365_config()) == 'AT'
+
+
+# user-025: attachments stream to disk under unique names and resume from a .part.
+
+def graph_value(graph_mock, path):
+    return urllib.request.urlopen(urllib.request.Request(graph_mock['url'] + path, headers={'Authorization': 'Bearer AT'})).read()
+
+
+def attachment_path(message, n):
+    return f'/me/messages/{message}/attachments/{message}-a{n}/$value'
+
+
+def test_mail_download_saves_every_attachment_under_a_unique_name(mailbox, graph_mock, tmp_path):
+    out = tmp_path / 'out'
+    code, [result] = mailbox('mail', 'download', '--id', 'inbox-m0', '--dir', str(out))
+    assert code == 0 and result['ok']
+    assert [(f['name'], pathlib.Path(f['path']).name if 'path' in f else f['skipped']) for f in result['files']] == [
+        ('Shared link', 'reference_attachment'), ('report.pdf', 'report.pdf'), ('report.pdf', 'report (2).pdf'),
+        ('Forwarded message', 'Forwarded message.eml')]
+    for n, name in enumerate(['report.pdf', 'report (2).pdf', 'Forwarded message.eml']):
+        assert (out / name).read_bytes() == graph_value(graph_mock, attachment_path('inbox-m0', n))
+    assert sorted(p.name for p in out.iterdir() if not p.name.startswith('.')) == [
+        'Forwarded message.eml', 'report (2).pdf', 'report.pdf']
+
+    before = graph_mock['stats']()['requests']
+    code, [again] = mailbox('mail', 'download', '--id', 'inbox-m0', '--dir', str(out))
+    assert code == 0
+    assert graph_mock['stats']()['requests'] == before + 1  # the attachment list only
+    assert [(f.get('path'), f.get('existing')) for f in again['files']] == [
+        (f.get('path'), True if 'path' in f else None) for f in result['files']]
+
+    code, [other] = mailbox('mail', 'download', '--id', 'inbox-m5', '--dir', str(out))
+    assert [pathlib.Path(f['path']).name for f in other['files'] if 'path' in f] == [
+        'report (3).pdf', 'report (4).pdf', 'Forwarded message (2).eml']
+
+
+def test_mail_download_resumes_a_partial_file_with_a_range_request(mailbox, graph_mock, tmp_path):
+    out = tmp_path / 'out'
+    mailbox('mail', 'download', '--id', 'inbox-m10', '--dir', str(out), '--attachment', 'inbox-m10-a0')
+    report = out / 'report.pdf'
+    data = report.read_bytes()
+    part = out / 'report.pdf.part'
+    part.write_bytes(data[:100000])
+    report.unlink()
+    before = graph_mock['stats']()['rangeRequests']
+    code, [result] = mailbox('mail', 'download', '--id', 'inbox-m10', '--dir', str(out), '--attachment', 'inbox-m10-a0')
+    assert code == 0
+    assert result['files'][0]['resumedFrom'] == 100000 and result['files'][0]['bytes'] == len(data)
+    assert graph_mock['stats']()['rangeRequests'] == before + 1
+    assert report.read_bytes() == data and not part.exists()
+
+
+def test_mail_download_restarts_a_partial_file_whose_source_changed(mailbox, graph_mock, tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+    source = attachment_path('inbox-m15', 0)
+    (out / 'report.pdf.part').write_bytes(b'x' * 1000)
+    (out / '.report.pdf.m365').write_text(json.dumps({'source': source, 'etag': '"stale"', 'length': 300000}))
+    code, [result] = mailbox('mail', 'download', '--id', 'inbox-m15', '--dir', str(out), '--attachment', 'inbox-m15-a0')
+    assert code == 0 and result['files'][0]['resumedFrom'] == 0
+    assert (out / 'report.pdf').read_bytes() == graph_value(graph_mock, source)
+
+
+def test_mail_download_leaves_files_it_did_not_write_alone(mailbox, tmp_path):
+    out = tmp_path / 'out'
+    out.mkdir()
+    (out / 'report.pdf').write_bytes(b'mine')
+    (out / 'report (2).pdf.part').write_bytes(b'also mine')
+    code, [result] = mailbox('mail', 'download', '--id', 'inbox-m20', '--dir', str(out), '--attachment', 'inbox-m20-a0')
+    assert code == 0 and pathlib.Path(result['files'][0]['path']).name == 'report (3).pdf'
+    assert (out / 'report.pdf').read_bytes() == b'mine'
+    assert (out / 'report (2).pdf.part').read_bytes() == b'also mine'